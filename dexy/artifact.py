@@ -2,11 +2,13 @@ from dexy.constants import Constants
 from dexy.version import Version
 from ordereddict import OrderedDict
 import codecs
+import dexy.artifact_cache
+import dexy.blob_store
 import dexy.commands
+import dexy.hashing
 import dexy.helpers
 import dexy.introspect
-import hashlib
-import inspect
+import dexy.source_hashes
 import json
 import logging
 import os
@@ -15,12 +17,22 @@ import stat
 import sys
 import time
 import traceback
-import zlib
 
 class Artifact(object):
     HASH_WHITELIST = Constants.ARTIFACT_HASH_WHITELIST
+    # Setting any of these attributes invalidates the cached hash dict.
+    HASH_ATTRS = frozenset(HASH_WHITELIST + ['_inputs', 'input_data_hashes'])
     MAX_DATA_DICT_DECIMALS = 5
     MAX_DATA_DICT_LENGTH = 10 ** MAX_DATA_DICT_DECIMALS
+    MAX_HASHABLE_VALUE_LENGTH = 50
+    HASH_CHUNK_SIZE = 1024 * 1024
+
+    # Replaced by the controller with a cache persisted in the logs dir.
+    source_hash_cache = dexy.source_hashes.SourceHashCache()
+
+    # Replaced by the controller with the store for its artifacts dir.
+    blob_store = dexy.blob_store.BlobStore(Constants.DEFAULT_ADIR)
+
     META_ATTRS = [
         'additional_inputs',
         'binary_input',
@@ -67,6 +79,7 @@ class Artifact(object):
         if not hasattr(self.__class__, 'FILTERS'):
             self.__class__.FILTERS = dexy.introspect.filters(Constants.NULL_LOGGER)
 
+        self._hash_dict = None
         self._inputs = {}
         self.additional = None
         self.additional_inputs = []
@@ -81,7 +94,10 @@ class Artifact(object):
         self.controller_args['globals'] = {}
         self.created_by = None
         self.ctime = None
-        self.data_dict = OrderedDict()
+        self._data_dict = OrderedDict()
+        self.data_hashes = None
+        self.deferred_output = False
+        self.deferred_source = False
         self.dexy_version = Version.VERSION
         self.dirty = False
         self.document_key = None
@@ -93,6 +109,7 @@ class Artifact(object):
         self.initial = None
         self.inode = None
         self.input_data_dict = OrderedDict()
+        self.input_data_hashes = None
         self.is_last = False
         self.key = None
         self.log = logging.getLogger()
@@ -105,6 +122,67 @@ class Artifact(object):
         self.stdout = None
         self.virtual_docs = None
 
+    def __setattr__(self, name, value):
+        if name in self.HASH_ATTRS:
+            self.__dict__['_hash_dict'] = None
+        object.__setattr__(self, name, value)
+
+    def get_data_dict(self):
+        if self.deferred_source:
+            self.load_source()
+        elif self.deferred_output:
+            self.load_deferred_output()
+        return self._data_dict
+
+    def set_data_dict(self, data_dict):
+        self.deferred_source = False
+        self._data_dict = data_dict
+
+    data_dict = property(get_data_dict, set_data_dict)
+
+    def load_source(self):
+        """
+        Reads the contents of an initial artifact whose source file was
+        unchanged, so it was not read during setup.
+        """
+        self.deferred_source = False
+        self.set_data(self.doc.initial_artifact_data())
+
+    def unload_output(self):
+        """
+        Drops the contents of a complete artifact whose output is cached in
+        the artifacts directory, to be loaded from there again when needed.
+        Returns whether it did.
+        """
+        if not self.is_complete() or self.deferred_source or not self.is_output_cached():
+            return False
+        self._data_dict = OrderedDict()
+        if self.__dict__.has_key('binary_data'):
+            del self.binary_data
+        self.deferred_output = True
+        return True
+
+    def load_deferred_output(self):
+        self.deferred_output = False
+        self.load_output()
+        # The contents are in memory again, so count them towards the limit.
+        cache = getattr(self.__class__, 'retrieved_artifacts', None)
+        if cache is not None and cache.has_key(self.hashstring):
+            cache.account(self.hashstring, self)
+
+    def section_index(self):
+        """
+        Returns a dict whose keys are the sections of output. Loads the output
+        here, subclasses which store an index of the sections read that.
+        """
+        return self.data_dict
+
+    def load_section(self, key):
+        """
+        Returns one section of output. Subclasses may read just that section.
+        """
+        return self.data_dict[key]
+
     def keys(self):
         return self.data_dict.keys()
 
@@ -120,6 +198,8 @@ class Artifact(object):
                 # Change from write mode to read mode...
                 self.setup_kv_storage()
             return self._storage.retrieve(key)
+        elif self.deferred_output and not self.binary_output and self.section_index().has_key(key):
+            return self.load_section(key)
         elif self.data_dict.has_key(key):
             return self.data_dict[key]
         elif hasattr(self, key):
@@ -144,22 +224,24 @@ class Artifact(object):
     @classmethod
     def retrieve(klass, hashstring, hashfunction='md5'):
         if not hasattr(klass, 'retrieved_artifacts'):
-            klass.retrieved_artifacts = {}
-        if klass.retrieved_artifacts.has_key(hashstring):
-            return klass.retrieved_artifacts[hashstring]
-        else:
+            klass.retrieved_artifacts = dexy.artifact_cache.ArtifactCache()
+        artifact = klass.retrieved_artifacts.get(hashstring)
+        if artifact is None:
             artifact = klass()
             artifact.hashstring = hashstring
             artifact.hashfunction = hashfunction
             artifact.load()
-            klass.retrieved_artifacts[hashstring] = artifact
-            return artifact
+            klass.retrieved_artifacts.add(hashstring, artifact)
+        return artifact
 
     def load(self):
         self.load_meta()
-        self.load_input()
+        if not self.is_complete():
+            # Input is only needed if we have to run the filter.
+            self.load_input()
         if self.is_complete() and not self.is_loaded():
-            self.load_output()
+            # Output is read from the artifacts dir the first time it's used.
+            self.deferred_output = True
 
     def load_inputs(self):
         for a in self.inputs():
@@ -173,6 +255,10 @@ class Artifact(object):
         else:
             self.save_meta()
             if self.is_complete() and not self.is_output_cached():
+                if self.deferred_source and not self.binary_output:
+                    # Binary sources are copied from the source file and
+                    # never need to be read into memory.
+                    self.load_source()
                 try:
                     self.save_output()
                 except IOError as e:
@@ -220,49 +306,53 @@ class Artifact(object):
             self.final = False
 
         if not self.doc.virtual:
+            # Sub-second times, so that a file saved twice within a second,
+            # as can happen while 'dexy watch' is running, gets a new hash.
             stat_info = os.stat(self.name)
-            self.ctime = stat_info[stat.ST_CTIME]
-            self.mtime = stat_info[stat.ST_MTIME]
+            self.ctime = stat_info.st_ctime
+            self.mtime = stat_info.st_mtime
             self.inode = stat_info[stat.ST_INO]
 
-        self.set_data(self.doc.initial_artifact_data())
+            # If the file is unchanged since the last run we already have its
+            # hashes, otherwise hash it without reading it all into memory.
+            stat_index = self.doc.controller.stat_index
+            self.data_hashes = stat_index.lookup(self.name, stat_info, self.hashfunction, self.binary_input)
+            if not self.data_hashes:
+                self.data_hashes = self.hashable_file(self.name)
+                stat_index.update(self.name, stat_info, self.hashfunction, self.binary_input, self.data_hashes)
+
+            # Don't read the file unless its contents are needed.
+            self.deferred_source = True
+        else:
+            self.set_data(self.doc.initial_artifact_data())
+            self.data_hashes = self.hashable_dict(self.data_dict)
 
-        # TODO remove?
-        if not self.data_dict:
-            raise Exception("no data dict!")
-        elif len(self.data_dict) == 0:
-            raise Exception("data dict has len 0!")
+            # TODO remove?
+            if not self.data_dict:
+                raise Exception("no data dict!")
+            elif len(self.data_dict) == 0:
+                raise Exception("data dict has len 0!")
 
         self.state = 'complete'
 
     def setup_from_filter_class(self):
-        # cache filter class source code so it only has to be calculated once
-        filter_class_source_const = "SOURCE_CODE_%s" % self.filter_class.__name__
-        if not hasattr(self.filter_class, filter_class_source_const):
-            # get source code of this filter class + all parent filter classes.
-            source = ""
-            klass = self.filter_class
-
-            # get source code from filter class and all parent classes
-            while klass != dexy.dexy_filter.DexyFilter:
-                source += inspect.getsource(klass)
-                klass = klass.__base__
-
-            # and then get source code of DexyFilter class
-            source += inspect.getsource(dexy.dexy_filter.DexyFilter)
-
-            filter_class_source_hash = self.compute_hash(source)
-            setattr(self.filter_class, filter_class_source_const, filter_class_source_hash)
-            assert filter_class_source_hash == getattr(self.filter_class, filter_class_source_const)
-            self.log.debug("Source code hash for %s is %s" % (self.filter_class.__name__, filter_class_source_hash))
-
-        if not hasattr(self.filter_class, 'VERSION'):
+        # source code of this filter class, all parent filter classes and DexyFilter
+        classes = [self.filter_class]
+        while classes[-1] != dexy.dexy_filter.DexyFilter:
+            classes.append(classes[-1].__base__)
+        filter_class_source_hash = self.source_hash(classes)
+        self.log.debug("Source code hash for %s is %s" % (self.filter_class.__name__, filter_class_source_hash))
+
+        if hasattr(self.filter_class, 'VERSION'):
+            filter_version = self.filter_class.VERSION
+        else:
+            # Not stored on the class, which outlives a run in 'dexy watch'.
+            # The version cache makes repeated lookups cheap.
             filter_version = self.filter_class.version(self.log)
-            self.filter_class.VERSION = filter_version
 
         self.filter_name = self.filter_class.__name__
-        self.filter_source = getattr(self.filter_class, filter_class_source_const)
-        self.filter_version = self.filter_class.VERSION
+        self.filter_source = filter_class_source_hash
+        self.filter_version = filter_version
 
         if self.final is None:
             self.final = self.filter_class.FINAL
@@ -285,7 +375,12 @@ class Artifact(object):
                     self.add_input(kk, aa)
 
         self.binary_input = previous_artifact.binary_output
-        self.input_data_dict = previous_artifact.data_dict
+        if previous_artifact.deferred_source:
+            # Input will be loaded from previous artifact's output if needed.
+            self.input_data_hashes = previous_artifact.data_hashes
+        else:
+            self.input_data_dict = previous_artifact.data_dict
+            self.input_data_hashes = previous_artifact.data_hashes
         self.input_ext = previous_artifact.ext
         self.previous_artifact_hashstring = previous_artifact.hashstring
         self.previous_artifact_filename = previous_artifact.filename()
@@ -294,7 +389,7 @@ class Artifact(object):
         self.previous_long_canonical_filename = previous_artifact.long_canonical_filename()
         self.previous_websafe_key = previous_artifact.websafe_key()
 
-        # The JSON output of previous artifact
+        # The section index of previous artifact's output
         if not previous_artifact.binary_output:
             self.previous_cached_output_filepath = previous_artifact.cached_output_filepath()
 
@@ -394,7 +489,12 @@ class Artifact(object):
             filter_instance.artifact = self
             filter_instance.log = self.log
 
+            # The output file may be linked to a blob shared with other
+            # artifacts, so it must not be written to in place.
+            dexy.blob_store.release(self.filepath())
+
             # Make sure previous artifact is loaded.
+            self.load_input()
             if not self.binary_input and len(self.input_text()) == 0:
                 f = open(self.previous_artifact_filepath, "rb")
                 self.data_dict['1'] = f.read()
@@ -441,6 +541,11 @@ class Artifact(object):
             else:
                 raise Exception("data neither in memory nor on disk")
 
+            if self.binary_output and self.is_canonical_output_cached():
+                self.output_hash = self.compute_file_hash(self.filepath())
+                if self.output_may_be_shared():
+                    self.blob_store.add(self.filepath(), self.output_hash)
+
             self.logstream = self.doc.logstream.getvalue()
             self.state = 'complete'
             self.source = 'run'
@@ -490,6 +595,7 @@ class Artifact(object):
 
     def add_input(self, key, artifact):
         self._inputs[key] = artifact
+        self._hash_dict = None
         self.additional_inputs.append(artifact.hashstring)
 
     def inputs(self):
@@ -512,49 +618,59 @@ class Artifact(object):
     def is_loaded(self):
         return hasattr(self, 'data_dict') and len(self.data_dict) > 0
 
+    def hasher(self):
+        """
+        Returns a new hash object for self.hashfunction.
+        """
+        return dexy.hashing.new(self.hashfunction)
+
     def compute_hash(self, text):
-        unicode_text = None
+        if type(text) in [dict, list]:
+            text = json.dumps(text)
 
         if type(text) == unicode:
-            unicode_text = text
-        elif type(text) in [dict, list]:
-            unicode_text = json.dumps(text)
-        elif self.binary_input:
-            pass
-        else:
-            unicode_text = unicode(text, encoding="utf-8")
-
-        if unicode_text:
-            text = unicode_text.encode("utf-8")
-
-        if self.hashfunction == 'md5':
-            h = hashlib.md5(text).hexdigest()
-
-        elif self.hashfunction == 'sha1':
-            h = hashlib.sha1(text).hexdigest()
-
-        elif self.hashfunction == 'sha224':
-            h = hashlib.sha224(text).hexdigest()
+            text = text.encode("utf-8")
 
-        elif self.hashfunction == 'sha256':
-            h = hashlib.sha256(text).hexdigest()
+        h = self.hasher()
+        h.update(text)
+        return h.hexdigest()
 
-        elif self.hashfunction == 'sha384':
-            h = hashlib.sha384(text).hexdigest()
-
-        elif self.hashfunction == 'sha512':
-            h = hashlib.sha512(text).hexdigest()
-
-        elif self.hashfunction == 'crc32':
-            h = str(zlib.crc32(text) & 0xffffffff)
+    def source_hash(self, classes):
+        """
+        Returns the hash of the source code of classes, from the source hash
+        cache if the files defining them haven't changed.
+        """
+        return self.source_hash_cache.source_hash(classes, self.hashfunction, self.compute_hash)
 
-        elif self.hashfunction == 'adler32':
-            h = str(zlib.adler32(text) & 0xffffffff)
+    def output_may_be_shared(self):
+        """
+        Returns whether the output file may be linked to a blob which other
+        artifacts share. Filters copy files into virtual and additional
+        artifacts in place, so those always have a file of their own.
+        """
+        return not (getattr(self, 'virtual', False) or self.additional)
 
+    def copy_output_from(self, filepath):
+        """
+        Makes the output file a copy of filepath, which is only physically
+        copied if no other artifact has the same contents.
+        """
+        if self.output_may_be_shared():
+            self.blob_store.copy(filepath, self.filepath(), self.compute_file_hash(filepath))
         else:
-            raise Exception("unexpected hash function %s" % self.hashfunction)
+            dexy.blob_store.release(self.filepath())
+            dexy.blob_store.copy_data(filepath, self.filepath())
 
-        return h
+    def compute_file_hash(self, filepath):
+        """
+        Returns the hash of the contents of filepath, which is read in chunks
+        so large files are hashed without loading them into memory.
+        """
+        h = self.hasher()
+        with open(filepath, "rb") as f:
+            for chunk in iter(lambda: f.read(self.HASH_CHUNK_SIZE), ""):
+                h.update(chunk)
+        return h.hexdigest()
 
     def input_hashes(self):
         """
@@ -566,12 +682,32 @@ class Artifact(object):
         """
         Calculate and cache the elements used to compute the hashstring
         """
-        if not hasattr(self.__class__, 'SOURCE_CODE'):
-            artifact_class_source = inspect.getsource(self.__class__)
-            artifact_py_source = inspect.getsource(Artifact)
-            self.__class__.SOURCE_CODE = self.compute_hash(artifact_class_source + artifact_py_source)
+        if self._hash_dict is None:
+            hash_dict = self.calculate_hash_dict()
+            self.__dict__['_hash_dict'] = hash_dict
+            self.__dict__['_hash_data'] = str(hash_dict)
+            self.__dict__['_hash_dict_json'] = None
+        return self._hash_dict
+
+    def hash_data(self):
+        """
+        Returns the serialized hash dict from which the hashstring is computed.
+        """
+        self.hash_dict()
+        return self._hash_data
 
-        self.artifact_class_source = self.__class__.SOURCE_CODE
+    def hash_dict_json(self):
+        """
+        Returns a copy of the hash dict with dict values serialized as JSON.
+        """
+        hash_dict = self.hash_dict()
+        if self._hash_dict_json is None:
+            to_json = lambda v: isinstance(v, OrderedDict) and json.dumps(v) or v
+            self.__dict__['_hash_dict_json'] = dict((k, to_json(v)) for k, v in hash_dict.iteritems())
+        return self._hash_dict_json
+
+    def calculate_hash_dict(self):
+        self.artifact_class_source = self.source_hash([self.__class__, Artifact])
 
         if self.dirty:
             self.dirty_string = time.gmtime()
@@ -581,37 +717,59 @@ class Artifact(object):
         hash_dict['inputs'] = self.input_hashes()
 
         for k in self.HASH_WHITELIST:
-            if self.__dict__.has_key(k):
+            if k == 'input_data_dict' and self.input_data_hashes is not None:
+                # Already hashed by the previous artifact.
+                hash_dict[k] = self.input_data_hashes
+            elif self.__dict__.has_key(k):
                 v = self.__dict__[k]
                 if hasattr(v, 'items'):
-                    hash_v = OrderedDict()
-                    for k1 in sorted(v.keys()):
-                        v1 = v[k1]
-                        try:
-                            if len(str(v1)) > 50:
-                                raise Exception()
-                            json.dumps(v1)
-                            hash_v[str(k1)] = v1
-                        except Exception:
-                            # Use a hash if we will have problems saving to JSON
-                            # or if the data is large (don't want to clutter up the DB,
-                            # makes it harder to spot differences)
-                            hash_v[str(k1)] = self.compute_hash(v1)
+                    hash_v = self.hashable_dict(v)
                 else:
                     hash_v = str(v)
                 hash_dict[str(k)] = hash_v
         return hash_dict
 
+    def hashable_file(self, filepath):
+        """
+        Returns the same dict as hashable_dict would for a data dict holding
+        the contents of filepath, without reading large files into memory.
+        """
+        if os.path.getsize(filepath) > self.MAX_HASHABLE_VALUE_LENGTH:
+            return OrderedDict([('1', self.compute_file_hash(filepath))])
+        else:
+            with open(filepath, "rb") as f:
+                return self.hashable_dict({'1' : f.read()})
+
+    def hashable_dict(self, d):
+        """
+        Returns a copy of d, sorted by key, in which long values or values
+        which can't be serialized to JSON are replaced by their hashes.
+        """
+        hash_v = OrderedDict()
+        for k1 in sorted(d.keys()):
+            v1 = d[k1]
+            try:
+                if len(str(v1)) > self.MAX_HASHABLE_VALUE_LENGTH:
+                    raise Exception()
+                json.dumps(v1)
+                hash_v[str(k1)] = v1
+            except Exception:
+                # Use a hash if we will have problems saving to JSON
+                # or if the data is large (don't want to clutter up the DB,
+                # makes it harder to spot differences)
+                hash_v[str(k1)] = self.compute_hash(v1)
+        return hash_v
+
     def set_hashstring(self):
         if hasattr(self, 'hashstring'):
             raise Exception("setting hashstring twice")
 
-        hash_data = str(self.hash_dict())
+        hash_data = self.hash_data()
         self.hashstring = self.compute_hash(hash_data)
 
         try:
             original_document_key = self.document_key
-            if not self.is_loaded():
+            if not self.deferred_source and not self.is_loaded():
                 self.load()
             self.document_key = original_document_key
         except AttributeError as e:
@@ -651,7 +809,9 @@ class Artifact(object):
             raise Exception("can't call output unless complete!")
 
         if self.binary_output:
-            if not hasattr(self, 'binary_data'):
+            if self.deferred_output:
+                self.load_deferred_output()
+            elif not hasattr(self, 'binary_data'):
                 self.load_output()
             return self.binary_data
         else:
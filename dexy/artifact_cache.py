@@ -0,0 +1,138 @@
+"""
+The cache of artifacts loaded by Artifact.retrieve. Every retrieved artifact's
+metadata stays in memory, but the contents of complete artifacts are dropped,
+least recently used first, once they add up to more than a set number of
+bytes. Dropped contents are read from the artifacts directory again if they
+are needed. The inputs of a retrieved artifact are proxies, so an artifact is
+only loaded once something about it other than its hashstring is used.
+"""
+from dexy.constants import Constants
+from ordereddict import OrderedDict
+
+def payload_size(artifact):
+    """
+    Returns the number of bytes of contents artifact holds in memory.
+    """
+    size = 0
+    if not artifact.deferred_output:
+        for v in artifact._data_dict.itervalues():
+            if v is not None:
+                size += len(v)
+        if artifact.__dict__.has_key('binary_data'):
+            size += len(artifact.binary_data)
+    return size
+
+class ArtifactCache(object):
+    """
+    Maps hashstrings to retrieved artifacts. Keeps the hashstrings of
+    artifacts holding contents in least recently used order along with the
+    size of their contents, and counts hits, misses and evictions.
+    """
+    def __init__(self, max_bytes=Constants.DEFAULT_ARTIFACT_CACHE_MB * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.artifacts = {}
+        self.payloads = OrderedDict()
+        self.payload_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def has_key(self, hashstring):
+        return self.artifacts.has_key(hashstring)
+
+    def __contains__(self, hashstring):
+        return self.artifacts.has_key(hashstring)
+
+    def __len__(self):
+        return len(self.artifacts)
+
+    def get(self, hashstring):
+        """
+        Returns the artifact with this hashstring, or None if it hasn't been
+        retrieved before.
+        """
+        artifact = self.artifacts.get(hashstring)
+        if artifact is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.account(hashstring, artifact)
+        return artifact
+
+    def add(self, hashstring, artifact):
+        self.artifacts[hashstring] = artifact
+        self.account(hashstring, artifact)
+
+    def account(self, hashstring, artifact):
+        """
+        Records the size of artifact's contents and marks it most recently
+        used, then evicts the contents of other artifacts if there are too
+        many bytes in memory.
+        """
+        if self.payloads.has_key(hashstring):
+            self.payload_bytes -= self.payloads.pop(hashstring)
+
+        size = payload_size(artifact)
+        if size > 0:
+            self.payloads[hashstring] = size
+            self.payload_bytes += size
+        self.evict(keep=hashstring)
+
+    def evict(self, keep=None):
+        for hashstring in self.payloads.keys():
+            if self.payload_bytes <= self.max_bytes:
+                break
+            elif hashstring == keep:
+                continue
+
+            artifact = self.artifacts[hashstring]
+            if artifact.unload_output():
+                self.payload_bytes -= self.payloads.pop(hashstring)
+                self.evictions += 1
+
+    def stats(self):
+        return {
+            'artifacts' : len(self.artifacts),
+            'payload_bytes' : self.payload_bytes,
+            'max_bytes' : self.max_bytes,
+            'hits' : self.hits,
+            'misses' : self.misses,
+            'evictions' : self.evictions
+        }
+
+class ArtifactProxy(object):
+    """
+    Stands in for the artifact with hashstring, which is retrieved using
+    artifact_class the first time any other attribute is used. Attributes set
+    on the proxy are set on the artifact.
+    """
+    def __init__(self, artifact_class, hashstring):
+        self.__dict__['artifact_class'] = artifact_class
+        self.__dict__['hashstring'] = hashstring
+        self.__dict__['artifact'] = None
+
+    # So isinstance works without retrieving the artifact.
+    __class__ = property(lambda self: self.artifact_class)
+
+    def retrieved(self):
+        if self.artifact is None:
+            self.__dict__['artifact'] = self.artifact_class.retrieve(self.hashstring)
+        return self.artifact
+
+    def is_retrieved(self):
+        return self.artifact is not None
+
+    def __getattr__(self, name):
+        return getattr(self.retrieved(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self.retrieved(), name, value)
+
+    def __getitem__(self, key):
+        return self.retrieved()[key]
+
+    def __unicode__(self):
+        return unicode(self.retrieved())
+
+    def __repr__(self):
+        return "<ArtifactProxy %s>" % self.hashstring
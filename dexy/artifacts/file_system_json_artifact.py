@@ -1,6 +1,9 @@
 from dexy.artifact import Artifact
+from dexy.artifact_cache import ArtifactProxy
 from ordereddict import OrderedDict
 import codecs
+import dexy.blob_store
+import dexy.introspect
 import json
 import os
 
@@ -75,16 +78,17 @@ class FileSystemJsonArtifact(Artifact):
     def load_meta(self):
         m = self.read_dict_from_file(self.meta_filepath())
 
-        self._inputs = dict((k, self.__class__.retrieve(h)) for (k, h) in m.pop('inputs').iteritems())
+        # Inputs are only retrieved if they are used.
+        self._inputs = dict((k, ArtifactProxy(self.__class__, h)) for (k, h) in m.pop('inputs').iteritems())
 
         for k in m.pop('additional_inputs'):
-            self._inputs[k] = self.__class__.retrieve(k)
+            self._inputs[k] = ArtifactProxy(self.__class__, k)
 
         for k, v in m.iteritems():
             setattr(self, k, v)
 
         if hasattr(self, "filter_name") and not hasattr(self, "filter_class"):
-            self.filter_class = [k for n,k in self.FILTERS.iteritems() if k.__name__ == self.filter_name][0]
+            self.filter_class = dexy.introspect.get_filter_by_name(self.filter_name, self.FILTERS)
 
     # Input
     def load_input(self):
@@ -108,12 +112,14 @@ class FileSystemJsonArtifact(Artifact):
             #no previous cached output, can't load
             pass
         else:
-            with open(self.previous_cached_output_filepath, "rb") as f:
-                self.input_data_dict = self.convert_numbered_dict_to_ordered_dict(json.load(f))
+            self.input_data_dict = self.read_sections(self.previous_artifact_filepath, self.previous_cached_output_filepath)
 
     # Output
+    # The output of a text artifact is stored once, in its canonical file,
+    # along with an index of where each section of its data dict starts and
+    # how many bytes long it is.
     def cached_output_filename(self):
-        return "%s-output.json" % (self.hashstring)
+        return "%s-sections.json" % (self.hashstring)
 
     def cached_output_filepath(self):
         return os.path.join(self.artifacts_dir, self.cached_output_filename())
@@ -123,20 +129,65 @@ class FileSystemJsonArtifact(Artifact):
         if self.binary_output:
             return self.is_canonical_output_cached()
         else:
-            return self.is_json_output_cached() and self.is_canonical_output_cached()
+            return self.is_section_index_cached() and self.is_canonical_output_cached()
 
-    def is_json_output_cached(self):
-        fp = self.cached_output_filepath()
-        return os.path.isfile(fp) and (os.path.getsize(fp) > 0)
+    def is_section_index_cached(self):
+        return os.path.isfile(self.cached_output_filepath())
 
     def is_canonical_output_cached(self):
         fp = self.filepath()
         return os.path.isfile(fp) and (os.path.getsize(fp) > 0)
 
+    def write_sections(self, data_dict, filepath, index_filepath):
+        """
+        Writes the sections of data_dict, encoded as utf-8, one after another
+        to filepath and a list of [name, offset, length] for each section to
+        index_filepath.
+        """
+        index = []
+        offset = 0
+        with open(filepath, "wb") as f:
+            for k, v in data_dict.iteritems():
+                data = self.convert_if_not_unicode(v).encode("utf-8")
+                f.write(data)
+                index.append(["%s" % k, offset, len(data)])
+                offset += len(data)
+        self.write_dict_to_file(index, index_filepath)
+
+    def read_sections(self, filepath, index_filepath):
+        """
+        Returns an OrderedDict of the sections written by write_sections.
+        """
+        with open(filepath, "rb") as f:
+            data = f.read()
+        sections = OrderedDict()
+        for k, offset, length in self.read_dict_from_file(index_filepath):
+            sections[k] = data[offset:offset+length].decode("utf-8")
+        return sections
+
+    def section_index(self):
+        """
+        Returns a dict of the offset and length of each section of output.
+        """
+        if not hasattr(self, '_section_index'):
+            index = self.read_dict_from_file(self.cached_output_filepath())
+            self._section_index = dict((k, (offset, length)) for k, offset, length in index)
+        return self._section_index
+
+    def load_section(self, key):
+        """
+        Reads one section of output without reading the others.
+        """
+        offset, length = self.section_index()[key]
+        with open(self.filepath(), "rb") as f:
+            f.seek(offset)
+            return f.read(length).decode("utf-8")
+
     def save_output(self):
         if not self.is_complete():
             raise Exception("should not be calling save_output unless artifact is complete")
         if not self.binary_output:
+            dexy.blob_store.release(self.filepath())
             if not self.data_dict or len(self.data_dict) == 0:
                 # Our filter has written directly to an output file
                 # We need to load this into memory first
@@ -144,22 +195,17 @@ class FileSystemJsonArtifact(Artifact):
                 with codecs.open(self.filepath(), 'r', encoding="utf-8") as f:
                     data = f.read()
                 self.data_dict['1'] = data
+                self.write_dict_to_file([['1', 0, os.path.getsize(self.filepath())]], self.cached_output_filepath())
             else:
-                # Write the canonical output file.
-                with codecs.open(self.filepath(), 'w', encoding="utf-8") as f:
-                    f.write(self.output_text())
-
-            # Write the JSON output file.
-            output_dict = self.convert_data_dict_to_numbered_dict()
-            self.write_dict_to_file(output_dict, self.cached_output_filepath())
+                self.write_sections(self.data_dict, self.filepath(), self.cached_output_filepath())
+            if self.output_may_be_shared():
+                self.blob_store.add(self.filepath(), self.compute_file_hash(self.filepath()))
 
     def load_output(self):
         if not self.is_complete():
             raise Exception("should not be calling load_output unless artifact is complete")
         if not self.binary_output:
-            output_dict = self.read_dict_from_file(self.cached_output_filepath())
-            self.data_dict = self.convert_numbered_dict_to_ordered_dict(output_dict)
+            self.data_dict = self.read_sections(self.filepath(), self.cached_output_filepath())
         else:
             with open(self.filepath(), "rb") as f:
                 self.binary_data = f.read()
-
@@ -6,7 +6,7 @@ class FileSystemPickleArtifact(FileSystemJsonArtifact):
         return "%s-meta.pickle" % (self.hashstring)
 
     def cached_output_filename(self):
-        return "%s-output.pickle" % (self.hashstring)
+        return "%s-sections.pickle" % (self.hashstring)
 
     def write_dict_to_file(self, data_dict, filepath):
         with open(filepath, "wb") as f:
@@ -0,0 +1,278 @@
+"""
+Keeps one copy of each distinct file stored in the artifacts directory. Files
+are kept in a blobs directory under the hash of their contents, and artifact
+files with the same contents are hard links to the same blob (or reflinks, or
+copies if the filesystem can do neither). A table in the artifacts directory
+counts how many artifact files refer to each blob, so blobs nothing refers to
+can be removed. Blobs, and so the files linked to them, are read-only.
+"""
+from ordereddict import OrderedDict
+import errno
+import os
+import shutil
+import sqlite3
+import stat
+import thread
+import threading
+
+BLOBS_DIRNAME = "blobs"
+REFS_FILENAME = "blobs.sqlite3"
+
+# From linux/fs.h
+FICLONE = 0x40049409
+
+def reflink(src, dst):
+    """
+    Makes dst a copy of src sharing its data blocks, on filesystems which
+    support it. Raises IOError or OSError if it can't.
+    """
+    import fcntl
+    with open(src, "rb") as s:
+        with open(dst, "wb") as d:
+            try:
+                fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+            except IOError as e:
+                d.close()
+                os.remove(dst)
+                raise e
+
+def tmp_filepath(filepath):
+    return "%s.tmp-%s-%s" % (filepath, os.getpid(), thread.get_ident())
+
+def copy_data(src, dst):
+    """
+    Makes dst a reflink to src if possible, otherwise a copy. Either way dst
+    is a separate file, so writing to src later doesn't change it.
+    """
+    try:
+        reflink(src, dst)
+    except (IOError, OSError, ImportError):
+        shutil.copyfile(src, dst)
+
+def make_read_only(filepath):
+    """
+    Removes write permission from filepath, and so from every file linked to
+    it, so writing to any of them in place fails instead of changing the
+    others.
+    """
+    mode = stat.S_IMODE(os.stat(filepath).st_mode)
+    os.chmod(filepath, mode & ~(stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH))
+
+def link_file(src, dst):
+    """
+    Makes dst a hard link to src if possible, otherwise a reflink or a copy.
+    """
+    try:
+        os.link(src, dst)
+        return
+    except AttributeError:
+        # No os.link on this platform.
+        pass
+    except OSError as e:
+        if e.errno == errno.EEXIST:
+            raise e
+    copy_data(src, dst)
+
+def replace_with_link(src, dst):
+    """
+    Replaces dst by a link to src without there being a moment when dst
+    doesn't exist.
+    """
+    tmp = tmp_filepath(dst)
+    link_file(src, tmp)
+    os.rename(tmp, dst)
+
+def release(filepath):
+    """
+    Removes filepath if it is linked to a blob, so it can be written without
+    changing the blob. Returns whether it was removed.
+    """
+    try:
+        if os.stat(filepath).st_nlink > 1:
+            os.remove(filepath)
+            return True
+    except os.error:
+        pass
+    return False
+
+class BlobStore(object):
+    """
+    The blobs and reference counts for an artifacts directory. References
+    recorded while running are kept in pending until persist writes them all
+    in one transaction.
+    """
+    def __init__(self, artifacts_dir):
+        self.artifacts_dir = artifacts_dir
+        self.blobs_dir = os.path.join(artifacts_dir, BLOBS_DIRNAME)
+        self.refs_filepath = os.path.join(artifacts_dir, REFS_FILENAME)
+        self.pending = OrderedDict()
+        self.lock = threading.Lock()
+        self.conn = None
+        self.conn_pid = None
+
+    def blob_filepath(self, content_hash):
+        return os.path.join(self.blobs_dir, content_hash)
+
+    def connection(self):
+        # A connection can't be shared with a forked worker, so a worker
+        # which needs one opens its own.
+        if self.conn is None or self.conn_pid != os.getpid():
+            self.conn = sqlite3.connect(self.refs_filepath, timeout=60, check_same_thread=False)
+            self.conn.execute("create table if not exists blob_refs (blob text primary key, size int, refcount int)")
+            self.conn.execute("create table if not exists blob_links (filename text primary key, blob text)")
+            self.conn.commit()
+            self.conn_pid = os.getpid()
+        return self.conn
+
+    def ensure_blobs_dir(self):
+        try:
+            os.mkdir(self.blobs_dir)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise e
+
+    def record(self, filepath, content_hash):
+        """
+        Records that the artifact file at filepath refers to the blob with
+        content_hash, in place of any blob it referred to before.
+        """
+        with self.lock:
+            self.pending[os.path.basename(filepath)] = (content_hash, os.path.getsize(filepath))
+
+    def merge(self, pending):
+        """
+        Adds references recorded by another BlobStore, e.g. in a worker
+        process.
+        """
+        with self.lock:
+            self.pending.update(pending)
+
+    def persist(self):
+        """
+        Writes the pending references and their reference counts.
+        """
+        with self.lock:
+            if not self.pending:
+                return
+            pending = self.pending
+            self.pending = OrderedDict()
+
+            conn = self.connection()
+            with conn:
+                for filename, (content_hash, size) in pending.iteritems():
+                    row = conn.execute("select blob from blob_links where filename = ?", (filename,)).fetchone()
+                    if row and row[0] == content_hash:
+                        continue
+                    elif row:
+                        conn.execute("update blob_refs set refcount = refcount - 1 where blob = ?", (row[0],))
+                    conn.execute("insert or replace into blob_links (filename, blob) values (?, ?)", (filename, content_hash))
+                    conn.execute("insert or ignore into blob_refs (blob, size, refcount) values (?, ?, 0)", (content_hash, size))
+                    conn.execute("update blob_refs set refcount = refcount + 1 where blob = ?", (content_hash,))
+
+    def add(self, filepath, content_hash):
+        """
+        Stores the file just written at filepath. If there is already a blob
+        with the same contents, filepath is replaced by a link to it,
+        otherwise the file becomes the blob. Blobs are read-only.
+        """
+        self.ensure_blobs_dir()
+        blob = self.blob_filepath(content_hash)
+        if not os.path.exists(blob):
+            try:
+                os.link(filepath, blob)
+            except (AttributeError, OSError):
+                # No hard links here, or another process just added the
+                # blob, so this file stays as it is.
+                return
+            make_read_only(blob)
+        elif not os.path.samefile(blob, filepath):
+            replace_with_link(blob, filepath)
+        self.record(filepath, content_hash)
+
+    def copy(self, src, filepath, content_hash):
+        """
+        Makes filepath a file with the contents of src, which hash to
+        content_hash. The contents are only copied if no blob has them yet.
+        """
+        self.ensure_blobs_dir()
+        if os.path.exists(filepath):
+            os.remove(filepath)
+
+        blob = self.blob_filepath(content_hash)
+        if os.path.exists(blob):
+            new_blob = None
+        else:
+            # src may be a source file, which must not be linked to the blob
+            # in case it is edited in place.
+            new_blob = tmp_filepath(blob)
+            copy_data(src, new_blob)
+
+        try:
+            os.link(new_blob or blob, filepath)
+        except (AttributeError, OSError):
+            # No hard links here, so there is nothing to share and only one
+            # copy is made, as add does.
+            if new_blob:
+                os.rename(new_blob, filepath)
+            else:
+                copy_data(blob, filepath)
+            return
+
+        if new_blob:
+            make_read_only(new_blob)
+            os.rename(new_blob, blob)
+        self.record(filepath, content_hash)
+
+    def remove(self, filepath):
+        """
+        Removes the artifact file at filepath and its reference to a blob.
+        Returns the blob's hash if nothing refers to it any more.
+        """
+        self.persist()
+        filename = os.path.basename(filepath)
+        if os.path.exists(filepath):
+            os.remove(filepath)
+        conn = self.connection()
+        with conn:
+            row = conn.execute("select blob from blob_links where filename = ?", (filename,)).fetchone()
+            if not row:
+                return None
+            conn.execute("delete from blob_links where filename = ?", (filename,))
+            conn.execute("update blob_refs set refcount = refcount - 1 where blob = ?", (row[0],))
+            refcount = conn.execute("select refcount from blob_refs where blob = ?", (row[0],)).fetchone()[0]
+        if refcount <= 0:
+            return row[0]
+
+    def unreferenced_blobs(self):
+        """
+        Returns the hashes of blobs which no artifact file refers to.
+        """
+        self.persist()
+        if not os.path.exists(self.refs_filepath):
+            return []
+        return [row[0] for row in self.connection().execute("select blob from blob_refs where refcount <= 0")]
+
+    def remove_blob(self, content_hash):
+        """
+        Removes an unreferenced blob. Returns the number of bytes freed.
+        """
+        blob = self.blob_filepath(content_hash)
+        size = 0
+        if os.path.exists(blob):
+            size = os.path.getsize(blob)
+            os.remove(blob)
+        with self.connection() as conn:
+            conn.execute("delete from blob_refs where blob = ? and refcount <= 0", (content_hash,))
+        return size
+
+    def stats(self):
+        """
+        Returns the number of blobs, the number of artifact files referring
+        to them and the number of bytes the links save.
+        """
+        self.persist()
+        if not os.path.exists(self.refs_filepath):
+            return { 'blobs' : 0, 'links' : 0, 'saved_bytes' : 0 }
+        sql = "select count(*), sum(refcount), sum(size * (refcount - 1)) from blob_refs where refcount > 0"
+        blobs, links, saved = self.connection().execute(sql).fetchone()
+        return { 'blobs' : blobs, 'links' : links or 0, 'saved_bytes' : saved or 0 }
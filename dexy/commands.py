@@ -1,13 +1,8 @@
 from dexy.constants import Constants
 from dexy.version import Version
 from modargs import args
-from pygments import highlight
-from pygments.formatters import TerminalFormatter
-from pygments.lexers.agile import PythonLexer
-import cProfile
 import copy
 import datetime
-import dexy.controller
 import dexy.introspect
 import dexy.utils
 import inspect
@@ -18,8 +13,6 @@ import shutil
 import sys
 import warnings
 
-import web
-
 class InternalDexyProblem(Exception):
     def __init__(self, message):
         self.message = """\nOops! You may have found a bug in Dexy.
@@ -60,34 +53,43 @@ def run():
         sys.exit(1)
 
 def dexy_command(
+        affected=False, # space-separated list of changed source files, only documents which depend on them are run. pass with no value to detect files changed since the last run
         allreports=False, # whether to run all available reports
+        artifactcachemb=Constants.DEFAULT_ARTIFACT_CACHE_MB, # megabytes of artifact contents to keep in memory when artifacts are loaded from the cache, metadata is always kept
         artifactclass=Constants.DEFAULT_ACLASS, # name of class to use for artifacts
         artifactsdir=Constants.DEFAULT_ADIR, # location of directory in which to store artifacts
         config=Constants.DEFAULT_CONFIG, # name to use for configuration file
         danger=False, # whether to allow running remote files
         dbclass=Constants.DEFAULT_DBCLASS, # name of database class to use
         dbfile=Constants.DEFAULT_DBFILE, # name of the database file (it lives in the logs dir)
+        dbwal=False, # whether to use sqlite's write-ahead log and relaxed syncing for faster database writes
         directory=".", # the directory to process, you can just process a subdirectory of your project
         disabletests=False, # Whether to disable the dexy 'test' filter
         dryrun=False, # if True, just parse config and print batch info, don't run dexy
         exclude="", # directories to exclude from dexy processing
         filters=False, # DEPRECATED just to catch people who use the old dexy --filters syntax
+        gc=False, # whether to remove artifacts not used by recent batches after running, like 'dexy gc'
+        gckeep=Constants.DEFAULT_GC_KEEP_BATCHES, # with -gc, number of recent batches whose artifacts are kept
+        gcmaxmb=0, # with -gc, stop removing unused artifacts once the artifacts directory is this many megabytes
         globals="", # global values to make available within dexy documents, should be KEY=VALUE pairs separated by spaces
         help=False, # for people who type -help out of habit
         h=False, # for people who type -h out of habit
-        hashfunction='md5', # What hash function to use, set to crc32 or adler32 for more speed, less reliability
+        hashfunction="", # What hash function to use, defaults to 'hashfunction' in $globals or md5. blake2b (if available) and xxh64 are faster, crc32 and adler32 are fast but unreliable
         ignore=False, # whether to ignore nonzero exit status or raise an error - may not be supported by all filters
         inputs=False, # whether to log information about inputs for debugging
+        jobs=1, # number of documents to run at once in separate worker processes
         logfile=Constants.DEFAULT_LFILE, # name of log file
         loglevel=Constants.DEFAULT_LOGLEVEL, # default log level (see Constants.LOGLEVELS.keys), can also be set per-document
         logsdir=Constants.DEFAULT_LDIR, # location of directory in which to store logs
         nocache=False, # whether to force artifacts to run even if there is a matching file in the cache
+        noplancache=False, # whether to work out documents and dependencies from config files even if a cached plan is still valid
         output=False, # Shortcut to mean "I just want the OutputReporter, nothing else"
         recurse=True, # whether to recurse into subdirectories when running Dexy
         reporters=False, # DEPRECATED just to catch people who use the old dexy --reporters syntax
         reports=Constants.DEFAULT_REPORTS, # reports to be run after dexy runs, enclose in quotes and separate with spaces
         reset=False, # whether to purge existing artifacts and logs before running Dexy
         run="", # specific document to run. if specified, this document + its dependencies will be all that is run
+        schedule="dag", # when jobs > 1, 'dag' starts each document once its inputs are done, 'levels' runs one dependency level at a time
         setup=False, # DEPRECATED just to catch people who use the old dexy --setup syntax
         silent=False, # Whether to not print any output when running dexy
         strictinherit=False, # set to true if you want 'allinputs' to only reference items in same dir or a subdir
@@ -154,7 +156,7 @@ def dexy_command(
                 allreports=True,
                 artifactclass=artifactclass,
                 controller=controller,
-                hashfunction=hashfunction,
+                hashfunction=controller.args['hashfunction'],
                 logsdir=logsdir
             )
         else:
@@ -162,16 +164,31 @@ def dexy_command(
                 reports=reports,
                 artifactclass=artifactclass,
                 controller=controller,
-                hashfunction=hashfunction,
+                hashfunction=controller.args['hashfunction'],
                 logsdir=logsdir
             )
 
+        # Save the batch info again, so the artifact cache counters include
+        # the artifacts loaded by reporters.
+        dexy.utils.save_batch_info(controller.batch_id, controller.batch_info(), logsdir)
+
+        if gc:
+            gc_command(
+                keep=gckeep,
+                maxmb=gcmaxmb,
+                artifactsdir=artifactsdir,
+                dbclass=dbclass,
+                dbfile=dbfile,
+                logsdir=logsdir,
+                silent=silent
+            )
 
-def run_dexy(args):
+def run_dexy(args, previous=None):
     # validate args and do any conversions required
     args['globals'] = dict([g.split("=") for g in args['globals'].split()])
     args['exclude'] = [x.strip("/") for x in args['exclude'].split()]
-    controller = dexy.controller.Controller(args)
+    import dexy.controller
+    controller = dexy.controller.Controller(args, previous)
     controller.run()
     return controller
 
@@ -201,11 +218,42 @@ def profile_command(
     if kw.has_key('artifactclass'):
         report_kwargs['artifactclass'] = kw['artifactclass']
 
+    import cProfile
     for i in xrange(n):
         print "===== run %s of %s =====" % (i+1, n)
         cProfile.runctx("run_dexy(args)", globals(), copy.deepcopy(locals_for_run_dexy), prof_file)
         reports_command(reports=reports, **report_kwargs)
 
+def watch_command(
+        interval=0.25, # seconds to wait between checks for changed files
+        reports="Output", # reports to be run after each rebuild, enclose in quotes and separate with spaces
+        **kw # Accepts additional keyword arguments for the 'dexy' command
+    ):
+    """
+    Runs dexy, then watches your project and runs it again each time a
+    document's source file, a config file or the list of files in a directory
+    changes. Filters, caches and the database connection stay loaded between
+    runs, and only the documents affected by the changes are run, while the
+    artifacts of all other documents are carried over from the last batch
+    each ran in so reports stay complete. Type ctrl+c to stop watching.
+    """
+    logsdir = kw.get('logsdir', Constants.DEFAULT_LDIR)
+    artifactsdir = kw.get('artifactsdir', Constants.DEFAULT_ADIR)
+    if not check_setup(logsdir=logsdir, artifactsdir=artifactsdir):
+        raise UserFeedback("Please run '%s setup' first to create the directories dexy needs to work with" % PROG)
+
+    dexy_fn = args.function_for(dexy.commands, "dexy")
+    defaults = args.determine_kwargs(dexy_fn)
+    defaults.update(kw)
+    defaults['reports'] = reports
+
+    from dexy.watcher import Watcher
+    watcher = Watcher(defaults, interval)
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        print "stopped watching."
+
 def check_setup(logsdir=Constants.DEFAULT_LDIR, artifactsdir=Constants.DEFAULT_ADIR):
     return os.path.exists(logsdir) and os.path.exists(artifactsdir)
 
@@ -321,6 +369,34 @@ def reset_command(logsdir=Constants.DEFAULT_LDIR, artifactsdir=Constants.DEFAULT
     cleanup_command(logsdir=logsdir, artifactsdir=artifactsdir)
     setup_command(logsdir=logsdir, artifactsdir=artifactsdir, showhelp=False)
 
+def gc_command(
+        keep=Constants.DEFAULT_GC_KEEP_BATCHES, # number of recent batches whose artifacts are kept
+        maxmb=0, # stop removing unused artifacts once the artifacts directory is this many megabytes, 0 removes all of them
+        artifactsdir=Constants.DEFAULT_ADIR, # location of directory in which artifacts are stored
+        dbclass=Constants.DEFAULT_DBCLASS, # name of database class to use
+        dbfile=Constants.DEFAULT_DBFILE, # name of the database file (it lives in the logs dir)
+        logsdir=Constants.DEFAULT_LDIR, # location of directory in which logs are stored
+        silent=False # whether to not print how much space was reclaimed
+        ):
+    """
+    Removes artifacts which the last few batches didn't use from the artifacts
+    directory, least recently used first, until it is no bigger than maxmb
+    megabytes. Unlike 'dexy reset', artifacts still in use are kept, so the
+    next run doesn't have to start from scratch.
+    """
+    from dexy.garbage_collector import GarbageCollector
+    db = dexy.utils.get_db(dbclass, dbfile=dbfile, logsdir=logsdir)
+    collector = GarbageCollector(db, artifactsdir, int(keep), float(maxmb) * 1024 * 1024)
+    result = collector.collect()
+    if not silent:
+        print "removed %s unused artifacts, reclaimed %0.1f MB, artifacts directory is now %0.1f MB" % (
+                result['removed'],
+                result['bytes_reclaimed'] / (1024.0 * 1024),
+                result['bytes_after'] / (1024.0 * 1024))
+        if result['kept_unreachable']:
+            print "kept %s unused artifacts which fit in %s MB" % (result['kept_unreachable'], maxmb)
+    return result
+
 def purge_artifacts(remake=True, artifact_class=None, artifactsdir=Constants.DEFAULT_ADIR):
     shutil.rmtree(artifactsdir, ignore_errors=True)
     if remake:
@@ -412,6 +488,9 @@ def filters_text(
             if nocolor:
                 text.append(source_code)
             else:
+                from pygments import highlight
+                from pygments.formatters import TerminalFormatter
+                from pygments.lexers.agile import PythonLexer
                 formatter = TerminalFormatter()
                 lexer = PythonLexer()
                 text.append(highlight(source_code, lexer, formatter))
@@ -657,34 +736,6 @@ def grep_command(
                 if not k == '1':
                     print "    %s" % k
 
-
-class CustomStaticApp(web.httpserver.StaticApp):
-    def translate_path(self, path):
-        return os.path.join(os.path.dirname(os.path.abspath(__file__)), "viewer", path.lstrip("/"))
-
-import posixpath
-import urllib
-class StaticMiddleware:
-    """WSGI middleware for serving static files."""
-    def __init__(self, app, prefix='/static/'):
-        self.app = app
-        self.prefix = prefix
-
-    def __call__(self, environ, start_response):
-        path = environ.get('PATH_INFO', '')
-        path = self.normpath(path)
-
-        if path.startswith(self.prefix):
-            return CustomStaticApp(environ, start_response)
-        else:
-            return self.app(environ, start_response)
-
-    def normpath(self, path):
-        path2 = posixpath.normpath(urllib.unquote(path))
-        if path.endswith("/"):
-            path2 += "/"
-        return path2
-
 def viewer_command(
         port=8090 # Port on which to run the viewer
         ):
@@ -692,10 +743,11 @@ def viewer_command(
     Starts a web.py application which lets you preview the snippets generated by your previous dexy run.
     """
     import dexy.viewer.app as viewer
+    import web
     func = viewer.app.wsgifunc()
     server_address =("0.0.0.0", port)
 
-    func = StaticMiddleware(func)
+    func = viewer.StaticMiddleware(func)
     func = web.httpserver.LogMiddleware(func)
 
     server = web.httpserver.WSGIServer(server_address, func)
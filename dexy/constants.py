@@ -25,11 +25,14 @@ class Constants():
     }
 
     DEFAULT_ACLASS = 'FileSystemJsonArtifact'
+    DEFAULT_ARTIFACT_CACHE_MB = 256
     DEFAULT_ADIR = 'artifacts'
     DEFAULT_COMMAND = 'dexy'
     DEFAULT_CONFIG = '.dexy'
     DEFAULT_DBCLASS = 'SqliteDatabase'
     DEFAULT_DBFILE = "db.sql"
+    DEFAULT_GC_KEEP_BATCHES = 3
+    DEFAULT_HASHFUNCTION = 'md5'
     DEFAULT_LDIR = 'logs'
     DEFAULT_LFILE = 'dexy.log'
     DEFAULT_LOGFORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
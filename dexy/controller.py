@@ -1,28 +1,153 @@
 from dexy.constants import Constants
 from dexy.topsort import CycleError
 from dexy.topsort import topsort
+from dexy.version import Version
 from ordereddict import OrderedDict
 import copy
 import dexy
+import dexy.artifact
+import dexy.artifact_cache
+import dexy.blob_store
 import dexy.commands
+import dexy.dexy_filter
 import dexy.document
+import dexy.file_index
+import dexy.hashing
 import dexy.introspect
+import dexy.plan_cache
+import dexy.scheduler
+import dexy.source_hashes
+import dexy.stat_index
 import dexy.utils
+import dexy.version_cache
 import fnmatch
-import glob
+import hashlib
 import json
 import os
 import re
 import sre_constants
 import time
 
+# Args which are used while working out the plan, see Controller.plan_cache_key
+PLAN_ARGS = ['artifactsdir', 'config', 'danger', 'directory', 'exclude',
+        'globals', 'hashfunction', 'logsdir', 'recurse', 'run', 'strictinherit']
+
+class ConfigResolver(object):
+    """
+    Works out the config applicable within each directory. Each config file is
+    parsed at most once, and the config for a directory is built from the
+    cached config of its parent directory.
+    """
+    def __init__(self, config_file, log, file_index=None):
+        self.config_file = config_file
+        self.log = log
+        self.file_index = file_index or dexy.file_index.FileIndex()
+        self.parsed = {}
+        self.resolved = {}
+        self.config_files = {}
+        self.parse_count = 0
+        self.resolve_count = 0
+        self.cache_hits = 0
+
+    def parse(self, config_path):
+        """
+        Returns a list of the parsed contents of config files matching
+        config_path.
+        """
+        key = os.path.normpath(config_path)
+        if not self.parsed.has_key(key):
+            json_dicts = []
+            for f in self.file_index.glob(config_path):
+                self.log.info("loading config file %s" % f)
+                self.parse_count += 1
+
+                with open(f, "r") as cf:
+                    text = cf.read()
+                    self.config_files[f] = dexy.plan_cache.config_file_signature(text)
+                    try:
+                        json_dicts.append(json.loads(text))
+                    except ValueError as e:
+                        msg = "Your config file %s has invalid JSON\n%s" % (f, e.message)
+                        raise dexy.commands.UserFeedback(msg)
+
+            self.parsed[key] = json_dicts
+        return self.parsed[key]
+
+    def resolve(self, path_elements):
+        """
+        Returns a tuple of the config dict, globals and variables which apply
+        after reading config files in each of path_elements in turn.
+        """
+        if self.resolved.has_key(path_elements):
+            self.cache_hits += 1
+            return self.resolved[path_elements]
+
+        if path_elements:
+            parent_config, parent_globals, parent_variables = self.resolve(path_elements[:-1])
+            config_dict = parent_config.copy()
+            global_args = parent_globals.copy()
+            variables = parent_variables.copy()
+        else:
+            config_dict = {}
+            global_args = {}
+            variables = {}
+
+        # Don't propagate virtual files
+        for k in config_dict.keys():
+            propagate_virtual = config_dict[k].has_key('propagate') and config_dict[k]['propagate']
+            if k.startswith("@") and not propagate_virtual:
+                del config_dict[k]
+
+        config_path = os.path.join(*(list(path_elements) + [self.config_file]))
+        for json_dict in self.parse(config_path):
+            if json_dict.has_key("$reset"):
+                # Reset the config, i.e. ignore everything from parent
+                # directories, just use this directory's config in json_dict
+                config_dict = json_dict.copy()
+            else:
+                # Combine any config in this dir with parent dir config.
+                config_dict.update(json_dict)
+
+            if json_dict.has_key("$globals"):
+                global_args.update(json_dict["$globals"])
+
+            if json_dict.has_key("$variables"):
+                variables.update(json_dict["$variables"])
+
+        self.resolve_count += 1
+        self.resolved[path_elements] = (config_dict, global_args, variables)
+        return self.resolved[path_elements]
+
+    def config_dirs(self):
+        """
+        Returns the directories which have been checked for config files.
+        """
+        return set(os.path.dirname(k) or "." for k in self.parsed)
+
+    def config_for_directory(self, path):
+        self.log.debug("Determining configuration applicable in %s" % path)
+        config_dict, global_args, variables = self.resolve(tuple(path.split(os.sep)))
+
+        # Documents are processed by changing their config in place, so each
+        # directory gets its own copy.
+        config_dict = copy.deepcopy(config_dict)
+        config_dict['$globals'] = copy.deepcopy(global_args)
+        config_dict['$variables'] = copy.deepcopy(variables)
+        return config_dict
+
 class Controller(object):
-    def __init__(self, args={}):
+    def __init__(self, args={}, previous=None):
+        """
+        If previous is given, it should be a Controller which has run earlier
+        in the same process, e.g. in 'dexy watch', and its database connection,
+        indexes and caches are reused instead of being loaded again.
+        """
         self.args = args # arguments from command line
         self.config = {} # config to be processed from .dexy files
         self.docs = []
         self.timing = []
         self.virtual_docs = []
+        self.file_index = dexy.file_index.FileIndex()
 
         self.batch_start_time = None
         self.batch_finish_time = None
@@ -35,18 +160,37 @@ class Controller(object):
             self.log = Constants.NULL_LOGGER
 
         # Set up db
-        if args.has_key('dbclass') and args.has_key("logsdir") and args.has_key("dbfile"):
-            self.db = dexy.utils.get_db(self.args['dbclass'], logsdir=self.args['logsdir'], dbfile=args['dbfile'])
+        if previous:
+            self.db = previous.db
+            self.db.extra_keys = []
+        elif args.has_key('dbclass') and args.has_key("logsdir") and args.has_key("dbfile"):
+            wal = args.has_key('dbwal') and args['dbwal']
+            self.db = dexy.utils.get_db(self.args['dbclass'], logsdir=self.args['logsdir'], dbfile=args['dbfile'], wal=wal)
         else:
             self.db = None
 
-        # List of directories that reporters use, these will not be processed by dexy
-        self.reports_dirs = dexy.introspect.reports_dirs(self.log)
+        if previous:
+            self.stat_index = previous.stat_index
+            self.reports_dirs = previous.reports_dirs
+            self.artifact_classes = previous.artifact_classes
+            self.filter_list = previous.filter_list
+            self.version_cache = previous.version_cache
+            self.source_hash_cache = previous.source_hash_cache
+            self.artifact_cache = previous.artifact_cache
+            self.blob_store = previous.blob_store
+
+            # Tools may have been installed or upgraded since the last run.
+            self.version_cache.clear_memos()
+        else:
+            self.stat_index = dexy.stat_index.StatIndex(self.db)
+
+            # List of directories that reporters use, these will not be processed by dexy
+            self.reports_dirs = dexy.introspect.reports_dirs(self.log)
 
-        # list of artifact classes - if nothing else uses this then move
-        # it into the if statement below and don't cache it
+            # list of artifact classes - if nothing else uses this then move
+            # it into the if statement below and don't cache it
+            self.artifact_classes = dexy.introspect.artifact_classes(self.log)
 
-        self.artifact_classes = dexy.introspect.artifact_classes(self.log)
         if args.has_key('artifactclass'):
             if self.artifact_classes.has_key(args['artifactclass']):
                 self.artifact_class = self.artifact_classes[args['artifactclass']]
@@ -61,22 +205,58 @@ class Controller(object):
         self.batch_start_time = time.time()
         start = self.batch_start_time
 
-        self.log.debug("populating Document class filter list")
-        dexy.document.Document.filter_list = dexy.introspect.filters(self.log)
+        if not hasattr(self, 'filter_list'):
+            self.log.debug("populating Document class filter list")
+            self.filter_list = dexy.introspect.filters(self.log, self.args['logsdir'])
+            self.version_cache = dexy.version_cache.VersionCache(self.args['logsdir'])
+            self.source_hash_cache = dexy.source_hashes.SourceHashCache(self.args['logsdir'])
+            if self.args.has_key('artifactcachemb'):
+                max_mb = self.args['artifactcachemb']
+            else:
+                max_mb = Constants.DEFAULT_ARTIFACT_CACHE_MB
+            self.artifact_cache = dexy.artifact_cache.ArtifactCache(int(float(max_mb) * 1024 * 1024))
+            self.blob_store = dexy.blob_store.BlobStore(self.args.get('artifactsdir', Constants.DEFAULT_ADIR))
+        dexy.document.Document.filter_list = self.filter_list
+        dexy.artifact.Artifact.FILTERS = self.filter_list
+        dexy.dexy_filter.DexyFilter.version_cache = self.version_cache
+        dexy.artifact.Artifact.source_hash_cache = self.source_hash_cache
+        dexy.artifact.Artifact.blob_store = self.blob_store
+        self.artifact_class.retrieved_artifacts = self.artifact_cache
         self.timing.append(("populate-filter-list", time.time() - start))
         start = time.time()
 
-        self.log.debug("loading config...")
-        self.load_config()
-        self.log.debug("finished loading config.")
-        self.timing.append(("load-config", time.time() - start))
-        start = time.time()
-
-        self.log.debug("processing config, populating document list...")
-        self.process_config()
-        self.log.debug("finished processing config.")
-        self.timing.append(("process-config", time.time() - start))
-        start = time.time()
+        affected = self.args.has_key('affected') and self.args['affected']
+        previous_plan = None
+        plan_loaded = self.load_plan()
+        if plan_loaded:
+            self.log.debug("loaded plan from plan cache.")
+            self.timing.append(("load-plan", time.time() - start))
+            start = time.time()
+        else:
+            self.log.debug("loading config...")
+            self.load_config()
+            self.log.debug("finished loading config.")
+            self.timing.append(("load-config", time.time() - start))
+            start = time.time()
+
+            self.log.debug("processing config, populating document list...")
+            self.process_config()
+            self.log.debug("finished processing config.")
+            self.timing.append(("process-config", time.time() - start))
+            start = time.time()
+
+            # The plan being replaced tells us which documents the changes to
+            # config files affect.
+            if affected is True:
+                previous_plan = self.previous_plan()
+            self.save_plan()
+            self.timing.append(("save-plan", time.time() - start))
+            start = time.time()
+
+        if affected:
+            self.limit_to_affected(self.changed_docs(not plan_loaded, previous_plan))
+            self.timing.append(("limit-to-affected", time.time() - start))
+            start = time.time()
 
         # set the list of documents which are virtual
         self.virtual_docs = [d for d in self.docs if d.virtual]
@@ -84,13 +264,21 @@ class Controller(object):
         try:
             if not self.args['dryrun']:
                 [doc.setup() for doc in self.docs]
-                self.docs = [doc.run() for doc in self.docs]
+                if self.args['jobs'] > 1:
+                    self.docs = dexy.scheduler.run_docs(self)
+                else:
+                    self.docs = [doc.run() for doc in self.docs]
         except dexy.commands.UserFeedback as e:
             self.persist()
             raise e
 
         self.timing.append(("run-docs", time.time() - start))
 
+        if affected and not self.args['dryrun']:
+            start = time.time()
+            self.carry_forward()
+            self.timing.append(("carry-forward", time.time() - start))
+
         self.batch_finish_time = time.time()
         self.batch_elapsed_time = self.batch_finish_time - self.batch_start_time
 
@@ -104,6 +292,11 @@ class Controller(object):
         Persists the database. Saves some information about this batch in a
         JSON file (for use by reporters or for debugging).
         """
+        self.stat_index.persist()
+        if hasattr(self, 'version_cache'):
+            self.version_cache.persist()
+            self.source_hash_cache.persist()
+            self.blob_store.persist()
         self.db.persist()
         dexy.utils.save_batch_info(self.batch_id, self.batch_info(), self.args['logsdir'])
 
@@ -119,67 +312,240 @@ class Controller(object):
             "start_time" : self.batch_start_time,
             "finish_time" : self.batch_finish_time,
             "elapsed" : self.batch_elapsed_time,
-            "timing" : self.timing
+            "timing" : self.timing,
+            "artifact_cache" : hasattr(self, 'artifact_cache') and self.artifact_cache.stats() or None
             }
 
-    def config_for_directory(self, path):
+    def plan_cache_key(self):
         """
-        Determine the config applicable within a directory by looking in every
-        parent directory (up as far as the dexy project root) for config files
-        and combining them, such that subdirectories override parents.
+        Returns a hash of everything besides the config files and directory
+        listings which can change the plan: the args used while processing
+        config, the reports directories and the code which does the processing.
         """
-        self.log.debug("Determining configuration applicable in %s" % path)
+        # The modules which glob, exclude and walk the project, find the
+        # filters and save the plan, as well as those which process config.
+        modules = [dexy.controller, dexy.document, dexy.file_index, dexy.introspect, dexy.plan_cache]
+        source_hash = dexy.artifact.Artifact.source_hash_cache.source_hash(
+                modules, 'md5', lambda s: hashlib.md5(s).hexdigest())
 
-        global_args = {}
-        config_dict = {}
-        variables = {}
-        config_file = self.args['config']
+        plan_args = dict((k, self.args.get(k)) for k in PLAN_ARGS)
+        key_info = [plan_args, self.reports_dirs, Version.VERSION, source_hash]
+        return hashlib.md5(json.dumps(key_info, sort_keys=True)).hexdigest()
 
-        path_elements = path.split(os.sep)
+    def load_plan(self):
+        """
+        Sets up the documents, dependencies and run order from the plan cache
+        if there is a plan which is still valid. Returns whether it did.
+        """
+        if self.args.has_key('noplancache') and self.args['noplancache']:
+            return False
 
-        for i in range(0,len(path_elements)+1):
-            config_path = os.path.join(*(path_elements[0:i] + [config_file]))
-            config_files = glob.glob(config_path)
+        self.plan_cache = dexy.plan_cache.PlanCache(self.args['logsdir'], self.log)
+        self.plan_key = self.plan_cache_key()
+        plan = self.plan_cache.load(self.plan_key)
+        if not plan:
+            return False
 
-            # Don't propagate virtual files
-            for k in config_dict.keys():
-                propagate_virtual = config_dict[k].has_key('propagate') and config_dict[k]['propagate']
-                if k.startswith("@") and not propagate_virtual:
-                    del config_dict[k]
+        self.config = plan['config']
+        self.plan_dirs = plan['dirs']
+        self.plan_config_files = plan['config_files']
+        self.args['hashfunction'] = plan['hashfunction']
+        dexy.hashing.new(self.args['hashfunction']) # raises UserFeedback if not available
 
-            for f in config_files:
-                self.log.info("loading config file %s" % f)
+        self.members = OrderedDict()
+        self.depends = plan['depends']
+        self.registry = []
 
-                with open(f, "r") as cf:
-                    try:
-                        json_dict = json.load(cf)
-                    except ValueError as e:
-                        msg = "Your config file %s has invalid JSON\n%s" % (f, e.message)
-                        raise dexy.commands.UserFeedback(msg)
+        self.batch_id = self.db.next_batch_id()
+        if not self.args['silent']:
+            print "batch id is", self.batch_id
 
-                if json_dict.has_key("$reset"):
-                    # Reset the config, i.e. ignore everything from parent
-                    # directories, just use this directory's config in json_dict
-                    config_dict = json_dict
-                else:
-                    # Combine any config in this dir with parent dir config.
-                    config_dict.update(json_dict)
+        for doc_info in plan['docs']:
+            doc = dexy.document.Document()
+            doc.set_controller(self)
+            doc.load_plan_info(doc_info)
+            self.register(doc)
 
-                if json_dict.has_key("$globals"):
-                    global_args.update(json_dict["$globals"])
+        for doc, doc_info in zip(self.registry, plan['docs']):
+            doc.inputs = [self.registry[i] for i in doc_info['inputs']]
 
-                if json_dict.has_key("$variables"):
-                    variables.update(json_dict["$variables"])
+        for i in plan['members']:
+            self.members[self.registry[i].key()] = self.registry[i]
 
-        config_dict['$globals'] = global_args
-        config_dict['$variables'] = variables
-        return config_dict
+        self.ordering = plan['ordering']
+        for i in self.ordering:
+            self.docs.append(self.registry[i])
+
+        if not self.args['silent']:
+            print "using cached plan for %s documents" % len(self.members)
+        return True
+
+    def plan(self):
+        """
+        Returns the documents, dependencies and run order worked out by
+        load_config and process_config, in the form saved to the plan cache.
+        """
+        return {
+            'key' : self.plan_key,
+            'dirs' : self.plan_dirs,
+            'config_files' : self.plan_config_files,
+            'config' : self.config,
+            'hashfunction' : self.args['hashfunction'],
+            'docs' : [doc.plan_info() for doc in self.registry],
+            'members' : [doc.id for doc in self.members.values()],
+            'depends' : self.depends,
+            'ordering' : self.ordering
+        }
+
+    def save_plan(self):
+        if self.args.has_key('noplancache') and self.args['noplancache']:
+            return
+        self.plan_cache.save(self.plan())
+
+    def previous_plan(self):
+        """
+        Returns the plan saved by the last run if it was saved with the same
+        args and dexy code, otherwise None.
+        """
+        if self.args.has_key('noplancache') and self.args['noplancache']:
+            return None
+        plan = self.plan_cache.read()
+        if plan and plan['key'] == self.plan_key:
+            return plan
+
+    def changed_docs(self, replanned, previous_plan=None):
+        """
+        Returns the documents whose source files are named in the 'affected'
+        arg. If 'affected' is just True, returns the documents whose source
+        files have changed since they were last hashed and, if the plan had to
+        be worked out again, those which are new or configured differently
+        since previous_plan, or all documents if there is no previous plan.
+        """
+        affected = self.args['affected']
+        if affected is True:
+            if replanned and not previous_plan:
+                self.log.debug("no previous plan to compare with, all documents are affected")
+                return list(self.docs)
+            elif replanned:
+                previous = dexy.plan_cache.document_signatures(previous_plan)
+                current = dexy.plan_cache.document_signatures(self.plan())
+                reconfigured = set(k for k, v in current.iteritems() if previous.get(k) != v)
+            else:
+                reconfigured = set()
+
+            changed = []
+            for doc in self.docs:
+                if doc.key() in reconfigured:
+                    changed.append(doc)
+                elif not doc.virtual and self.stat_index.is_changed(doc.name):
+                    changed.append(doc)
+            return changed
+
+        else:
+            if isinstance(affected, basestring):
+                affected = affected.split()
+            paths = set(os.path.normpath(p) for p in affected)
+            return [doc for doc in self.docs if not doc.virtual and os.path.normpath(doc.name) in paths]
+
+    def limit_to_affected(self, changed_docs):
+        """
+        Limits the documents to be run to changed_docs, all the documents which
+        depend on them directly or indirectly, and the inputs those documents
+        need. Inputs which aren't affected themselves are unchanged, so running
+        them just loads their cached artifacts.
+        """
+        dependents = dict((i, []) for i in self.ordering)
+        for input_id, doc_id in self.depends:
+            dependents[input_id].append(doc_id)
+
+        affected = set()
+        stack = [doc.id for doc in changed_docs]
+        while stack:
+            doc_id = stack.pop()
+            if not doc_id in affected:
+                affected.add(doc_id)
+                stack.extend(dependents[doc_id])
+
+        needed = set(affected)
+        stack = list(affected)
+        while stack:
+            for input_doc in self.registry[stack.pop()].inputs:
+                if not input_doc.id in needed:
+                    needed.add(input_doc.id)
+                    stack.append(input_doc.id)
+
+        num_docs = len(self.docs)
+        self.skipped_keys = [doc.key() for doc in self.docs if not doc.id in needed]
+        self.ordering = [i for i in self.ordering if i in needed]
+        self.depends = [(input_id, doc_id) for input_id, doc_id in self.depends if doc_id in needed]
+        self.docs = [self.registry[i] for i in self.ordering]
+        self.members = OrderedDict((k, doc) for k, doc in self.members.iteritems() if doc.id in needed)
+        self.skipped_docs = len(self.skipped_keys)
+
+        if not self.args['silent']:
+            print "%s documents affected by changes, running %s documents (%s to provide inputs from cache), skipped %s/%s documents" % (len(affected), len(self.docs), len(needed) - len(affected), self.skipped_docs, num_docs)
+
+    def carry_forward(self):
+        """
+        Adds the artifacts which the documents skipped by limit_to_affected
+        had in the last batch each of them ran in to this batch, so reports on
+        this batch cover every document. Called by run when 'affected' is set.
+        """
+        self.db.copy_latest_rows(self.skipped_keys, self.batch_id)
+
+    def watched_paths(self):
+        """
+        Returns the paths whose changes can change what a run does: the
+        directories and config files the plan was worked out from and the
+        source files of the documents.
+        """
+        paths = set(self.plan_dirs.keys())
+        paths.update(self.plan_config_files.keys())
+        paths.update(doc.name for doc in self.registry if not doc.virtual)
+        return paths
+
+    def project_hashfunction(self):
+        """
+        Returns the name of the hash function to use, from the -hashfunction
+        option if given, otherwise from 'hashfunction' in the $globals of the
+        project's config.
+        """
+        if self.args.has_key('hashfunction') and self.args['hashfunction']:
+            return self.args['hashfunction']
+
+        hashfunctions = set()
+        for config in self.config.values():
+            if config.has_key('$globals') and config['$globals'].has_key('hashfunction'):
+                hashfunctions.add(config['$globals']['hashfunction'])
+
+        if len(hashfunctions) > 1:
+            msg = "The hashfunction in $globals must be the same throughout a project, found %s"
+            raise dexy.commands.UserFeedback(msg % ", ".join(sorted(hashfunctions)))
+        elif hashfunctions:
+            return hashfunctions.pop()
+        else:
+            return Constants.DEFAULT_HASHFUNCTION
+
+    def config_for_directory(self, path):
+        """
+        Determine the config applicable within a directory by looking in every
+        parent directory (up as far as the dexy project root) for config files
+        and combining them, such that subdirectories override parents.
+        """
+        if not hasattr(self, 'config_resolver'):
+            self.config_resolver = ConfigResolver(self.args['config'], self.log, self.file_index)
+        return self.config_resolver.config_for_directory(path)
 
     def load_config(self):
         """
         This method determines which subdirectories will be included in the
         dexy batch and populates the config dict for each of them.
         """
+        self.file_index = dexy.file_index.FileIndex()
+        self.config_resolver = ConfigResolver(self.args['config'], self.log, self.file_index)
+        self.plan_config_files = self.config_resolver.config_files
+        self.plan_dirs = {}
+
         if self.args['recurse']:
 
             # Figure out which directories need to be skipped
@@ -189,52 +555,34 @@ class Controller(object):
             exclude_everywhere = Constants.EXCLUDE_DIRS_ALL_LEVELS
             self.log.debug("directories excluded at all levels %s" % ", ".join(exclude_everywhere))
 
-            for dirpath, dirnames, filenames in os.walk(self.args['directory']):
-                # Figure out if we should process this directory and recurse
-                # into its children. Start with process_dir = True
-                process_dir = True
-
-                # Remove any children we don't want to recurse into.
-                if dirpath == ".":
-                    for x in exclude_at_root:
-                        if x in dirnames:
-                            dirnames.remove(x)
-                for x in exclude_everywhere:
-                    if x in dirnames:
-                        dirnames.remove(x)
-
-                # Look for a .nodexy file
-                if os.path.isfile(os.path.join(dirpath, '.nodexy')):
-                    # If we find one...
-                    self.log.info(".nodexy file found in %s" % dirpath)
+            # Directory names have no slashes, so an exclude pattern matches
+            # a directory when re.match(pattern, name) does.
+            args_exclude = self.args['exclude']
+            if isinstance(args_exclude, str):
+                args_exclude = args_exclude.split()
+            exclude_regex = dexy.file_index.exclusion_regex(args_exclude)
 
-                    # ...remove all child dirs from processing...
-                    for i in xrange(len(dirnames)):
-                        dirnames.pop()
-
-                    # ...and skip this directory.
-                    process_dir = False
-
-                # Check if we match any excludes specified on the command line
-                args_exclude = self.args['exclude']
-                if isinstance(args_exclude, str):
-                    args_exclude = args_exclude.split()
-                for pattern in args_exclude:
-                    for d in dirnames:
-                        m1 = re.match(pattern, d)
-                        m2 = re.match("./%s" % pattern, d)
-                        m3 = re.match("%s/" % pattern, d)
-                        m4 = re.match("./%s/" % pattern, d)
-                        if m1 or m2 or m3 or m4:
-                            dirnames.remove(d)
+            walker = dexy.file_index.walk_project(self.args['directory'], exclude_at_root, exclude_everywhere, exclude_regex)
+            for dirpath, dirnames, filenames, process_dir in walker:
+                self.plan_dirs[os.path.normpath(dirpath)] = dexy.plan_cache.directory_fingerprint(dirpath, dirnames, filenames)
+                self.file_index.add_dir(dirpath, dirnames, filenames)
 
                 if process_dir:
                     self.config[dirpath] = self.config_for_directory(dirpath)
+                else:
+                    self.log.info(".nodexy file found in %s" % dirpath)
             else:
                 # Not recursing
                 dirpath = self.args['directory']
                 self.config[dirpath] = self.config_for_directory(dirpath)
 
+        resolver = self.config_resolver
+        for dirpath in resolver.config_dirs():
+            if os.path.isdir(dirpath) and not self.plan_dirs.has_key(os.path.normpath(dirpath)):
+                self.plan_dirs[os.path.normpath(dirpath)] = dexy.plan_cache.directory_fingerprint(dirpath)
+
+        self.log.debug("parsed %s config files, resolved config for %s paths (%s cached lookups)" % (resolver.parse_count, resolver.resolve_count, resolver.cache_hits))
+
     def process_config(self):
         """
         Processes a populated config dict, identifies files to be processed,
@@ -276,10 +624,12 @@ class Controller(object):
             else:
                 virtual = False
 
-            regex = fnmatch.translate(glob_string).replace(".*", "(.*)")
-            matcher = re.compile(regex)
+            if not rootname_matchers.has_key(glob_string):
+                regex = fnmatch.translate(glob_string).replace(".*", "(.*)")
+                rootname_matchers[glob_string] = re.compile(regex)
+            matcher = rootname_matchers[glob_string]
 
-            files = glob.glob(glob_string)
+            files = self.file_index.glob(glob_string)
 
             nofiles = len(files) == 0
 
@@ -289,7 +639,7 @@ class Controller(object):
             for f in files:
                 create = True
                 if not virtual:
-                    if os.path.isdir(f):
+                    if self.file_index.isdir(f):
                         create = False
 
                 if args.has_key('disabled'):
@@ -342,7 +692,9 @@ class Controller(object):
 
                 if args.has_key('except'):
                     try:
-                        except_re = re.compile(args['except'])
+                        if not except_patterns.has_key(args['except']):
+                            except_patterns[args['except']] = re.compile(args['except'])
+                        except_re = except_patterns[args['except']]
                     except sre_constants.error as e:
                         raise dexy.commands.UserFeedback("""You passed 'except' value of %s.
 Please pass a valid Python-style regular expression for
@@ -376,6 +728,8 @@ re.compile: %s""" % (args['except'], e))
 
                     if self.members.has_key(key):
                         doc = self.members[key]
+                    else:
+                        self.register(doc)
 
                     if args.has_key('priority'):
                         doc.priority = args['priority']
@@ -398,16 +752,20 @@ re.compile: %s""" % (args['except'], e))
 
             return docs # end of parse_doc nested function
 
-        def get_pos(member):
-            key = member.key()
-            return self.members.keys().index(key)
+        # Compiled patterns, shared by every call to parse_doc.
+        rootname_matchers = {}
+        except_patterns = {}
 
         def depend(parent, child):
-            self.depends.append((get_pos(child), get_pos(parent)))
+            self.depends.append((child.id, parent.id))
 
         # The real processing starts here.
+        self.args['hashfunction'] = self.project_hashfunction()
+        dexy.hashing.new(self.args['hashfunction']) # raises UserFeedback if not available
+
         self.members = OrderedDict()
         self.depends = []
+        self.registry = []
 
         self.batch_id = self.db.next_batch_id()
         if not self.args['silent']:
@@ -442,8 +800,9 @@ re.compile: %s""" % (args['except'], e))
         # Determine dependencies
         total_dependencies = 0
         self.log.debug("Finalizing dependencies between documents...")
+        resolver = dexy.document.InputResolver(self.members)
         for doc in self.members.values():
-            doc.finalize_inputs(self.members)
+            doc.finalize_inputs(self.members, resolver)
             total_dependencies += len(doc.inputs)
             for input_doc in doc.inputs:
                 depend(doc, input_doc)
@@ -460,20 +819,17 @@ re.compile: %s""" % (args['except'], e))
             # Only run the specified document, and its dependencies.
             new_members = OrderedDict()
             new_depends = []
-
-            def new_get_pos(member):
-                key = member.key()
-                return new_members.keys().index(key)
-
-            def new_depend(parent, child):
-                new_depends.append((new_get_pos(child), new_get_pos(parent)))
+            parsed = set()
 
             def parse_new_document(d):
                 new_members[d.key()] = d
+                if d.id in parsed:
+                    return
+                parsed.add(d.id)
                 for input_doc in d.inputs:
-                    if not input_doc.key() in new_members.keys():
+                    if not new_members.has_key(input_doc.key()):
                         new_members[input_doc.key()] = input_doc
-                    new_depend(d, input_doc)
+                    new_depends.append((input_doc.id, d.id))
                     parse_new_document(input_doc)
 
             run_key = self.args['run']
@@ -514,12 +870,20 @@ re.compile: %s""" % (args['except'], e))
             answer, num_parents, children = e.args
             for child, parents in children.items():
                 for parent in parents:
-                    print "%s depends on %s" % (self.members.keys()[parent], self.members.keys()[child])
+                    print "%s depends on %s" % (self.registry[parent].key(), self.registry[child].key())
             raise dexy.commands.UserFeedback(e.message)
 
-        docs_without_dependencies = frozenset(range(len(self.members))) - frozenset(topsort_ordering)
-        self.ordering = topsort_ordering + list(docs_without_dependencies)
+        sorted_ids = frozenset(topsort_ordering)
+        docs_without_dependencies = [doc.id for doc in self.members.values() if not doc.id in sorted_ids]
+        self.ordering = topsort_ordering + docs_without_dependencies
 
         for i in self.ordering:
-            key = self.members.keys()[i]
-            self.docs.append(self.members[key])
+            self.docs.append(self.registry[i])
+
+    def register(self, doc):
+        """
+        Gives doc an integer id, its position in self.registry. Dependencies
+        and the run order refer to documents by these ids.
+        """
+        doc.id = len(self.registry)
+        self.registry.append(doc)
@@ -1,8 +1,7 @@
 from dexy.constants import Constants
-from ordereddict import OrderedDict
 import sqlite3
 import dexy.database
-import json
+import dexy.stat_index
 import os
 
 class SqliteDatabase(dexy.database.Database):
@@ -22,43 +21,147 @@ class SqliteDatabase(dexy.database.Database):
             ("source" , "text")
             ]
 
+    # Whitelisted attributes holding dicts, these are stored as JSON in the
+    # artifact_blobs table so queries on artifacts don't have to read them.
+    BLOB_KEYS = ['args', 'input_data_dict', 'inputs']
+
+    INDEXED_FIELDS = ['batch_id', 'hashstring', 'key']
+
     def create_table_sql(self):
         sql = "create table artifacts (id text primary key, %s)"
         fields = ["%s %s" % k for k in self.FIELDS]
-        fields.extend("%s text" % k for k in self.whitelist_keys)
+        fields.extend("%s text" % k for k in self.column_keys)
         return sql % (", ".join(fields))
 
+    def create_blobs_table_sql(self):
+        sql = "create table if not exists artifact_blobs (id text primary key, %s)"
+        return sql % (", ".join("%s text" % k for k in self.BLOB_KEYS))
+
+    def table_columns(self, table):
+        return [row[1] for row in self.conn.execute("PRAGMA table_info(%s)" % table)]
+
     def create_table(self):
-        try:
+        columns = self.table_columns("artifacts")
+        schema_changed = columns and columns != self.artifact_columns
+
+        if schema_changed:
+            self.conn.execute("ALTER TABLE artifacts RENAME TO artifacts_old")
+        if columns != self.artifact_columns:
             self.conn.execute(self.create_table_sql())
-        except sqlite3.OperationalError:
-            pass
+        self.conn.execute(self.create_blobs_table_sql())
+        if schema_changed:
+            self.copy_old_artifacts(columns)
+
+        for field in self.INDEXED_FIELDS:
+            sql = "create index if not exists artifacts_%s on artifacts (%s)"
+            self.conn.execute(sql % (field, field))
+        self.conn.commit()
 
-    def __init__(self, logsdir=Constants.DEFAULT_LDIR, dbfile=Constants.DEFAULT_DBFILE):
+    def copy_old_artifacts(self, columns):
+        """
+        Copies rows from an artifacts table created with a different schema,
+        which has been renamed to artifacts_old, and then drops it.
+        """
+        sql = "INSERT INTO %s (%s) SELECT %s FROM artifacts_old"
+        for table, table_columns in (("artifacts", self.artifact_columns), ("artifact_blobs", self.blob_columns)):
+            common = ", ".join(c for c in table_columns if c in columns)
+            self.conn.execute(sql % (table, common, common))
+        self.conn.execute("DROP TABLE artifacts_old")
+
+    def create_stat_index_table(self):
+        sql = """create table if not exists stat_index (path text primary key,
+            hashfunction text, binary int, size int, mtime real, ctime real,
+            inode int, data_hashes text)"""
+        self.conn.execute(sql)
+
+    # Number of buffered rows which triggers a flush.
+    FLUSH_SIZE = 1000
+
+    def __init__(self, logsdir=Constants.DEFAULT_LDIR, dbfile=Constants.DEFAULT_DBFILE, wal=False):
         self.logsdir = logsdir or ""
         if dbfile:
             filename = os.path.join(self.logsdir, dbfile)
             self.filename = filename
-            # TODO test that schema hasn't changed
         else:
             # use in-memory db
             self.filename = ":memory:"
 
         self.conn = sqlite3.connect(self.filename)
         self.conn.row_factory = sqlite3.Row
+        if wal:
+            # Faster writes, at the risk of losing the last transactions
+            # (but not corrupting the database) if the OS crashes.
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
 
         self.field_keys = [k[0] for k in self.FIELDS]
         self.whitelist_keys = sorted(Constants.ARTIFACT_HASH_WHITELIST)
-        self.field_names = ['id'] + self.field_keys + self.whitelist_keys
+        self.column_keys = [k for k in self.whitelist_keys if not k in self.BLOB_KEYS]
+        self.artifact_columns = ['id'] + self.field_keys + self.column_keys
+        self.blob_columns = ['id'] + self.BLOB_KEYS
+
+        # Rows are lists of values for these fields, the first values go in
+        # the artifacts table and the rest in artifact_blobs.
+        self.field_names = self.artifact_columns + self.BLOB_KEYS
+
         self.create_table()
+        self.create_stat_index_table()
         self.batch_orders = {}
         self.extra_keys = []
+        self._max_batch_id = None
+
+        self.insert_sql = self.build_insert_sql("artifacts", self.artifact_columns)
+        self.insert_blobs_sql = self.build_insert_sql("artifact_blobs", self.blob_columns)
+        self.update_sql = self.build_update_sql("artifacts", self.artifact_columns)
+        self.update_blobs_sql = self.build_update_sql("artifact_blobs", self.blob_columns)
+
+        # Rows waiting to be written, inserts are kept in order with an index
+        # of their positions by id.
+        self.pending_inserts = []
+        self.pending_insert_positions = {}
+        self.pending_updates = {}
+
+    def build_insert_sql(self, table, columns, statement="INSERT"):
+        return "%s INTO %s VALUES (%s)" % (statement, table, ",".join("?" * len(columns)))
+
+    def build_update_sql(self, table, columns):
+        set_fields = ", ".join("%s = ?" % k for k in columns[1:])
+        return "UPDATE %s SET %s where id = ?" % (table, set_fields)
 
     def persist(self):
+        self.flush()
         self.conn.commit()
 
+    def flush(self):
+        """
+        Writes any buffered rows in a single transaction.
+        """
+        if not self.pending_inserts and not self.pending_updates:
+            return
+
+        n = len(self.artifact_columns)
+        inserts = self.pending_inserts
+        updates = self.pending_updates.values()
+        with self.conn:
+            self.conn.executemany(self.insert_sql, (row[:n] for row in inserts))
+            self.conn.executemany(self.insert_blobs_sql, ([row[0]] + list(row[n:]) for row in inserts))
+            self.conn.executemany(self.update_sql, (list(row[1:n]) + [row[0]] for row in updates))
+            self.conn.executemany(self.update_blobs_sql, (list(row[n:]) + [row[0]] for row in updates))
+
+        self.pending_inserts = []
+        self.pending_insert_positions = {}
+        self.pending_updates = {}
+
+    def flush_if_full(self):
+        if len(self.pending_inserts) + len(self.pending_updates) >= self.FLUSH_SIZE:
+            self.flush()
+
     def max_batch_id(self):
-        return self.conn.execute("select max(batch_id) from artifacts").fetchone()[0] or 0
+        if self._max_batch_id is None:
+            self.flush()
+            sql = "select max(batch_id) from artifacts"
+            self._max_batch_id = self.conn.execute(sql).fetchone()[0] or 0
+        return self._max_batch_id
 
     def next_batch_id(self):
         return self.max_batch_id() + 1
@@ -78,54 +181,176 @@ class SqliteDatabase(dexy.database.Database):
         return self.max_batch_order(batch_id, True)
 
     def get_attributes_for_artifact(self, artifact):
-        hd = artifact.hash_dict()
+        hd = artifact.hash_dict_json()
         values = [artifact.unique_key()]
 
         # add attrs not in hash whitelist
         values.extend(getattr(artifact, k) for k in self.field_keys)
 
-        # get attrs from the hash whitelist, converting any OrderedDicts into JSON
-        artifact_values = (hd.get(k, None) for k in self.whitelist_keys)
-        convert_to_json = lambda v: isinstance(v, OrderedDict) and json.dumps(v) or v
-        values.extend(convert_to_json(v) for v in artifact_values)
+        # get attrs from the hash whitelist, with any OrderedDicts as JSON
+        values.extend(hd.get(k, None) for k in self.column_keys)
+        values.extend(hd.get(k, None) for k in self.BLOB_KEYS)
 
         return values
 
     def append_artifacts(self, artifacts):
-        qs = ("?," * len(self.field_names))[:-1]
-        sql = "INSERT INTO artifacts VALUES (%s)" % qs
-        for a in artifacts:
-            self.conn.execute(sql, self.get_attributes_for_artifact(a))
+        self.append_artifact_rows(self.get_attributes_for_artifact(a) for a in artifacts)
+
+    def append_artifact_rows(self, rows):
+        """
+        Inserts rows as returned by get_attributes_for_artifact. Rows are
+        buffered until the next flush.
+        """
+        for row in rows:
+            if self.pending_insert_positions.has_key(row[0]):
+                raise sqlite3.IntegrityError("column id is not unique: %s" % row[0])
+            self.pending_insert_positions[row[0]] = len(self.pending_inserts)
+            self.pending_inserts.append(row)
+            if self._max_batch_id is not None and row[1] > self._max_batch_id:
+                self._max_batch_id = row[1]
+        self.flush_if_full()
+
+    def copy_latest_rows(self, document_keys, to_batch_id):
+        """
+        Copies the artifact rows of each of document_keys in the latest batch
+        before to_batch_id which has that document into to_batch_id, unless
+        to_batch_id already has a row for the same artifact. The latest batch
+        can differ between documents, as batches run with -run or which
+        failed part way through only have some documents. A document is in a
+        batch if its last artifact, whose key is the document's key, is.
+        """
+        self.flush()
+        document_keys = list(document_keys)
+        if not document_keys:
+            return
+
+        # Batches to copy from and the id prefixes of the documents in each.
+        id_prefixes = {}
+        sql = "SELECT key, max(batch_id) FROM artifacts WHERE batch_id < ? AND key IN (%s) GROUP BY key"
+        for i in range(0, len(document_keys), 500):
+            keys = document_keys[i:i+500]
+            for key, batch_id in self.conn.execute(sql % ",".join("?" * len(keys)), [to_batch_id] + keys):
+                id_prefixes.setdefault(batch_id, []).append("%s:%s:" % (batch_id, key))
+
+        columns = ["a.%s" % k for k in self.artifact_columns] + ["b.%s" % k for k in self.BLOB_KEYS]
+        sql = "SELECT %s FROM artifacts a LEFT JOIN artifact_blobs b ON a.id = b.id WHERE a.batch_id = ?"
+        batch_id_index = self.field_names.index('batch_id')
+
+        rows = []
+        for from_batch_id, prefixes in id_prefixes.iteritems():
+            prefixes = tuple(prefixes)
+            old_prefix = "%s:" % from_batch_id
+            for row in self.conn.execute(sql % ", ".join(columns), (from_batch_id,)):
+                if row[0].startswith(prefixes):
+                    row = list(row)
+                    row[0] = "%s:%s" % (to_batch_id, row[0][len(old_prefix):])
+                    row[batch_id_index] = to_batch_id
+                    rows.append(row)
+
+        n = len(self.artifact_columns)
+        insert_sql = self.build_insert_sql("artifacts", self.artifact_columns, "INSERT OR IGNORE")
+        insert_blobs_sql = self.build_insert_sql("artifact_blobs", self.blob_columns, "INSERT OR IGNORE")
+        with self.conn:
+            self.conn.executemany(insert_sql, (row[:n] for row in rows))
+            self.conn.executemany(insert_blobs_sql, ([row[0]] + row[n:] for row in rows))
+
+        if rows and self._max_batch_id is not None and to_batch_id > self._max_batch_id:
+            self._max_batch_id = to_batch_id
 
     def update_artifact(self, artifact):
-        values = self.get_attributes_for_artifact(artifact)[1:]
-        values.append(artifact.unique_key())
-        sql = "UPDATE artifacts SET %s where id = ?" % (", ".join("%s = ? " % k for k in self.field_names[1:]))
-        self.conn.execute(sql, values)
+        self.update_artifact_row(self.get_attributes_for_artifact(artifact))
+
+    def update_artifact_row(self, row):
+        """
+        Updates the artifact whose id is the first element of row, a list as
+        returned by get_attributes_for_artifact.
+        """
+        if self.pending_insert_positions.has_key(row[0]):
+            # Not written yet, so just write the updated row instead.
+            self.pending_inserts[self.pending_insert_positions[row[0]]] = row
+        else:
+            self.pending_updates[row[0]] = row
+            self.flush_if_full()
+
+    def stat_entries(self):
+        """
+        Returns a dict of stat index entries keyed on path.
+        """
+        entries = {}
+        for row in self.conn.execute("SELECT * from stat_index"):
+            entries[row['path']] = {
+                'hashfunction' : row['hashfunction'],
+                'binary' : row['binary'],
+                'stat' : [row['size'], row['mtime'], row['ctime'], row['inode']],
+                'data_hashes' : dexy.stat_index.decode_data_hashes(row['data_hashes'])
+            }
+        return entries
+
+    def update_stat_entries(self, entries):
+        sql = "INSERT OR REPLACE INTO stat_index VALUES (?,?,?,?,?,?,?,?)"
+        rows = []
+        for path, entry in entries.iteritems():
+            row = [path, entry['hashfunction'], entry['binary']]
+            row.extend(entry['stat'])
+            row.append(dexy.stat_index.encode_data_hashes(entry['data_hashes']))
+            rows.append(row)
+        with self.conn:
+            self.conn.executemany(sql, rows)
 
     def artifact_row(self, artifact):
         """Returns the db row corresponding to an artifact."""
-        sql = "SELECT * from artifacts where id = ?"
+        self.flush()
+        sql = "SELECT * from artifacts LEFT JOIN artifact_blobs USING (id) where id = ?"
         return self.conn.execute(sql, (artifact.unique_key(),)).fetchone()
 
     def references_for_batch_id(self, batch_id=None):
         """
         Return information for a given batch.
         """
+        self.flush()
         if not batch_id:
             # use most recent batch
             batch_id = self.max_batch_id()
         sql = "SELECT * from artifacts where batch_id = ?"
         return self.conn.execute(sql, (batch_id,)).fetchall()
 
+    def last_used_batch_ids(self):
+        """
+        Returns a dict of the last batch each hashstring appears in.
+        """
+        self.flush()
+        sql = "SELECT hashstring, max(batch_id) from artifacts GROUP BY hashstring"
+        return dict((str(row[0]), row[1]) for row in self.conn.execute(sql))
+
+    def reachable_hashstrings(self, keep):
+        """
+        Returns the set of hashstrings in the last keep batches, along with
+        the hashstrings each artifact key had in the last batch it appears in,
+        which covers documents that didn't run in recent batches because they
+        weren't affected by changes.
+        """
+        self.flush()
+        min_batch_id = self.max_batch_id() - keep + 1
+        sql = "SELECT hashstring from artifacts where batch_id >= ?"
+        hashstrings = set(str(row[0]) for row in self.conn.execute(sql, (min_batch_id,)))
+        sql = """SELECT a.hashstring from artifacts a JOIN
+            (SELECT key, max(batch_id) as batch_id from artifacts GROUP BY key) m
+            ON a.key = m.key and a.batch_id = m.batch_id"""
+        hashstrings.update(str(row[0]) for row in self.conn.execute(sql))
+        return hashstrings
+
     def all(self, limit=None):
+        self.flush()
         if limit:
             return self.conn.execute("SELECT * from artifacts LIMIT ?", (limit,)).fetchall()
         else:
             return self.conn.execute("SELECT * from artifacts").fetchall()
 
     def query_unique_key(self, unique_key):
-        return self.conn.execute("SELECT * from artifacts where id = ?", (unique_key,)).fetchall()
+        self.flush()
+        sql = "SELECT * from artifacts LEFT JOIN artifact_blobs USING (id) where id = ?"
+        return self.conn.execute(sql, (unique_key,)).fetchall()
 
     def query_like(self, query):
+        self.flush()
         return self.conn.execute("SELECT * from artifacts where (is_last = 'True' or additional='True') and batch_id = ? and key like ?", (self.max_batch_id(), query,)).fetchall()
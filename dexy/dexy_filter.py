@@ -1,6 +1,5 @@
 import dexy.utils
 import dexy.commands
-import shutil
 import platform
 import subprocess
 import os
@@ -25,6 +24,9 @@ class DexyFilter(object):
     VERSION_COMMAND = None
     WINDOWS_VERSION_COMMAND = None
 
+    # A dexy.version_cache.VersionCache, set by the controller.
+    version_cache = None
+
     @classmethod
     def executables(self):
         """
@@ -67,6 +69,11 @@ class DexyFilter(object):
         vc = klass.version_command()
 
         if vc:
+            if klass.version_cache:
+                entry = klass.version_cache.lookup(vc)
+                if entry:
+                    return entry['version']
+
             # TODO make custom env available here...
             proc = subprocess.Popen(vc, shell=True,
                                     stdout=subprocess.PIPE,
@@ -77,9 +84,13 @@ class DexyFilter(object):
                 err_msg = """An error occurred running %s""" % vc
                 if log:
                     log.debug(err_msg)
-                return False
+                version = False
             else:
-                return stdout.strip().split("\n")[0]
+                version = stdout.strip().split("\n")[0]
+
+            if klass.version_cache:
+                klass.version_cache.update(vc, version)
+            return version
         else:
             return None
 
@@ -211,12 +222,12 @@ class DexyFilter(object):
             if self.artifact.input_data_dict:
                 # This code implements the neutral 'dexy' handler.
                 if self.artifact.binary_output:
-                    shutil.copyfile(self.artifact.previous_artifact_filepath, self.artifact.filepath())
+                    self.artifact.copy_output_from(self.artifact.previous_artifact_filepath)
                 else:
                     self.artifact.data_dict = self.artifact.input_data_dict
             else:
                 if os.path.exists(self.artifact.previous_artifact_filepath) and not os.path.exists(self.artifact.filepath()):
-                    shutil.copyfile(self.artifact.previous_artifact_filepath, self.artifact.filepath())
+                    self.artifact.copy_output_from(self.artifact.previous_artifact_filepath)
 
             method_used = "process"
 
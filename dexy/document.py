@@ -10,7 +10,6 @@ import json
 import logging
 import os
 import re
-import shutil
 import time
 import urllib2
 
@@ -20,12 +19,167 @@ try:
 except ImportError:
     USE_GIT = False
 
+GLOB_CHARS = re.compile("[*?[]")
+
+def doc_dir(doc):
+    return os.path.dirname(doc.name) or "."
+
+class InputResolver(object):
+    """
+    Indexes documents by key, key basename and directory so that each
+    document's inputs can be found by lookups rather than by comparing the
+    document with every other document.
+    """
+    def __init__(self, members_dict):
+        self.docs = members_dict.values()
+        self.keys = [doc.key() for doc in self.docs]
+        self.dirs = [doc_dir(doc) for doc in self.docs]
+        self.basenames = [os.path.basename(k) for k in self.keys]
+
+        self.by_key = {}
+        self.by_basename = {}
+        self.by_dir = {}
+        for pos, key in enumerate(self.keys):
+            self.by_key[key] = pos
+            self.by_basename.setdefault(self.basenames[pos], []).append(pos)
+            self.by_dir.setdefault(self.dirs[pos], []).append(pos)
+
+        # With normalized relative paths, a directory can only be at or below
+        # another if its name starts with the other's name.
+        self.clean_dirs = all(os.path.normpath(d) == d and not os.path.isabs(d) for d in self.by_dir)
+
+        self.matchers = {}
+        self.relations = {}
+        self.specified = {}
+        self.within = {}
+
+    def relation(self, dir1, dir2):
+        """
+        Returns (relpath2, in_parent_dir, in_same_dir, in_parent_or_child) for
+        a document in dir1 relative to a document in dir2.
+        """
+        if not self.relations.has_key((dir1, dir2)):
+            relpath = os.path.relpath(dir1, dir2)
+            relpath2 = os.path.relpath(dir2, dir1)
+
+            # Whether the document is in parent dir of input
+            in_parent_dir = not (".." in relpath) and not (relpath == ".")
+            in_same_dir = (relpath == ".") and (relpath2 == ".")
+            in_parent_or_child = (relpath == ".") or ((not ".." in relpath) ^ (not ".." in relpath2))
+
+            self.relations[(dir1, dir2)] = (relpath2, in_parent_dir, in_same_dir, in_parent_or_child)
+        return self.relations[(dir1, dir2)]
+
+    def matcher(self, input_glob):
+        if not self.matchers.has_key(input_glob):
+            self.matchers[input_glob] = re.compile(fnmatch.translate(os.path.normcase(input_glob))).match
+        return self.matchers[input_glob]
+
+    def dirs_within(self, dir2):
+        """
+        Directories which may be dir2 or below it. This can include other
+        directories, so callers must still check relation().
+        """
+        if not self.within.has_key(dir2):
+            if dir2 == "." or not self.clean_dirs:
+                self.within[dir2] = self.by_dir.keys()
+            else:
+                prefix = dir2 + os.sep
+                self.within[dir2] = [d for d in self.by_dir if d == dir2 or d.startswith(prefix)]
+        return self.within[dir2]
+
+    def specified_positions(self, input_glob, dir2):
+        """
+        Positions of documents which match an entry in a document's 'inputs'
+        when the document is in dir2.
+        """
+        if self.specified.has_key((input_glob, dir2)):
+            return self.specified[(input_glob, dir2)]
+
+        found = set()
+
+        # The full doc key is specified
+        if self.by_key.has_key(input_glob):
+            found.add(self.by_key[input_glob])
+
+        # Any other match on the whole key ends in the basename of input_glob.
+        for pos in self.by_basename.get(os.path.basename(input_glob), []):
+            relpath2, in_parent_dir, in_same_dir, in_parent_or_child = self.relation(self.dirs[pos], dir2)
+
+            # The relative path doc key is specified
+            if os.path.join(relpath2, input_glob) == self.keys[pos]:
+                found.add(pos)
+
+            # The basename of the key is specified, in a parent or child dir
+            # (also covers non-glob patterns matching in a child dir)
+            if self.basenames[pos] == input_glob and (in_parent_or_child or in_parent_dir or in_same_dir):
+                found.add(pos)
+
+        # A glob matches in any child dir
+        if GLOB_CHARS.search(input_glob):
+            match = self.matcher(input_glob)
+            for dir1 in self.dirs_within(dir2):
+                relpath2, in_parent_dir, in_same_dir, in_parent_or_child = self.relation(dir1, dir2)
+                if in_parent_dir or in_same_dir:
+                    found.update(pos for pos in self.by_dir[dir1] if match(os.path.normcase(self.basenames[pos])))
+
+        self.specified[(input_glob, dir2)] = found
+        return found
+
+    def all_inputs_positions(self, doc, dir2, strictinherit):
+        """
+        Positions of documents which doc takes as inputs because it has
+        'allinputs' set.
+        """
+        found = set()
+        for dir1, positions in self.by_dir.iteritems():
+            relpath2, in_parent_dir, in_same_dir, in_parent_or_child = self.relation(dir1, dir2)
+            if strictinherit and not in_parent_or_child:
+                continue
+
+            for pos in positions:
+                other = self.docs[pos]
+                # Work out relative priority
+                higher_priority = (doc.priority > other.priority)
+                equal_priority = (doc.priority == other.priority)
+                if higher_priority or (equal_priority and in_parent_dir) or not other.use_all_inputs:
+                    found.add(pos)
+        return found
+
+    def inputs_for(self, doc, strictinherit=False):
+        """
+        Returns the documents which doc will have as inputs, in the order of
+        members_dict.
+        """
+        if not (doc.input_args or doc.input_keys or doc.use_all_inputs or doc.args.has_key('exact-inputs')):
+            return []
+
+        dir2 = doc_dir(doc)
+        found = set()
+
+        for k in doc.input_keys:
+            if self.by_key.has_key(k):
+                found.add(self.by_key[k])
+
+        for k in doc.args.get('exact-inputs', []):
+            if self.by_key.has_key(k):
+                found.add(self.by_key[k])
+
+        for input_glob in doc.input_args:
+            found.update(self.specified_positions(input_glob, dir2))
+
+        if doc.use_all_inputs:
+            found.update(self.all_inputs_positions(doc, dir2, strictinherit))
+
+        return [self.docs[pos] for pos in sorted(found)]
+
 class Document(object):
     def __init__(self):
         # initialize attributes
         self.args = {}
         self.artifacts = []
         self.elapsed = 0
+        self.id = None
         self.input_args = []
         self.input_keys = []
         self.inputs = []
@@ -45,6 +199,41 @@ class Document(object):
             "timing" : self.timing
         }
 
+    def plan_info(self):
+        """
+        Returns the attributes set while processing config, for the plan cache.
+        """
+        info = {
+            "name" : self.name,
+            "filters" : self.filters,
+            "args" : self.args,
+            "priority" : self.priority,
+            "virtual" : self.virtual,
+            "use_all_inputs" : self.use_all_inputs,
+            "input_args" : self.input_args,
+            "input_keys" : self.input_keys,
+            "inputs" : [doc.id for doc in self.inputs]
+        }
+        if hasattr(self, 'loglevelname'):
+            info['loglevelname'] = self.loglevelname
+        return info
+
+    def load_plan_info(self, info):
+        """
+        Restores the attributes saved by plan_info, except for inputs which the
+        controller links up once every document has been created.
+        """
+        self.set_name_and_filters(info['name'], info['filters'])
+        self.args = info['args']
+        self.priority = info['priority']
+        self.virtual = info['virtual']
+        self.use_all_inputs = info['use_all_inputs']
+        self.input_args = info['input_args']
+        self.input_keys = info['input_keys']
+        if info.has_key('loglevelname'):
+            self.loglevelname = info['loglevelname']
+        self.setup_log()
+
     def set_controller(self, controller):
         self.controller = controller
 
@@ -99,70 +288,16 @@ class Document(object):
         if not input_key in self.input_keys:
             self.input_keys.append(input_key)
 
-    def finalize_inputs(self, members_dict):
+    def finalize_inputs(self, members_dict, resolver=None):
         """
         Called during setup, this method resolves which other docs this doc
-        will depend on (have as inputs).
+        will depend on (have as inputs). Pass an InputResolver built from
+        members_dict when finalizing many docs, so the index is built once.
         """
         start = time.time()
-        if len(self.input_args) > 0 or len(self.input_keys) > 0 or self.use_all_inputs or self.args.has_key('exact-inputs'):
-            for doc in members_dict.values():
-                if doc.key() in self.input_keys:
-                    self.inputs.append(doc)
-                else:
-                    # Work out relative paths
-                    dir1 = os.path.dirname(doc.name)
-                    dir2 = os.path.dirname(self.name)
-                    if dir1 == '':
-                        dir1 = "."
-                    if dir2 == "":
-                        dir2 = "."
-
-                    relpath = os.path.relpath(dir1, dir2)
-                    relpath2 = os.path.relpath(dir2, dir1)
-
-                    # Whether the document is in parent dir of input
-                    in_parent_dir = not (".." in relpath) and not (relpath == ".")
-                    in_same_dir = (relpath == ".") and (relpath2 == ".")
-                    in_parent_or_child = (relpath == ".") or ((not ".." in relpath) ^ (not ".." in relpath2))
-
-                    # See if input matches an item in inputs
-                    specified = False
-                    for input_glob in self.input_args:
-                        # The full doc key is specified
-                        is_exact_absolute_match = (input_glob == doc.key())
-
-                        # The relative path doc key is specified
-                        is_exact_relative_match = (os.path.join(relpath2, input_glob) == doc.key())
-
-                        is_exact_match_in_parent_or_child_dir = (in_parent_or_child and input_glob == os.path.basename(doc.key()))
-
-                        # A glob matches in any child dir
-                        is_glob_match_in_child_dir = (in_parent_dir or in_same_dir) and fnmatch.fnmatch(os.path.basename(doc.key()), input_glob)
-
-                        specified = (is_exact_absolute_match or is_exact_relative_match or is_exact_match_in_parent_or_child_dir or is_glob_match_in_child_dir)
-
-                        if specified:
-                           break
-
-                    if self.args.has_key('exact-inputs'):
-                        for exact_input in self.args['exact-inputs']:
-                            if not specified:
-                                specified = exact_input == doc.key()
-
-                    # Work out relative priority
-                    higher_priority = (self.priority > doc.priority)
-                    equal_priority = (self.priority == doc.priority)
-
-                    use_all_inputs = self.use_all_inputs
-                    also_all_inputs = doc.use_all_inputs
-
-                    all_inputs_and_qualified = use_all_inputs and (higher_priority or (equal_priority and in_parent_dir) or not also_all_inputs)
-                    disqualified_by_strictinherit = self.controller.args['strictinherit'] and not (in_parent_or_child)
-
-                    if specified or (all_inputs_and_qualified and not disqualified_by_strictinherit):
-                        self.inputs.append(doc)
-
+        if not resolver:
+            resolver = InputResolver(members_dict)
+        self.inputs.extend(resolver.inputs_for(self, self.controller.args['strictinherit']))
         elapsed = time.time() - start
         self.timing.append(("finalize-inputs", elapsed))
 
@@ -335,8 +470,8 @@ class Document(object):
                         initial_artifact_data = artifact.doc.initial_artifact_data()
                         if initial_artifact_data:
                             f.write(artifact.doc.initial_artifact_data())
-            else:
-                shutil.copyfile(artifact.name, artifact.filepath())
+            elif not (artifact.deferred_source and artifact.is_canonical_output_cached()):
+                artifact.copy_output_from(artifact.name)
         return artifact
 
     def setup(self):
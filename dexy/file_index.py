@@ -0,0 +1,171 @@
+"""
+Index of directory listings, so that the globs in config files can be expanded
+without listing a directory or checking whether a file is a directory more
+than once, and the walker which lists every directory in a project.
+"""
+import dexy.commands
+import fnmatch
+import glob
+import os
+import re
+import sre_constants
+
+try:
+    from os import scandir
+    USE_SCANDIR = True
+except ImportError:
+    try:
+        # The backport's C extension. Importing the scandir module itself
+        # runs ldconfig to set up a ctypes fallback, even when it isn't used.
+        from _scandir import scandir
+        USE_SCANDIR = True
+    except ImportError:
+        try:
+            from scandir import scandir
+            USE_SCANDIR = True
+        except ImportError:
+            USE_SCANDIR = False
+
+def list_dir(dirpath):
+    """
+    Returns a list of the names of subdirectories of dirpath, a list of the
+    names of other files and a set of the subdirectory names which are
+    symlinks. Uses scandir if available, which can usually tell directories
+    from files without calling stat.
+    """
+    dirnames = []
+    filenames = []
+    symlinks = set()
+    if USE_SCANDIR:
+        for entry in scandir(dirpath):
+            if entry.is_dir():
+                dirnames.append(entry.name)
+                if entry.is_symlink():
+                    symlinks.add(entry.name)
+            else:
+                filenames.append(entry.name)
+    else:
+        for name in os.listdir(dirpath):
+            path = os.path.join(dirpath, name)
+            if os.path.isdir(path):
+                dirnames.append(name)
+                if os.path.islink(path):
+                    symlinks.add(name)
+            else:
+                filenames.append(name)
+    return dirnames, filenames, symlinks
+
+def exclusion_regex(patterns):
+    """
+    Combines the regular expressions passed to -exclude into one, which
+    matches a directory name if any of them do. Returns None if there are no
+    patterns.
+    """
+    if not patterns:
+        return None
+    try:
+        return re.compile("|".join("(?:%s)" % p for p in patterns))
+    except sre_constants.error as e:
+        msg = "You passed 'exclude' patterns %s, please pass valid Python-style regular expressions. Error message from re.compile: %s"
+        raise dexy.commands.UserFeedback(msg % (", ".join(patterns), e))
+
+def walk_project(top, exclude_at_root, exclude_everywhere, exclude_regex=None):
+    """
+    Walks the directories from top down, like os.walk without following
+    symlinks, yielding (dirpath, dirnames, filenames, process_dir) for each
+    one. dirnames is the full list of subdirectories, the walker itself skips
+    those named in exclude_everywhere, those named in exclude_at_root when
+    dirpath is '.' and those matching exclude_regex. A directory containing a
+    .nodexy file is yielded with process_dir False and none of its
+    subdirectories are walked.
+    """
+    exclude_at_root = frozenset(exclude_at_root)
+    exclude_everywhere = frozenset(exclude_everywhere)
+
+    stack = [top]
+    while stack:
+        dirpath = stack.pop()
+        try:
+            dirnames, filenames, symlinks = list_dir(dirpath)
+        except os.error:
+            continue
+        dirnames.sort()
+        filenames.sort()
+
+        process_dir = not '.nodexy' in filenames
+        yield dirpath, dirnames, filenames, process_dir
+
+        if process_dir:
+            children = []
+            for d in dirnames:
+                if d in symlinks or d in exclude_everywhere:
+                    continue
+                elif dirpath == "." and d in exclude_at_root:
+                    continue
+                elif exclude_regex and exclude_regex.match(d):
+                    continue
+                children.append(os.path.join(dirpath, d))
+            stack.extend(reversed(children))
+
+class FileIndex(object):
+    """
+    Holds the names of the files and subdirectories in each directory. Listings
+    are added while walking the project and any other directory is listed the
+    first time it is needed.
+    """
+    def __init__(self):
+        self.listings = {}
+        self.matchers = {}
+        self.list_count = 0
+
+    def add_dir(self, dirpath, dirnames, filenames):
+        self.listings[os.path.normpath(dirpath)] = (sorted(dirnames + filenames), set(dirnames))
+
+    def listing(self, dirpath):
+        """
+        Returns a sorted list of the names in dirpath and a set of the names
+        which are directories, or None if the directories aren't known.
+        """
+        dirpath = os.path.normpath(dirpath)
+        if not self.listings.has_key(dirpath):
+            self.list_count += 1
+            try:
+                self.listings[dirpath] = (sorted(os.listdir(dirpath)), None)
+            except os.error:
+                self.listings[dirpath] = ([], set())
+        return self.listings[dirpath]
+
+    def matcher(self, pattern):
+        if not self.matchers.has_key(pattern):
+            self.matchers[pattern] = re.compile(fnmatch.translate(os.path.normcase(pattern))).match
+        return self.matchers[pattern]
+
+    def glob(self, pattern):
+        """
+        Does what glob.glob does for a pattern whose wildcards are all in its
+        last path component, with the matches sorted.
+        """
+        dirname, basename = os.path.split(pattern)
+        if not basename:
+            return [pattern] if dirname and self.isdir(dirname) else []
+
+        names = self.listing(dirname or ".")[0]
+        if not glob.has_magic(basename):
+            matching = [basename] if basename in names else []
+        else:
+            match = self.matcher(basename)
+            hidden_ok = basename.startswith(".")
+            matching = [n for n in names if match(os.path.normcase(n)) and (hidden_ok or not n.startswith("."))]
+
+        if dirname:
+            return [os.path.join(dirname, n) for n in matching]
+        else:
+            return matching
+
+    def isdir(self, path):
+        dirname, basename = os.path.split(path)
+        dirs = self.listing(dirname or ".")[1]
+        if dirs is None:
+            return os.path.isdir(path)
+        else:
+            return basename in dirs
@@ -1,5 +1,4 @@
 from dexy.dexy_filter import DexyFilter
-import shutil
 
 class ForceCPickleExtensionFilter(DexyFilter):
     """
@@ -83,7 +82,7 @@ class ForcePdfExtensionFilter(DexyFilter):
     BINARY = True
 
     def process(self):
-        shutil.copyfile(self.artifact.previous_artifact_filepath, self.artifact.filepath())
+        self.artifact.copy_output_from(self.artifact.previous_artifact_filepath)
 
 class ForceJpgExtensionFilter(DexyFilter):
     """
@@ -95,7 +94,7 @@ class ForceJpgExtensionFilter(DexyFilter):
     BINARY = True
 
     def process(self):
-        shutil.copyfile(self.artifact.previous_artifact_filepath, self.artifact.filepath())
+        self.artifact.copy_output_from(self.artifact.previous_artifact_filepath)
 
 class ForcePngExtensionFilter(DexyFilter):
     """
@@ -107,7 +106,7 @@ class ForcePngExtensionFilter(DexyFilter):
     BINARY = True
 
     def process(self):
-        shutil.copyfile(self.artifact.previous_artifact_filepath, self.artifact.filepath())
+        self.artifact.copy_output_from(self.artifact.previous_artifact_filepath)
 
 class ForceGifExtensionFilter(DexyFilter):
     """
@@ -119,7 +118,7 @@ class ForceGifExtensionFilter(DexyFilter):
     BINARY = True
 
     def process(self):
-        shutil.copyfile(self.artifact.previous_artifact_filepath, self.artifact.filepath())
+        self.artifact.copy_output_from(self.artifact.previous_artifact_filepath)
 
 class ForceBmpExtensionFilter(DexyFilter):
     """
@@ -131,7 +130,7 @@ class ForceBmpExtensionFilter(DexyFilter):
     BINARY = True
 
     def process(self):
-        shutil.copyfile(self.artifact.previous_artifact_filepath, self.artifact.filepath())
+        self.artifact.copy_output_from(self.artifact.previous_artifact_filepath)
 
 class ConvertBashExtensionFilter(DexyFilter):
     """
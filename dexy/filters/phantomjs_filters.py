@@ -1,6 +1,7 @@
 from dexy.filters.process_filters import SubprocessFilter
 from dexy.filters.process_filters import SubprocessStdoutFilter
 from ordereddict import OrderedDict
+import dexy.blob_store
 import json
 import os
 import re
@@ -280,6 +281,7 @@ class PhantomJsRenderJavascriptInteractiveFilter(SubprocessFilter):
             src = os.path.join(self.setup_cwd(), i.filename())
             if (i.virtual or i.additional) and os.path.exists(src):
                 self.log.debug("Copying %s to %s (%s)" % (src, i.filepath(), i.key))
+                dexy.blob_store.release(i.filepath())
                 shutil.copy(src, i.filepath())
 
         self.copy_canonical_file()
@@ -1,5 +1,6 @@
 from dexy.commands import UserFeedback
 from dexy.dexy_filter import DexyFilter
+import dexy.blob_store
 import os
 import shutil
 import subprocess
@@ -135,6 +136,7 @@ class ProcessFilter(DexyFilter):
             self.log.debug("Checking input %s at %s" % (i.key, src))
             if (i.virtual or i.additional) and os.path.exists(src):
                 self.log.debug("Copying %s to %s" % (src, i.filepath()))
+                dexy.blob_store.release(i.filepath())
                 shutil.copy(src, i.filepath())
             else:
                 self.log.debug("Not copying %s" % src)
@@ -0,0 +1,150 @@
+"""
+Removes artifacts which recent batches don't use from the artifacts
+directory, for 'dexy gc'. Artifacts used by the last few batches are kept, the
+others are removed least recently used first until the directory fits in a
+size budget.
+"""
+import dexy.blob_store
+import dexy.commands
+import dexy.hashing
+import os
+import re
+import shutil
+
+ARTIFACT_NAME_REGEX = re.compile("^([0-9a-f]+)([-.].*)?$")
+
+def path_size(path):
+    """
+    Returns the number of bytes in the file or directory tree at path.
+    """
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    size = 0
+    for dirpath, dirnames, filenames in os.walk(path):
+        for filename in filenames:
+            size += os.path.getsize(os.path.join(dirpath, filename))
+    return size
+
+def directory_size(path):
+    """
+    Returns the number of bytes in the files under path, counting files with
+    more than one link once.
+    """
+    size = 0
+    inodes = set()
+    for dirpath, dirnames, filenames in os.walk(path):
+        for filename in filenames:
+            stat_info = os.lstat(os.path.join(dirpath, filename))
+            if stat_info.st_nlink > 1:
+                if stat_info.st_ino in inodes:
+                    continue
+                inodes.add(stat_info.st_ino)
+            size += stat_info.st_size
+    return size
+
+class ArtifactFiles(object):
+    """
+    The meta file, output, section index, work files and temp dir for one
+    hashstring in the artifacts directory.
+    """
+    def __init__(self, hashstring):
+        self.hashstring = hashstring
+        self.paths = []
+        self.mtime = 0
+
+    def add(self, path):
+        self.paths.append(path)
+        self.mtime = max(self.mtime, os.lstat(path).st_mtime)
+
+def artifact_files(artifacts_dir, known_hashstrings):
+    """
+    Returns a dict of ArtifactFiles for the hashstrings of the files in
+    artifacts_dir. A name starts with a hashstring if it is in
+    known_hashstrings or is as long as the digests of a hash function, since
+    artifacts may have been made with a different -hashfunction. Other
+    files, such as key-value stores named after documents and the blob
+    store, are left out.
+    """
+    lengths = dexy.hashing.digest_lengths()
+    groups = {}
+    for name in os.listdir(artifacts_dir):
+        m = ARTIFACT_NAME_REGEX.match(name)
+        if not m or "-kv" in name:
+            continue
+        hashstring = m.group(1)
+        if not (known_hashstrings.has_key(hashstring) or len(hashstring) in lengths):
+            continue
+        if not groups.has_key(hashstring):
+            groups[hashstring] = ArtifactFiles(hashstring)
+        groups[hashstring].add(os.path.join(artifacts_dir, name))
+    return groups
+
+class GarbageCollector(object):
+    """
+    Removes the files of artifacts which don't appear in the last keep
+    batches recorded in db from artifacts_dir, least recently used first,
+    until the directory holds no more than max_bytes.
+    """
+    def __init__(self, db, artifacts_dir, keep, max_bytes=0):
+        self.db = db
+        self.artifacts_dir = artifacts_dir
+        self.keep = keep
+        self.max_bytes = max_bytes
+        self.blob_store = dexy.blob_store.BlobStore(artifacts_dir)
+
+    def remove_path(self, path):
+        """
+        Removes a file or directory and returns the number of bytes freed.
+        """
+        if os.path.isdir(path):
+            size = path_size(path)
+            shutil.rmtree(path)
+            return size
+        elif os.stat(path).st_nlink > 1:
+            # Linked to a blob, which is freed when nothing else uses it.
+            content_hash = self.blob_store.remove(path)
+            if content_hash:
+                return self.blob_store.remove_blob(content_hash)
+            return 0
+        else:
+            size = os.path.getsize(path)
+            os.remove(path)
+            return size
+
+    def collect(self):
+        """
+        Removes unused artifacts and returns a dict describing what was done.
+        """
+        if self.db.max_batch_id() == 0:
+            raise dexy.commands.UserFeedback("No batches have been recorded, so there is nothing to tell which artifacts are in use.")
+
+        reachable = self.db.reachable_hashstrings(self.keep)
+        last_used = self.db.last_used_batch_ids()
+
+        size_before = directory_size(self.artifacts_dir)
+        size = size_before
+
+        # Blobs left behind if a run was interrupted.
+        for content_hash in self.blob_store.unreferenced_blobs():
+            size -= self.blob_store.remove_blob(content_hash)
+
+        groups = artifact_files(self.artifacts_dir, last_used)
+        unreachable = [g for h, g in groups.iteritems() if not h in reachable]
+        unreachable.sort(key=lambda g: (last_used.get(g.hashstring, 0), g.mtime))
+
+        removed = 0
+        for group in unreachable:
+            if size <= self.max_bytes:
+                break
+            for path in group.paths:
+                size -= self.remove_path(path)
+            removed += 1
+
+        return {
+            'reachable' : len(reachable),
+            'removed' : removed,
+            'kept_unreachable' : len(unreachable) - removed,
+            'bytes_before' : size_before,
+            'bytes_after' : size,
+            'bytes_reclaimed' : size_before - size
+        }
@@ -0,0 +1,174 @@
+"""
+Registry of the hash functions which can be used to calculate artifact
+hashstrings. Each hash function is registered under a name, which is what is
+passed to the -hashfunction option or set as 'hashfunction' in $globals, along
+with a callable returning a new object with hashlib's update/hexdigest
+interface.
+"""
+from ordereddict import OrderedDict
+import dexy.commands
+import functools
+import hashlib
+import struct
+import zlib
+
+try:
+    import xxhash
+    USE_XXHASH = True
+except ImportError:
+    USE_XXHASH = False
+
+try:
+    import pyblake2
+    USE_PYBLAKE2 = True
+except ImportError:
+    USE_PYBLAKE2 = False
+
+HASH_FUNCTIONS = OrderedDict()
+
+def register_hash_function(name, constructor):
+    HASH_FUNCTIONS[name] = constructor
+
+def new(name):
+    """
+    Returns a new hash object for the hash function registered as name.
+    """
+    if not HASH_FUNCTIONS.has_key(name):
+        msg = "unexpected hash function '%s', available hash functions are: %s"
+        raise dexy.commands.UserFeedback(msg % (name, ", ".join(HASH_FUNCTIONS.keys())))
+    return HASH_FUNCTIONS[name]()
+
+def digest_lengths():
+    """
+    Returns the set of the lengths of the hexdigests of the registered hash
+    functions whose hexdigests are always the same length, which leaves out
+    the checksums.
+    """
+    lengths = set()
+    for constructor in HASH_FUNCTIONS.itervalues():
+        empty = constructor()
+        nonempty = constructor()
+        nonempty.update("dexy")
+        if len(empty.hexdigest()) == len(nonempty.hexdigest()):
+            lengths.add(len(empty.hexdigest()))
+    return lengths
+
+class ChecksumHash(object):
+    """
+    Gives zlib's crc32 and adler32 checksums the update/hexdigest interface of
+    hashlib's hash objects.
+    """
+    def __init__(self, checksum):
+        self.checksum = checksum
+        self.value = checksum("")
+
+    def update(self, data):
+        self.value = self.checksum(data, self.value)
+
+    def hexdigest(self):
+        return str(self.value & 0xffffffff)
+
+MASK64 = 0xffffffffffffffff
+PRIME64_1 = 11400714785074694791
+PRIME64_2 = 14029467366897019727
+PRIME64_3 = 1609587929392839161
+PRIME64_4 = 9650029242287828579
+PRIME64_5 = 2870177450012600261
+
+def rotl64(x, r):
+    return ((x << r) | (x >> (64 - r))) & MASK64
+
+def xxh64_round(acc, lane):
+    acc = (acc + lane * PRIME64_2) & MASK64
+    return (rotl64(acc, 31) * PRIME64_1) & MASK64
+
+def xxh64_merge_round(acc, val):
+    acc ^= xxh64_round(0, val)
+    return (acc * PRIME64_1 + PRIME64_4) & MASK64
+
+class PurePythonXXH64(object):
+    """
+    Implementation of the XXH64 hash function giving the same hexdigest as
+    xxhash.xxh64, used when the xxhash module is not installed so that
+    hashstrings don't depend on whether it is. Much slower than xxhash.
+    """
+    def __init__(self, seed=0):
+        self.seed = seed
+        self.acc = [
+            (seed + PRIME64_1 + PRIME64_2) & MASK64,
+            (seed + PRIME64_2) & MASK64,
+            seed,
+            (seed - PRIME64_1) & MASK64
+        ]
+        self.buf = ""
+        self.total_len = 0
+
+    def update(self, data):
+        self.total_len += len(data)
+        buf = self.buf + data
+        stripes = len(buf) // 32
+        v1, v2, v3, v4 = self.acc
+        for offset in xrange(0, stripes * 32, 32):
+            l1, l2, l3, l4 = struct.unpack_from("<4Q", buf, offset)
+            v1 = xxh64_round(v1, l1)
+            v2 = xxh64_round(v2, l2)
+            v3 = xxh64_round(v3, l3)
+            v4 = xxh64_round(v4, l4)
+        self.acc = [v1, v2, v3, v4]
+        self.buf = buf[stripes * 32:]
+
+    def intdigest(self):
+        v1, v2, v3, v4 = self.acc
+        if self.total_len >= 32:
+            h = (rotl64(v1, 1) + rotl64(v2, 7) + rotl64(v3, 12) + rotl64(v4, 18)) & MASK64
+            for v in self.acc:
+                h = xxh64_merge_round(h, v)
+        else:
+            h = (self.seed + PRIME64_5) & MASK64
+
+        h = (h + self.total_len) & MASK64
+
+        buf = self.buf
+        offset = 0
+        while offset + 8 <= len(buf):
+            lane = struct.unpack_from("<Q", buf, offset)[0]
+            h ^= xxh64_round(0, lane)
+            h = (rotl64(h, 27) * PRIME64_1 + PRIME64_4) & MASK64
+            offset += 8
+
+        if offset + 4 <= len(buf):
+            lane = struct.unpack_from("<I", buf, offset)[0]
+            h ^= (lane * PRIME64_1) & MASK64
+            h = (rotl64(h, 23) * PRIME64_2 + PRIME64_3) & MASK64
+            offset += 4
+
+        while offset < len(buf):
+            h ^= (ord(buf[offset]) * PRIME64_5) & MASK64
+            h = (rotl64(h, 11) * PRIME64_1) & MASK64
+            offset += 1
+
+        h ^= h >> 33
+        h = (h * PRIME64_2) & MASK64
+        h ^= h >> 29
+        h = (h * PRIME64_3) & MASK64
+        h ^= h >> 32
+        return h
+
+    def hexdigest(self):
+        return "%016x" % self.intdigest()
+
+for name in ['md5', 'sha1', 'sha224', 'sha256', 'sha384', 'sha512']:
+    register_hash_function(name, functools.partial(hashlib.new, name))
+
+if hasattr(hashlib, 'blake2b'):
+    register_hash_function('blake2b', hashlib.blake2b)
+elif USE_PYBLAKE2:
+    register_hash_function('blake2b', pyblake2.blake2b)
+
+if USE_XXHASH:
+    register_hash_function('xxh64', xxhash.xxh64)
+else:
+    register_hash_function('xxh64', PurePythonXXH64)
+
+register_hash_function('crc32', functools.partial(ChecksumHash, zlib.crc32))
+register_hash_function('adler32', functools.partial(ChecksumHash, zlib.adler32))
@@ -1,11 +1,18 @@
 from dexy.constants import Constants
+from dexy.version import Version
+from ordereddict import OrderedDict
+import UserDict
+import ast
 import dexy
 import dexy.artifact
 import dexy.commands
 import dexy.dexy_filter
 import dexy.reporter
+import hashlib
 import inspect
+import json
 import os
+import platform
 import sys
 
 NULL_LOGGER = Constants.NULL_LOGGER
@@ -74,15 +81,77 @@ def artifact_classes(log=NULL_LOGGER):
 
     return artifact_classes
 
+FILTERS_MANIFEST_FILENAME = "filters-manifest.json"
+
+class FilterRegistry(UserDict.DictMixin):
+    """
+    Dict of filter aliases and filter classes which imports the module
+    defining a filter class the first time one of its aliases is looked up.
+    Each entry records the module and class name for an alias along with the
+    executable which was found for the class, if it needs one.
+    """
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.classes = {}
+
+    def add(self, alias, modname, classname, executable=None, klass=None):
+        self.entries[alias] = (modname, classname, executable)
+        if klass:
+            self.classes[alias] = klass
+        elif self.classes.has_key(alias):
+            del self.classes[alias]
+
+    def __getitem__(self, alias):
+        if not self.classes.has_key(alias):
+            modname, classname, executable = self.entries[alias]
+            __import__(modname)
+            self.classes[alias] = getattr(sys.modules[modname], classname)
+        return self.classes[alias]
+
+    def __setitem__(self, alias, klass):
+        self.add(alias, klass.__module__, klass.__name__, klass=klass)
+
+    def __delitem__(self, alias):
+        del self.entries[alias]
+        if self.classes.has_key(alias):
+            del self.classes[alias]
+
+    def keys(self):
+        return self.entries.keys()
+
+    def __contains__(self, alias):
+        return self.entries.has_key(alias)
+
+    def has_key(self, alias):
+        return self.entries.has_key(alias)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def class_named(self, name):
+        """
+        Returns the filter class called name, importing only its module, or
+        None if there isn't one.
+        """
+        for alias, (modname, classname, executable) in self.entries.iteritems():
+            if classname == name:
+                return self[alias]
+
+    def manifest(self):
+        return [[alias] + list(entry) for alias, entry in self.entries.iteritems()]
+
 def get_filter_by_name(name, filter_list=None):
     if not filter_list:
         # populate the filter list ourselves if not supplied...
         filter_list = filters()
 
-    classes = [k for k in filter_list if k.__name__ == name]
-    if len(classes) == 0:
+    klass = filter_list.class_named(name)
+    if not klass:
         raise Exception("no filter class %s found" % name)
-    return classes[0]
+    return klass
 
 def get_filter_for_alias(alias, filter_list=None):
     if not filter_list:
@@ -100,14 +169,101 @@ def get_filter_for_alias(alias, filter_list=None):
     else:
         raise dexy.commands.UserFeedback("Filter alias '%s' not found or not available. Check the logs/dexy.log file for information." % alias)
 
-def filters(log=NULL_LOGGER):
+def filter_dirs():
     """
-    Returns a dict whose keys are all supported filter aliases and whose values
-    are the corresponding filter classes.
+    Returns (package, directory) pairs for the places filters are loaded from.
     """
     dexy_filters = ('dexy.filters', os.path.join(dexy.__path__[0], 'filters'))
     proj_filters = ('filters', os.path.abspath(os.path.join(os.curdir, 'filters')))
     user_filters = ('dexy_filters', os.path.expanduser(os.path.join('~', 'dexy_filters')))
+    return [dexy_filters, user_filters, proj_filters]
+
+def filter_modules(d):
+    return sorted(f for f in os.listdir(d) if f.endswith(".py") and f not in ["base.py", "__init__.py"])
+
+def filters_manifest_key():
+    """
+    Returns a hash of everything which can change the available filters: the
+    filter module files, the PATH and the directories in it, which change when
+    executables are installed, and the platform.
+    """
+    modules = []
+    for pkg, d in filter_dirs():
+        if os.path.exists(d):
+            for f in filter_modules(d):
+                stat_info = os.stat(os.path.join(d, f))
+                modules.append([pkg, f, stat_info.st_size, stat_info.st_mtime])
+
+    path_dirs = []
+    for p in os.environ.get("PATH", "").split(os.pathsep):
+        if os.path.isdir(p):
+            path_dirs.append([p, os.stat(p).st_mtime])
+
+    key_info = [
+        modules,
+        path_dirs,
+        os.environ.get("PATHEXT"),
+        platform.system(),
+        sys.version,
+        Version.VERSION
+    ]
+    return hashlib.md5(json.dumps(key_info)).hexdigest()
+
+def load_filters_manifest(manifest_dir, key, log=NULL_LOGGER):
+    """
+    Returns a FilterRegistry built from the manifest saved in manifest_dir, or
+    None if there isn't one saved with this key, or if a filter module which
+    couldn't be imported when it was saved now can be.
+    """
+    filepath = os.path.join(manifest_dir, FILTERS_MANIFEST_FILENAME)
+    if not os.path.exists(filepath):
+        return None
+
+    try:
+        with open(filepath, "r") as f:
+            manifest = json.load(f)
+    except ValueError as e:
+        log.debug("could not read filters manifest %s: %s" % (filepath, e))
+        return None
+
+    if manifest['key'] != key:
+        log.debug("filters manifest is out of date")
+        return None
+
+    # An import can start working when a package is installed, without any
+    # filter module or PATH changing.
+    for modname in manifest['unavailable']:
+        try:
+            __import__(str(modname))
+            log.debug("filters in %s have become available" % modname)
+            return None
+        except ImportError:
+            pass
+
+    registry = FilterRegistry()
+    for alias, modname, classname, executable in manifest['filters']:
+        registry.add(str(alias), str(modname), str(classname), executable)
+    return registry
+
+def save_filters_manifest(manifest_dir, key, registry, unavailable):
+    filepath = os.path.join(manifest_dir, FILTERS_MANIFEST_FILENAME)
+    manifest = {
+        'key' : key,
+        'filters' : registry.manifest(),
+        'unavailable' : unavailable
+    }
+    with open(filepath, "w") as f:
+        json.dump(manifest, f, indent=4)
+
+def filters(log=NULL_LOGGER, manifest_dir=None):
+    """
+    Returns a FilterRegistry whose keys are all supported filter aliases and
+    whose values are the corresponding filter classes. If manifest_dir is
+    given, the aliases are read from the manifest saved there if it is still
+    valid, so filter modules are only imported when their aliases are used.
+    Otherwise every filter module is imported, and the manifest is saved.
+    """
+    dexy_filters, user_filters, proj_filters = filter_dirs()
 
     if os.path.exists(proj_filters[1]):
         init_py_file = os.path.join(proj_filters[1], "__init__.py")
@@ -127,7 +283,15 @@ def filters(log=NULL_LOGGER):
             log.info("Adding %s to python sys.path so your custom filters in %s will be available" % (path, user_filters[1]))
             sys.path.append(path)
 
-    filters = {}
+    if manifest_dir and os.path.isdir(manifest_dir):
+        key = filters_manifest_key()
+        filters = load_filters_manifest(manifest_dir, key, log)
+        if filters is not None:
+            log.info("Loaded %s filter aliases from filters manifest" % len(filters))
+            return filters
+
+    filters = FilterRegistry()
+    unavailable = []
 
     for a in dexy.dexy_filter.DexyFilter.ALIASES:
         filters[a] = dexy.dexy_filter.DexyFilter
@@ -135,48 +299,57 @@ def filters(log=NULL_LOGGER):
     for pkg, d in [dexy_filters, user_filters, proj_filters]:
         if os.path.exists(d):
             log.info("Loading filters in %s" % d)
-            for f in os.listdir(d):
-                if f.endswith(".py") and f not in ["base.py", "__init__.py"]:
-                    log.info("Loading filters in %s" % os.path.join(d, f))
-                    basename = f.replace(".py", "")
-                    modname = "%s.%s" % (pkg, basename)
-
-                    try:
-                        __import__(modname)
-                    except ImportError as e:
-                        log.warn("filters defined in %s are not available: %s" % (modname, e))
-
-                    if not sys.modules.has_key(modname):
-                        continue
-
-                    mod = sys.modules[modname]
-
-                    for k in dir(mod):
-                        klass = mod.__dict__[k]
-
-                        is_class = inspect.isclass(klass)
-
-                        if is_class and issubclass(klass, dexy.dexy_filter.DexyFilter) and (klass.__module__ == modname):
-                            if not klass.ALIASES:
-                                log.info("class %s is not available because it has no aliases" % klass.__name__)
-                            elif len(klass.executables()) > 0 and not klass.executable():
-                                log.info("class %s is not available because %s not found" %
-                                              (klass.__name__, klass.executable()))
-                            elif not klass.enabled():
-                                log.info("class %s is not available because it is not enabled" %
-                                              (klass.__name__))
-                            else:
-                                for a in klass.ALIASES:
-                                    if filters.has_key(a):
-                                        log.info("Replacing class %s with %s for alias %s" % (filters[a].__name__, klass.__name__,  a))
-                                    filters[a] = klass
-                                    log.info("registered alias %s for class %s" % (a, k))
+            for f in filter_modules(d):
+                log.info("Loading filters in %s" % os.path.join(d, f))
+                basename = f.replace(".py", "")
+                modname = "%s.%s" % (pkg, basename)
+
+                try:
+                    __import__(modname)
+                except ImportError as e:
+                    log.warn("filters defined in %s are not available: %s" % (modname, e))
+                    unavailable.append(modname)
+
+                if not sys.modules.has_key(modname):
+                    continue
+
+                mod = sys.modules[modname]
+
+                for k in dir(mod):
+                    klass = mod.__dict__[k]
+
+                    is_class = inspect.isclass(klass)
+
+                    if is_class and issubclass(klass, dexy.dexy_filter.DexyFilter) and (klass.__module__ == modname):
+                        if len(klass.executables()) > 0:
+                            executable = klass.executable()
+                        else:
+                            executable = None
+
+                        if not klass.ALIASES:
+                            log.info("class %s is not available because it has no aliases" % klass.__name__)
+                        elif len(klass.executables()) > 0 and not executable:
+                            log.info("class %s is not available because %s not found" %
+                                          (klass.__name__, executable))
+                        elif not klass.enabled():
+                            log.info("class %s is not available because it is not enabled" %
+                                          (klass.__name__))
+                        else:
+                            for a in klass.ALIASES:
+                                if filters.has_key(a):
+                                    log.info("Replacing class %s with %s for alias %s" % (filters[a].__name__, klass.__name__,  a))
+                                filters.add(a, modname, klass.__name__, executable, klass)
+                                log.info("registered alias %s for class %s" % (a, k))
         log.info("...finished loading filters from %s" % d)
+
+    if manifest_dir and os.path.isdir(manifest_dir):
+        save_filters_manifest(manifest_dir, key, filters, unavailable)
+
     return filters
 
-def reporters(log=NULL_LOGGER):
+def reporter_dirs():
     """
-    Returns a dict of reporter names and classes.
+    Returns the directories reporters are loaded from.
     """
     # Reporters that come with dexy are installed in the reporters/ subdir:
     d1 = os.path.abspath(os.path.join(INSTALL_DIR, 'reporters'))
@@ -185,37 +358,155 @@ def reporters(log=NULL_LOGGER):
     d2 = os.path.abspath(os.path.join(os.curdir, 'reporters'))
 
     if d1 == d2 or not os.path.exists(d2):
-        reporter_dirs = [d1]
+        return [d1]
     else:
-        reporter_dirs = [d1,d2]
+        return [d1,d2]
 
-    reporters = {}
-    for d in reporter_dirs:
-        log.info("Loading reporters in dir %s" % d)
-        for f in os.listdir(d):
-            if f.endswith(".py") and f not in ["base.py", "__init__.py"]:
-                log.info("Loading reporters in %s" % os.path.join(d, f))
-                basename = f.replace(".py", "")
-                module = "reporters.%s" % basename
+def reporter_modules(d):
+    return sorted(f for f in os.listdir(d) if f.endswith(".py") and f not in ["base.py", "__init__.py"])
 
-                try:
-                    __import__(module)
-                except ImportError as e:
-                    log.warn("reporters defined in %s are not available: %s" % (module, e))
+def reporter_module_classes(f, log=NULL_LOGGER):
+    """
+    Imports the reporter module in file f and returns the Reporter subclasses
+    it defines, or an empty list if it can't be imported.
+    """
+    basename = f.replace(".py", "")
+    module = "reporters.%s" % basename
 
-                if not sys.modules.has_key(module):
-                    continue
+    try:
+        __import__(module)
+    except ImportError as e:
+        log.warn("reporters defined in %s are not available: %s" % (module, e))
 
-                mod = sys.modules[module]
+    if not sys.modules.has_key(module):
+        return []
 
-                for k in dir(mod):
-                    klass = mod.__dict__[k]
-                    if inspect.isclass(klass) and not (klass == dexy.reporter.Reporter) and issubclass(klass, dexy.reporter.Reporter):
-                        reporters[klass.__name__] = klass
+    mod = sys.modules[module]
+
+    classes = []
+    for k in dir(mod):
+        klass = mod.__dict__[k]
+        if inspect.isclass(klass) and not (klass == dexy.reporter.Reporter) and issubclass(klass, dexy.reporter.Reporter):
+            classes.append(klass)
+    return classes
+
+def reporters(log=NULL_LOGGER):
+    """
+    Returns a dict of reporter names and classes.
+    """
+    reporters = {}
+    for d in reporter_dirs():
+        log.info("Loading reporters in dir %s" % d)
+        for f in reporter_modules(d):
+            log.info("Loading reporters in %s" % os.path.join(d, f))
+            for klass in reporter_module_classes(f, log):
+                reporters[klass.__name__] = klass
     return reporters
 
+# Values of a class constant which reporter_class_constants can't give.
+NOT_ASSIGNED = object()
+NOT_LITERAL = object()
+
+def base_class_name(node):
+    if isinstance(node, ast.Name):
+        return node.id
+    elif isinstance(node, ast.Attribute):
+        return node.attr
+
+def reporter_class_constants(filepath, name):
+    """
+    Returns an ordered dict mapping the name of each class in filepath to a
+    tuple of the names of its base classes and the value its class body
+    assigns to the constant name. The value is NOT_ASSIGNED if the class
+    doesn't assign it and NOT_LITERAL if it isn't a string or None. Reads the
+    source code instead of importing it, so this works without a reporter's
+    dependencies and without paying for importing them.
+    """
+    with open(filepath, "r") as f:
+        tree = ast.parse(f.read(), filepath)
+
+    constants = OrderedDict()
+    for node in tree.body:
+        if isinstance(node, ast.ClassDef):
+            value = NOT_ASSIGNED
+            for stmt in node.body:
+                if isinstance(stmt, ast.Assign) and any(isinstance(t, ast.Name) and t.id == name for t in stmt.targets):
+                    if isinstance(stmt.value, ast.Str):
+                        value = stmt.value.s
+                    elif isinstance(stmt.value, ast.Name) and stmt.value.id == 'None':
+                        value = None
+                    else:
+                        value = NOT_LITERAL
+            constants[node.name] = ([base_class_name(b) for b in node.bases], value)
+    return constants
+
+def resolve_reporter_constant(class_name, classes, seen=()):
+    """
+    Returns whether the class named class_name is a Reporter subclass and the
+    value of its constant, including one inherited from a base class, given
+    classes, a dict of class names and the lists of entries returned by
+    reporter_class_constants for the classes with that name. Returns None if
+    that can't be worked out from the source, e.g. because the class has a
+    base class defined elsewhere or its value isn't a literal.
+    """
+    if class_name == 'Reporter':
+        return True, dexy.reporter.Reporter.REPORTS_DIR
+    elif class_name == 'object':
+        return False, None
+    elif len(classes.get(class_name, [])) != 1 or class_name in seen:
+        return None
+
+    bases, value = classes[class_name][0]
+    if value is NOT_LITERAL:
+        return None
+
+    is_reporter = False
+    inherited = None
+    for base in bases:
+        resolved = resolve_reporter_constant(base, classes, seen + (class_name,))
+        if resolved is None:
+            return None
+        is_reporter = is_reporter or resolved[0]
+        if inherited is None:
+            inherited = resolved[1]
+
+    if value is NOT_ASSIGNED:
+        value = inherited
+    return is_reporter, value
+
 def reports_dirs(log=NULL_LOGGER):
     """
     Returns a list of all directories which reporters declare that they use.
+    The REPORTS_DIR of each reporter class is read from its source if
+    possible, and a reporter module is only imported if one of its classes
+    has a value which can't be read that way.
     """
-    return [r.REPORTS_DIR for r in reporters(log).values() if r.REPORTS_DIR and not r.REPORTS_DIR.startswith("logs/")]
+    modules = []
+    classes = {}
+    for d in reporter_dirs():
+        for f in reporter_modules(d):
+            try:
+                constants = reporter_class_constants(os.path.join(d, f), 'REPORTS_DIR')
+            except SyntaxError as e:
+                log.warn("could not read reporters defined in %s: %s" % (f, e))
+                continue
+            modules.append((f, constants))
+            for class_name, entry in constants.iteritems():
+                classes.setdefault(class_name, []).append(entry)
+
+    dirs = []
+    for f, constants in modules:
+        values = []
+        for class_name in constants:
+            resolved = resolve_reporter_constant(class_name, classes)
+            if resolved is None:
+                log.debug("importing %s to find its reporters' REPORTS_DIR" % f)
+                values = [klass.REPORTS_DIR for klass in reporter_module_classes(f, log)]
+                break
+            elif resolved[0]:
+                values.append(resolved[1])
+
+        for reports_dir in values:
+            if reports_dir and not reports_dir.startswith("logs/") and not reports_dir in dirs:
+                dirs.append(reports_dir)
+    return dirs
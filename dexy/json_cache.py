@@ -0,0 +1,41 @@
+"""
+Base class for caches of entries which are loaded from and persisted to a
+JSON file in the logs directory.
+"""
+import json
+import os
+
+class JsonCache(object):
+    """
+    Entries keyed on strings, loaded from filename in logsdir if given. Entries
+    added with merge are written back by persist. Without logsdir, entries are
+    only kept in memory.
+    """
+    def __init__(self, logsdir, filename):
+        self.updated = {}
+        if logsdir:
+            self.filepath = os.path.join(logsdir, filename)
+        else:
+            self.filepath = None
+
+        self.entries = {}
+        if self.filepath and os.path.exists(self.filepath):
+            try:
+                with open(self.filepath, "r") as f:
+                    self.entries = json.load(f)
+            except ValueError:
+                pass
+
+    def merge(self, updated):
+        """
+        Adds entries, including those recorded by the same kind of cache in
+        a worker process.
+        """
+        self.entries.update(updated)
+        self.updated.update(updated)
+
+    def persist(self):
+        if self.filepath and self.updated:
+            with open(self.filepath, "w") as f:
+                json.dump(self.entries, f, indent=4)
+        self.updated = {}
@@ -0,0 +1,126 @@
+"""
+Saves the plan worked out from a project's config, the documents with their
+filters and args, the dependencies between them and the order to run them in,
+so that later runs can skip loading and processing config when no config file
+and no directory listing they depend on has changed.
+"""
+import cPickle
+import dexy.file_index
+import dexy.stat_index
+import gc
+import hashlib
+import os
+import time
+
+PLAN_CACHE_FILENAME = "plan-cache.pickle"
+
+def listing_signature(dirnames, filenames):
+    """
+    Hashes the names in a directory listing, marking which are directories.
+    """
+    entries = sorted([d + "/" for d in dirnames] + list(filenames))
+    return hashlib.md5("\n".join(entries)).hexdigest()
+
+def current_listing_signature(dirpath):
+    dirnames, filenames, symlinks = dexy.file_index.list_dir(dirpath)
+    return listing_signature(dirnames, filenames)
+
+def config_file_signature(text):
+    return hashlib.md5(text).hexdigest()
+
+def directory_fingerprint(dirpath, dirnames=None, filenames=None):
+    """
+    Returns the mtime and listing signature of dirpath, using dirnames and
+    filenames if the directory has already been listed. The mtime is left out
+    if it is too recent to be trusted, so the listing will always be checked.
+    """
+    mtime = os.stat(dirpath).st_mtime
+    if time.time() - mtime < dexy.stat_index.RACY_SECONDS:
+        mtime = None
+
+    if dirnames is None:
+        signature = current_listing_signature(dirpath)
+    else:
+        signature = listing_signature(dirnames, filenames)
+    return (mtime, signature)
+
+def document_signatures(plan):
+    """
+    Returns a dict of the key of each document in plan and its plan info, with
+    inputs given by key instead of id, so documents can be compared between
+    plans.
+    """
+    keys = ["|".join([info['name']] + info['filters']) for info in plan['docs']]
+    signatures = {}
+    for key, info in zip(keys, plan['docs']):
+        signature = dict(info)
+        signature['inputs'] = [keys[i] for i in info['inputs']]
+        signatures[key] = signature
+    return signatures
+
+class PlanCache(object):
+    """
+    Reads and writes a single cached plan in the logs directory. A plan is a
+    dict, it is only returned by load if it was saved with the same key and its
+    'dirs' and 'config_files' entries still match the file system.
+    """
+    def __init__(self, logsdir, log):
+        self.filepath = os.path.join(logsdir, PLAN_CACHE_FILENAME)
+        self.log = log
+
+    def read(self):
+        """
+        Returns the saved plan without checking whether it is still valid, or
+        None if there isn't one.
+        """
+        if not os.path.exists(self.filepath):
+            return None
+
+        # Unpickling creates many objects and no garbage, so the garbage
+        # collector would only slow it down.
+        gc.disable()
+        try:
+            with open(self.filepath, "rb") as f:
+                plan = cPickle.load(f)
+        except Exception as e:
+            self.log.debug("could not read plan cache %s: %s" % (self.filepath, e))
+            return None
+        finally:
+            gc.enable()
+        return plan
+
+    def load(self, key):
+        plan = self.read()
+        if not plan:
+            return None
+
+        if plan['key'] != key:
+            self.log.debug("plan cache was saved with different args or dexy code")
+            return None
+
+        for dirpath, (mtime, signature) in plan['dirs'].iteritems():
+            if not os.path.isdir(dirpath):
+                self.log.debug("directory %s no longer exists" % dirpath)
+                return None
+            elif mtime is not None and os.stat(dirpath).st_mtime == mtime:
+                continue
+            elif current_listing_signature(dirpath) != signature:
+                self.log.debug("contents of directory %s have changed" % dirpath)
+                return None
+
+        for filepath, signature in plan['config_files'].iteritems():
+            if not os.path.isfile(filepath):
+                self.log.debug("config file %s no longer exists" % filepath)
+                return None
+            with open(filepath, "rb") as f:
+                if config_file_signature(f.read()) != signature:
+                    self.log.debug("config file %s has changed" % filepath)
+                    return None
+
+        return plan
+
+    def save(self, plan):
+        tmp_filepath = "%s.tmp" % self.filepath
+        with open(tmp_filepath, "wb") as f:
+            cPickle.dump(plan, f, cPickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_filepath, self.filepath)
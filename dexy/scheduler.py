@@ -0,0 +1,300 @@
+"""
+Runs the documents in a batch concurrently.
+
+Documents are set up serially by the controller as usual, then each call to
+Document.run is handed to a worker. Workers are forked processes, so they see
+the controller's state (including the final artifacts of every document that
+has already completed) at the moment they are started, or threads for
+documents which spend their time waiting on external executables. Workers never
+touch the batch database, the rows they would have written are recorded and
+sent back to the parent process which writes them.
+
+There are two schedules. The 'dag' schedule starts each document as soon as
+all of its inputs have completed. The 'levels' schedule runs the documents in
+each dependency level together and waits for the whole level to finish before
+starting the next one.
+"""
+from dexy.topsort import topsort_levels
+import Queue
+import dexy.artifact
+import dexy.commands
+import dexy.dexy_filter
+import multiprocessing
+import os
+import threading
+import time
+import traceback
+
+class DeferredDatabase(object):
+    """
+    Stands in for the batch database while a document runs in a worker,
+    recording the rows which would have been written so that they can be
+    written by the parent process.
+    """
+    def __init__(self, db):
+        self.db = db
+        self.extra_keys = list(db.extra_keys)
+        self.new_extra_keys = []
+        self.calls = []
+
+    def next_batch_order(self, batch_id):
+        return self.db.next_batch_order(batch_id)
+
+    def append_artifact(self, artifact):
+        self.extra_keys.append(artifact.key)
+        self.new_extra_keys.append(artifact.key)
+        self.append_artifacts([artifact])
+
+    def append_artifacts(self, artifacts):
+        rows = [self.db.get_attributes_for_artifact(a) for a in artifacts]
+        self.calls.append(('append', rows))
+
+    def update_artifact(self, artifact):
+        row = self.db.get_attributes_for_artifact(artifact)
+        self.calls.append(('update', row))
+
+def replay_calls(db, calls, new_extra_keys):
+    """
+    Writes rows recorded by a DeferredDatabase to the real database.
+    """
+    db.extra_keys.extend(new_extra_keys)
+    for method, rows in calls:
+        if method == 'append':
+            db.append_artifact_rows(rows)
+        else:
+            db.update_artifact_row(rows)
+
+def run_document(doc):
+    """
+    Runs a document against a DeferredDatabase and returns a dict, which can
+    be pickled, describing what happened.
+    """
+    log_offset = len(doc.logstream.getvalue())
+    db = doc.db
+    deferred_db = DeferredDatabase(db)
+    doc.db = deferred_db
+
+    result = {}
+    try:
+        doc.run()
+        result['artifacts'] = [(a.hashstring, a.source, a.elapsed) for a in doc.artifacts[1:]]
+        result['elapsed'] = doc.elapsed
+        result['timing'] = doc.timing
+    except dexy.commands.UserFeedback as e:
+        result['error_class'] = 'UserFeedback'
+        result['error'] = e.message
+    except Exception as e:
+        result['error_class'] = e.__class__.__name__
+        result['error'] = traceback.format_exc()
+    finally:
+        doc.db = db
+
+    result['calls'] = deferred_db.calls
+    if dexy.dexy_filter.DexyFilter.version_cache:
+        result['tool_versions'] = dexy.dexy_filter.DexyFilter.version_cache.updated
+    result['source_hashes'] = dexy.artifact.Artifact.source_hash_cache.updated
+    result['blob_links'] = dexy.artifact.Artifact.blob_store.pending
+    result['new_extra_keys'] = deferred_db.new_extra_keys
+    result['log'] = doc.logstream.getvalue()[log_offset:]
+    return result
+
+def apply_result(controller, doc, result, in_process):
+    """
+    Writes a worker's database rows and, if the document ran in another
+    process, replaces the document's artifacts with ones loaded from the
+    artifacts directory.
+    """
+    replay_calls(controller.db, result['calls'], result['new_extra_keys'])
+    if not in_process:
+        if result.has_key('tool_versions'):
+            controller.version_cache.merge(result['tool_versions'])
+        controller.source_hash_cache.merge(result['source_hashes'])
+        controller.blob_store.merge(result['blob_links'])
+
+    if result.has_key('error'):
+        controller.log.debug("error in worker running %s" % doc.key())
+        if result['error_class'] == 'UserFeedback':
+            raise dexy.commands.UserFeedback(result['error'])
+        else:
+            raise dexy.commands.InternalDexyProblem("error running %s in worker\n%s" % (doc.key(), result['error']))
+
+    if not in_process:
+        artifacts = doc.artifacts[0:1]
+        for hashstring, source, elapsed in result['artifacts']:
+            artifact = controller.artifact_class.retrieve(hashstring, controller.args['hashfunction'])
+            artifact.source = source
+            artifact.elapsed = elapsed
+            artifacts.append(artifact)
+        doc.artifacts = artifacts
+        doc.last_artifact = artifacts[-1]
+        doc.elapsed = result['elapsed']
+        doc.timing = result['timing']
+        doc.logstream.write(result['log'])
+
+class WorkerPool(object):
+    """
+    Runs up to a fixed number of documents at once, each in a forked process or
+    in a thread.
+    """
+    def __init__(self, jobs):
+        self.jobs = jobs
+        self.results = multiprocessing.Queue()
+        self.running = {}
+
+    def has_free_worker(self):
+        return len(self.running) < self.jobs
+
+    def start(self, doc, use_thread=False):
+        if use_thread:
+            worker = threading.Thread(target=self.work, args=(doc,))
+        else:
+            worker = multiprocessing.Process(target=self.work, args=(doc,))
+        worker.daemon = True
+        self.running[doc.id] = (worker, doc, use_thread)
+        worker.start()
+
+    def work(self, doc):
+        self.results.put((doc.id, run_document(doc)))
+
+    def wait(self):
+        """
+        Blocks until a worker finishes, returns the document it ran, its
+        result and whether it ran in this process.
+        """
+        while True:
+            try:
+                doc_id, result = self.results.get(True, 1)
+                break
+            except Queue.Empty:
+                for doc_id, (worker, doc, use_thread) in self.running.items():
+                    if not use_thread and worker.exitcode:
+                        del self.running[doc_id]
+                        raise dexy.commands.InternalDexyProblem("worker process running %s exited with code %s" % (doc.key(), worker.exitcode))
+
+        worker, doc, use_thread = self.running.pop(doc_id)
+        worker.join()
+        return doc, result, use_thread
+
+    def shutdown(self):
+        for worker, doc, use_thread in self.running.values():
+            if not use_thread:
+                worker.terminate()
+            worker.join()
+        self.running = {}
+
+def can_fork():
+    return hasattr(os, 'fork')
+
+def run_dag(controller, jobs):
+    """
+    Starts each document as soon as all of its inputs have completed, keeping
+    up to jobs worker processes busy.
+    """
+    waiting_on = dict((i, set()) for i in controller.ordering)
+    dependents = dict((i, set()) for i in controller.ordering)
+    for input_id, doc_id in controller.depends:
+        waiting_on[doc_id].add(input_id)
+        dependents[input_id].add(doc_id)
+
+    position = dict((doc_id, i) for i, doc_id in enumerate(controller.ordering))
+    ready = [i for i in controller.ordering if not waiting_on[i]]
+
+    pool = WorkerPool(jobs)
+    completed = 0
+    try:
+        while completed < len(controller.ordering):
+            while ready and pool.has_free_worker():
+                pool.start(controller.registry[ready.pop(0)])
+
+            doc, result, in_process = pool.wait()
+            apply_result(controller, doc, result, in_process)
+            completed += 1
+
+            for child in dependents[doc.id]:
+                waiting_on[child].discard(doc.id)
+                if not waiting_on[child]:
+                    ready.append(child)
+            ready.sort(key=position.get)
+    finally:
+        pool.shutdown()
+
+def is_subprocess_bound(doc):
+    """
+    Whether every filter applied to doc runs an external executable, so doc
+    can run in a thread without holding up other threads.
+    """
+    filter_classes = [doc.get_filter_for_alias(f) for f in doc.filters]
+    return len(filter_classes) > 0 and all(len(k.executables()) > 0 for k in filter_classes)
+
+def dependency_levels(controller):
+    """
+    Returns a list of lists of document ids, each list holding documents whose
+    inputs are all in earlier lists.
+    """
+    position = dict((doc_id, i) for i, doc_id in enumerate(controller.ordering))
+
+    levels = [level for level in topsort_levels(controller.depends)]
+    linked = set(doc_id for pair in controller.depends for doc_id in pair)
+    unlinked = [doc_id for doc_id in controller.ordering if not doc_id in linked]
+    if levels:
+        levels[0].extend(unlinked)
+    elif unlinked:
+        levels.append(unlinked)
+
+    return [sorted(level, key=position.get) for level in levels]
+
+def run_levels(controller, jobs):
+    """
+    Runs each dependency level using up to jobs workers, waiting for every
+    document in a level to finish before starting the next level. Records the
+    time taken by each level in controller.timing.
+    """
+    pool = WorkerPool(jobs)
+    try:
+        for i, level in enumerate(dependency_levels(controller)):
+            start = time.time()
+            docs = [controller.registry[doc_id] for doc_id in level]
+
+            # Start all the processes before any threads, forking while
+            # another thread holds a logging lock can deadlock the child.
+            threaded = [doc for doc in docs if is_subprocess_bound(doc)]
+            forked = [doc for doc in docs if not doc in threaded]
+
+            for group, use_thread in ((forked, False), (threaded, True)):
+                pending = list(group)
+                remaining = len(group)
+                while remaining > 0:
+                    while pending and pool.has_free_worker():
+                        pool.start(pending.pop(0), use_thread)
+
+                    doc, result, ran_in_process = pool.wait()
+                    apply_result(controller, doc, result, ran_in_process)
+                    remaining -= 1
+
+            elapsed = time.time() - start
+            controller.log.debug("ran level %s (%s documents) in %s" % (i+1, len(level), elapsed))
+            controller.timing.append(("run-level-%s" % (i+1), elapsed))
+    finally:
+        pool.shutdown()
+
+def run_docs(controller):
+    """
+    Runs the controller's documents, which must already be set up, using
+    controller.args['jobs'] workers and the schedule named in
+    controller.args['schedule'].
+    """
+    jobs = controller.args['jobs']
+    schedule = controller.args['schedule']
+    if not can_fork():
+        controller.log.warn("can't fork worker processes on this platform, running documents one at a time")
+        return [doc.run() for doc in controller.docs]
+
+    start = time.time()
+    if schedule == 'dag':
+        run_dag(controller, jobs)
+    elif schedule == 'levels':
+        run_levels(controller, jobs)
+    else:
+        raise dexy.commands.UserFeedback("schedule must be 'dag' or 'levels', not '%s'" % schedule)
+    controller.log.debug("ran %s documents using %s workers in %s" % (len(controller.docs), jobs, time.time() - start))
+    return controller.docs
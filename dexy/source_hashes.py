@@ -0,0 +1,55 @@
+"""
+Remembers the hashes of the source code of filter classes, artifact classes
+and dexy's own modules, which go into artifact hashstrings and the plan cache
+key, so that source code only has to be read and hashed again after the file
+it is in changes.
+"""
+import dexy.json_cache
+import inspect
+import os
+
+SOURCE_HASHES_FILENAME = "source-hashes.json"
+
+def object_name(obj):
+    if inspect.ismodule(obj):
+        return obj.__name__
+    else:
+        return "%s.%s" % (obj.__module__, obj.__name__)
+
+def files_signature(objects):
+    """
+    Returns the path, mtime and size of each file defining one of objects.
+    """
+    signature = []
+    for filepath in sorted(set(inspect.getsourcefile(obj) for obj in objects)):
+        stat_info = os.stat(filepath)
+        signature.append([filepath, stat_info.st_mtime, stat_info.st_size])
+    return signature
+
+class SourceHashCache(dexy.json_cache.JsonCache):
+    """
+    Maps a hash function and a list of classes or modules to the hash of their
+    concatenated source code, along with the signature of the files defining
+    them. Hashes are remembered for the life of the process, and if logsdir is
+    given they are loaded from and persisted to a JSON file there.
+    """
+    def __init__(self, logsdir=None):
+        dexy.json_cache.JsonCache.__init__(self, logsdir, SOURCE_HASHES_FILENAME)
+        self.memo = {}
+
+    def source_hash(self, objects, hashfunction, compute_hash):
+        """
+        Returns the hash of the source code of objects calculated by
+        compute_hash, which is only called if there is no valid cached hash.
+        """
+        key = "%s %s" % (hashfunction, " ".join(object_name(obj) for obj in objects))
+        if not self.memo.has_key(key):
+            signature = files_signature(objects)
+            entry = self.entries.get(key)
+            if entry and entry['files'] == signature:
+                self.memo[key] = str(entry['hash'])
+            else:
+                source = "".join(inspect.getsource(obj) for obj in objects)
+                self.memo[key] = compute_hash(source)
+                self.merge({ key : { 'files' : signature, 'hash' : self.memo[key] } })
+        return self.memo[key]
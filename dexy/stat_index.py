@@ -0,0 +1,87 @@
+"""
+Remembers the stat information of each source file along with the hashes of
+its contents, so that files which haven't changed since the last run don't
+need to be read or hashed again.
+"""
+from ordereddict import OrderedDict
+import json
+import os
+import time
+
+# Files modified this recently aren't recorded, a later write within the
+# resolution of the file system's mtime would go unnoticed.
+RACY_SECONDS = 2
+
+def stat_signature(stat_info):
+    return [stat_info.st_size, stat_info.st_mtime, stat_info.st_ctime, stat_info.st_ino]
+
+def encode_data_hashes(data_hashes):
+    return json.dumps(data_hashes)
+
+def decode_data_hashes(text):
+    """
+    Rebuilds the dict written by encode_data_hashes with str keys and values,
+    so it is identical to the dict originally passed in.
+    """
+    d = json.loads(text)
+    as_str = lambda v: isinstance(v, unicode) and v.encode("utf-8") or v
+    return OrderedDict((str(k), as_str(d[k])) for k in sorted(d))
+
+class StatIndex(object):
+    """
+    Maps source file paths to their size, mtime, ctime and inode and the hashes
+    of their contents. Entries are loaded from and persisted to the database.
+    """
+    def __init__(self, db=None):
+        self.db = db
+        self.changed = {}
+        if db:
+            self.entries = db.stat_entries()
+        else:
+            self.entries = {}
+
+    def lookup(self, path, stat_info, hashfunction, binary):
+        """
+        Returns the hashes of the contents of path if it hasn't changed since
+        they were recorded, otherwise None.
+        """
+        if not self.entries.has_key(path):
+            return None
+
+        entry = self.entries[path]
+        if entry['hashfunction'] != hashfunction or bool(entry['binary']) != bool(binary):
+            return None
+        elif entry['stat'] != stat_signature(stat_info):
+            return None
+        else:
+            return entry['data_hashes']
+
+    def is_changed(self, path):
+        """
+        Returns whether path has changed, or was never recorded, since its
+        hashes were last recorded with any hash function.
+        """
+        if not self.entries.has_key(path):
+            return True
+        try:
+            return self.entries[path]['stat'] != stat_signature(os.stat(path))
+        except os.error:
+            return True
+
+    def update(self, path, stat_info, hashfunction, binary, data_hashes):
+        if time.time() - stat_info.st_mtime < RACY_SECONDS:
+            return
+
+        entry = {
+            'hashfunction' : hashfunction,
+            'binary' : bool(binary),
+            'stat' : stat_signature(stat_info),
+            'data_hashes' : data_hashes
+        }
+        self.entries[path] = entry
+        self.changed[path] = entry
+
+    def persist(self):
+        if self.db and self.changed:
+            self.db.update_stat_entries(self.changed)
+        self.changed = {}
@@ -1,7 +1,11 @@
 from dexy.artifact import Artifact
+from dexy.artifact_cache import ArtifactCache
 from dexy.artifacts.file_system_json_artifact import FileSystemJsonArtifact
+from dexy.controller import Controller
+from dexy.tests.utils import controller_args
 from dexy.tests.utils import tempdir
 from ordereddict import OrderedDict
+import dexy.hashing
 import dexy.utils
 import os
 
@@ -79,6 +83,41 @@ def test_simple_metadata():
         a2.load_meta()
         assert a2.key == 'xyz'
 
+def test_output_is_stored_once_with_section_index():
+    with tempdir():
+        os.mkdir('artifacts')
+
+        a1 = FileSystemJsonArtifact()
+        a1.hashstring = 'abc123'
+        a1.key = 'xyz.txt'
+        a1.ext = '.txt'
+        a1.binary_output = False
+        a1.state = 'complete'
+        a1.data_dict = OrderedDict([('a', u"caf\xe9\n"), ('b', "plain\n"), (3, u"")])
+        a1.save()
+        assert sorted(os.listdir('artifacts')) == ['abc123-meta.json', 'abc123-sections.json', 'abc123.txt', 'blobs']
+
+        with open(a1.filepath(), "rb") as f:
+            assert f.read() == "caf\xc3\xa9\nplain\n"
+
+        FileSystemJsonArtifact.retrieved_artifacts = ArtifactCache()
+        a2 = FileSystemJsonArtifact.retrieve('abc123')
+        assert a2.deferred_output
+        assert a2['b'] == "plain\n"
+        assert a2.deferred_output
+        assert a2.data_dict == OrderedDict([('a', u"caf\xe9\n"), ('b', "plain\n"), ('3', u"")])
+
+def test_deferred_output_without_section_index():
+    class MemoryArtifact(Artifact):
+        def load_output(self):
+            self.data_dict = OrderedDict([('a', u"first\n"), ('b', u"second\n")])
+
+    artifact = MemoryArtifact()
+    artifact.binary_output = False
+    artifact.deferred_output = True
+    assert artifact['b'] == u"second\n"
+    assert not artifact.deferred_output
+
 def test_artifact_data_dict_to_numbered_dict():
     artifact = Artifact()
     artifact.data_dict = OrderedDict()
@@ -90,3 +129,49 @@ def test_artifact_data_dict_to_numbered_dict():
     assert numbered_dict.keys()[1] == '00001:b'
     assert numbered_dict['00000:a'] == 10
     assert numbered_dict['00001:b'] == 20
+
+def test_hash_dict_is_cached_until_whitelisted_attribute_changes():
+    artifact = Artifact()
+    artifact.key = 'abc.txt'
+    artifact.ext = '.txt'
+
+    hash_dict = artifact.hash_dict()
+    assert artifact.hash_dict() is hash_dict
+    assert artifact.hash_data() == str(hash_dict)
+
+    artifact.state = 'complete'
+    assert artifact.hash_dict() is hash_dict
+
+    artifact.ext = '.html'
+    assert not artifact.hash_dict() is hash_dict
+    assert artifact.hash_dict()['ext'] == '.html'
+    assert artifact.hash_dict_json()['args'] == '{"globals": {}}'
+
+def test_compute_file_hash_matches_compute_hash():
+    with tempdir():
+        contents = "".join(chr(i % 256) for i in range(3000))
+        with open("data.bin", "wb") as f:
+            f.write(contents)
+
+        artifact = Artifact()
+        artifact.binary_input = True
+        artifact.HASH_CHUNK_SIZE = 1000
+        for hashfunction in dexy.hashing.HASH_FUNCTIONS.keys():
+            artifact.hashfunction = hashfunction
+            assert artifact.compute_file_hash("data.bin") == artifact.compute_hash(contents)
+        assert artifact.hashable_file("data.bin") == artifact.hashable_dict({'1' : contents})
+
+def test_binary_source_is_not_read_into_memory():
+    with tempdir():
+        with open(".dexy", "w") as f:
+            f.write('{ "*.png" : {} }')
+        with open("a.png", "wb") as f:
+            f.write("\x89PNG" * 1000)
+
+        c = Controller(controller_args({'silent' : True, 'globals' : {}}))
+        c.run()
+
+        artifact = c.members['a.png'].last_artifact
+        assert not artifact._data_dict
+        with open(artifact.filepath(), "rb") as f:
+            assert f.read() == "\x89PNG" * 1000
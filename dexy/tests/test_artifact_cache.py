@@ -0,0 +1,99 @@
+from dexy.artifact_cache import ArtifactCache
+from dexy.artifacts.file_system_json_artifact import FileSystemJsonArtifact
+from dexy.controller import Controller
+from dexy.tests.utils import controller_args
+from dexy.tests.utils import tempdir
+from ordereddict import OrderedDict
+import json
+
+class FakeArtifact(object):
+    def __init__(self, contents):
+        self.deferred_output = False
+        self._data_dict = OrderedDict([('1', contents)])
+
+    def unload_output(self):
+        self._data_dict = OrderedDict()
+        self.deferred_output = True
+        return True
+
+def test_artifact_cache_evicts_least_recently_used():
+    cache = ArtifactCache(max_bytes=10)
+    a, b, c = FakeArtifact("aaaa"), FakeArtifact("bbbb"), FakeArtifact("cccc")
+    cache.add("a", a)
+    cache.add("b", b)
+    assert cache.get("a") is a
+    assert cache.get("x") is None
+
+    # b is the least recently used, so its contents go.
+    cache.add("c", c)
+    assert b.deferred_output
+    assert not a.deferred_output
+    assert cache.payload_bytes == 8
+
+    # Metadata stays, so b is still a hit.
+    assert cache.get("b") is b
+    assert cache.stats() == {
+        'artifacts' : 3,
+        'payload_bytes' : 8,
+        'max_bytes' : 10,
+        'hits' : 2,
+        'misses' : 1,
+        'evictions' : 1
+    }
+
+def test_evicted_contents_are_reloaded():
+    with tempdir():
+        with open(".dexy", "w") as f:
+            json.dump({"*.txt" : {}, "a.md|jinja" : { "inputs" : ["*.txt"] }}, f)
+        for name in ["a.txt", "b.txt", "c.txt"]:
+            with open(name, "w") as f:
+                f.write(name * 10)
+        with open("a.md", "w") as f:
+            f.write("{{ d['a.txt'] }} {{ d['b.txt'] }} {{ d['c.txt'] }}")
+
+        args = controller_args({'silent' : True, 'globals' : {}, 'artifactcachemb' : 0.00001})
+        c = Controller(args)
+        c.run()
+
+        cache = FileSystemJsonArtifact.retrieved_artifacts
+        assert cache.max_bytes == 10
+        hashstrings = [doc.last_artifact.hashstring for doc in c.docs]
+        artifacts = [FileSystemJsonArtifact.retrieve(h) for h in hashstrings]
+        expected = dict((doc.key(), doc.output()) for doc in c.docs)
+        for artifact in artifacts:
+            assert artifact.output() == expected[artifact.document_key]
+        assert cache.evictions > 0
+        assert cache.payload_bytes <= cache.max_bytes or len(cache.payloads) == 1
+        assert c.batch_info()['artifact_cache']['misses'] > 0
+
+def test_inputs_are_retrieved_when_used():
+    with tempdir():
+        with open(".dexy", "w") as f:
+            json.dump({"*.txt" : {}, "a.md|jinja" : { "inputs" : ["*.txt"] }}, f)
+        for name in ["a.txt", "b.txt"]:
+            with open(name, "w") as f:
+                f.write(name)
+        with open("a.md", "w") as f:
+            f.write("{{ d['a.txt'] }}")
+
+        args = controller_args({'silent' : True, 'globals' : {}})
+        c = Controller(args)
+        c.run()
+        hashstring = c.members['a.md|jinja'].last_artifact.hashstring
+
+        cache = FileSystemJsonArtifact.retrieved_artifacts = ArtifactCache()
+        artifact = FileSystemJsonArtifact.retrieve(hashstring)
+        assert len(cache) == 1
+        assert artifact.deferred_output
+
+        inputs = artifact.inputs()
+        assert sorted(inputs.keys()) == ['a.txt', 'b.txt']
+        assert artifact.input_hashes().keys() == ['a.txt', 'b.txt']
+        assert isinstance(inputs['a.txt'], FileSystemJsonArtifact)
+        assert not inputs['a.txt'].is_retrieved()
+
+        assert inputs['a.txt'].output() == "a.txt"
+        assert inputs['a.txt'].is_retrieved()
+        assert not inputs['b.txt'].is_retrieved()
+        assert len(cache) == 2
+        assert artifact.output() == "a.txt"
@@ -0,0 +1,186 @@
+"""
+Benchmarks for the slower phases of a dexy run. Each benchmark prints its
+timing. They run at a small size by default to keep the test suite fast, set
+DEXY_BENCHMARK_SCALE to run them at full size, e.g.
+
+    DEXY_BENCHMARK_SCALE=10 nosetests -s dexy/tests/test_benchmarks.py
+"""
+from dexy.controller import Controller
+from dexy.databases.sqlite_database import SqliteDatabase
+from dexy.tests.utils import controller_args
+from dexy.tests.utils import tempdir
+import dexy.file_index
+import dexy.hashing
+import json
+import os
+import subprocess
+import sys
+import time
+
+SCALE = int(os.environ.get("DEXY_BENCHMARK_SCALE", 1))
+
+def synthetic_tree(num_docs, files_per_dir=20):
+    """
+    Creates a tree of empty .py and .md files in the current directory and
+    returns a config dict for it. Each .md document takes the .py documents in
+    its directory as inputs.
+    """
+    config = {}
+    for d in range(num_docs / files_per_dir):
+        path = os.path.join("dir%03d" % (d % 10), "sub%04d" % d)
+        os.makedirs(path)
+        for i in range(files_per_dir / 2):
+            for ext in (".py", ".md"):
+                open(os.path.join(path, "file%02d%s" % (i, ext)), "w").close()
+        config["./%s" % path] = {
+            "*.py|pyg" : {},
+            "*.md|jinja" : { "inputs" : ["*.py|pyg"] }
+        }
+    return config
+
+def test_benchmark_process_config():
+    num_docs = 1000 * SCALE
+    with tempdir():
+        config = synthetic_tree(num_docs)
+        c = Controller(controller_args({'silent' : True}))
+        c.config = config
+
+        start = time.time()
+        c.process_config()
+        elapsed = time.time() - start
+
+        print "process-config for %s documents took %0.2fs" % (num_docs, elapsed)
+        assert len(c.docs) == num_docs
+
+def test_benchmark_hash_functions():
+    sizes = [1024, 64 * 1024, 1024 * 1024]
+    for name in dexy.hashing.HASH_FUNCTIONS.keys():
+        for size in sizes:
+            data = os.urandom(size)
+            repeat = max(1, SCALE * 1024 * 1024 / size)
+
+            start = time.time()
+            for i in range(repeat):
+                h = dexy.hashing.new(name)
+                h.update(data)
+                assert h.hexdigest()
+            elapsed = max(time.time() - start, 1e-6)
+
+            mb = size * repeat / (1024.0 * 1024.0)
+            print "%-8s %8s bytes %8.1f MB/s" % (name, size, mb / elapsed)
+
+def test_benchmark_database_writes():
+    num_rows = 5000 * SCALE
+    with tempdir():
+        db = SqliteDatabase(logsdir=None, dbfile="db.sql")
+        width = len(db.field_names)
+        rows = [["%s:key%s" % (1, i), 1, i] + [str(i)] * (width - 3) for i in range(num_rows)]
+
+        # Like Document.run, update each artifact as it runs and then append
+        # all of a document's artifacts.
+        start = time.time()
+        for i in range(0, num_rows, 3):
+            for row in rows[i:i+3]:
+                db.update_artifact_row(row)
+            db.append_artifact_rows(rows[i:i+3])
+        db.persist()
+        elapsed = time.time() - start
+
+        print "writing %s artifact rows took %0.2fs" % (num_rows, elapsed)
+        assert db.conn.execute("select count(*) from artifacts").fetchone()[0] == num_rows
+
+def test_benchmark_load_config():
+    num_dirs = 2000 * SCALE
+    with tempdir():
+        with open(".dexy", "w") as f:
+            json.dump({"*.txt" : {}, "$globals" : {"a" : 1}}, f)
+        for d in range(num_dirs):
+            path = os.path.join("dir%02d" % (d % 20), "sub%03d" % (d / 20 % 10), "leaf%05d" % d)
+            os.makedirs(path)
+            with open(os.path.join(path, ".dexy"), "w") as f:
+                json.dump({"*.py|pyg" : {}}, f)
+
+        c = Controller(controller_args({'silent' : True}))
+        start = time.time()
+        c.load_config()
+        elapsed = time.time() - start
+
+        print "load-config for %s directories took %0.2fs, parsed %s config files" % (len(c.config), elapsed, c.config_resolver.parse_count)
+        assert c.config_resolver.parse_count == num_dirs + 1
+
+def test_benchmark_plan_cache():
+    num_docs = 1000 * SCALE
+    with tempdir():
+        for path, config in synthetic_tree(num_docs).iteritems():
+            with open(os.path.join(path, ".dexy"), "w") as f:
+                json.dump(config, f)
+
+        timings = []
+        for i in range(2):
+            c = Controller(controller_args({'silent' : True, 'dryrun' : True, 'globals' : {}}))
+            c.run()
+            timings.append(dict(c.timing))
+            assert len(c.docs) == num_docs
+
+        planning = timings[0]['load-config'] + timings[0]['process-config']
+        print "planning %s documents took %0.2fs, loading the cached plan took %0.2fs" % (num_docs, planning, timings[1]['load-plan'])
+        assert timings[1].has_key('load-plan')
+
+def test_benchmark_walk_project():
+    num_files = 10000 * SCALE
+    with tempdir():
+        for d in range(num_files / 50):
+            path = os.path.join("dir%02d" % (d % 20), "sub%04d" % d)
+            os.makedirs(path)
+            for i in range(50):
+                open(os.path.join(path, "file%02d.txt" % i), "w").close()
+
+        start = time.time()
+        regex = dexy.file_index.exclusion_regex(["skip\\d+", "tmp"])
+        walked = [w for w in dexy.file_index.walk_project(".", ["logs"], [".git"], regex)]
+        elapsed = time.time() - start
+
+        start = time.time()
+        os_walked = [w for w in os.walk(".")]
+        os_walk_elapsed = time.time() - start
+
+        print "walking %s files took %0.2fs (os.walk took %0.2fs, scandir %s)" % (num_files, elapsed, os_walk_elapsed, dexy.file_index.USE_SCANDIR and "used" or "not available")
+        assert len(walked) == len(os_walked)
+
+# Modules only some subcommands need, which importing dexy.commands shouldn't
+# pull in.
+LAZY_MODULES = ['cProfile', 'dexy.controller', 'jinja2', 'pygments', 'web']
+
+IMPORT_TIME_SCRIPT = """
+import __builtin__, json, sys, time
+builtin_import = __builtin__.__import__
+times = {}
+def timed_import(name, *args, **kwargs):
+    start = time.time()
+    try:
+        return builtin_import(name, *args, **kwargs)
+    finally:
+        times[name] = times.get(name, 0) + time.time() - start
+__builtin__.__import__ = timed_import
+start = time.time()
+import dexy.commands
+elapsed = time.time() - start
+__builtin__.__import__ = builtin_import
+print json.dumps({'elapsed' : elapsed, 'times' : times, 'modules' : [k for k, v in sys.modules.items() if v]})
+"""
+
+def test_benchmark_cli_import():
+    proc = subprocess.Popen([sys.executable, "-c", IMPORT_TIME_SCRIPT], stdout=subprocess.PIPE)
+    stdout, stderr = proc.communicate()
+    assert proc.returncode == 0
+    result = json.loads(stdout.splitlines()[-1])
+
+    for m in result['modules']:
+        assert not m.startswith("reporters."), m
+        assert not m.split(".")[0] in LAZY_MODULES, m
+        assert not m in LAZY_MODULES, m
+
+    slowest = sorted(result['times'].items(), key=lambda t: t[1], reverse=True)[0:5]
+    print "importing dexy.commands took %0.3fs, %s modules loaded" % (result['elapsed'], len(result['modules']))
+    for name, elapsed in slowest:
+        print "    %-24s %0.3fs (cumulative)" % (name, elapsed)
@@ -0,0 +1,93 @@
+from dexy.blob_store import BlobStore
+from dexy.controller import Controller
+from dexy.tests.utils import controller_args
+from dexy.tests.utils import tempdir
+import errno
+import json
+import os
+import stat
+
+def test_identical_outputs_share_a_blob():
+    with tempdir():
+        with open(".dexy", "w") as f:
+            json.dump({"*.png" : {}, "a.png|dexy" : {}, "*.txt" : {}}, f)
+        for name in ["a.png", "b.png"]:
+            with open(name, "wb") as f:
+                f.write("\x89PNG same bytes")
+        for name in ["c.txt", "d.txt"]:
+            with open(name, "w") as f:
+                f.write("same text")
+
+        c = Controller(controller_args({'silent' : True, 'globals' : {}}))
+        c.run()
+
+        pngs = [a.filepath() for doc in c.docs for a in doc.artifacts if a.ext == ".png"]
+        assert len(set(pngs)) == 4
+        assert len(set(os.stat(p).st_ino for p in pngs)) == 1
+        for p in pngs:
+            with open(p, "rb") as f:
+                assert f.read() == "\x89PNG same bytes"
+
+        # Source files are copied into the blob store, not linked to it.
+        assert os.stat("a.png").st_nlink == 1
+        assert os.stat("b.png").st_nlink == 1
+
+        txts = [c.members[k].last_artifact.filepath() for k in ["c.txt", "d.txt"]]
+        assert os.path.samefile(txts[0], txts[1])
+
+        store = BlobStore("artifacts")
+        assert sorted(os.listdir(store.blobs_dir)) == sorted(set(
+            c.members[k].last_artifact.compute_file_hash(c.members[k].last_artifact.filepath())
+            for k in ["a.png", "c.txt"]))
+        assert store.stats()['links'] == 6
+
+        # Removing all the files linked to a blob leaves it unreferenced.
+        for p in pngs[:-1]:
+            assert store.remove(p) is None
+        h = store.remove(pngs[-1])
+        assert store.unreferenced_blobs() == [h]
+        assert store.remove_blob(h) == len("\x89PNG same bytes")
+        assert store.unreferenced_blobs() == []
+
+def test_copy_without_hard_links_copies_once():
+    def no_link(src, dst):
+        raise OSError(errno.EPERM, "Operation not permitted")
+
+    with tempdir():
+        os.mkdir("artifacts")
+        with open("src.png", "wb") as f:
+            f.write("\x89PNG")
+
+        store = BlobStore("artifacts")
+        link = os.link
+        os.link = no_link
+        try:
+            store.copy("src.png", "artifacts/abc.png", "123")
+        finally:
+            os.link = link
+
+        with open("artifacts/abc.png", "rb") as f:
+            assert f.read() == "\x89PNG"
+        assert os.listdir(store.blobs_dir) == []
+        assert not store.pending
+
+def test_virtual_artifacts_are_not_linked():
+    with tempdir():
+        with open(".dexy", "w") as f:
+            json.dump({"@x.csv" : {"contents" : "placeholder"}, "@y.csv" : {"contents" : "placeholder"}, "a.txt" : {}, "b.txt" : {}}, f)
+        for name in ["a.txt", "b.txt"]:
+            with open(name, "w") as f:
+                f.write("same text")
+
+        c = Controller(controller_args({'silent' : True, 'globals' : {}}))
+        c.run()
+
+        x = c.members['x.csv'].last_artifact.filepath()
+        y = c.members['y.csv'].last_artifact.filepath()
+        assert not os.path.samefile(x, y)
+        assert os.stat(x).st_nlink == 1
+
+        # Files which are linked to a blob can't be written in place.
+        a = c.members['a.txt'].last_artifact.filepath()
+        assert os.stat(a).st_nlink > 1
+        assert not os.stat(a).st_mode & (stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH)
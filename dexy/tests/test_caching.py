@@ -1,5 +1,6 @@
 from dexy.tests.utils import run_dexy_without_tempdir
 from dexy.tests.utils import tempdir
+import os
 
 BASIC_CONFIG = {
     "." : {
@@ -48,3 +49,41 @@ def test_inputs():
         for doc in run_dexy_without_tempdir(CONFIG_WITH_INPUT_2):
             doc.run()
             assert doc.artifacts[-1].source == 'cache'
+
+STAT_INDEX_CONFIG = {
+    "." : {
+        "example.txt|jinja" : {}
+    }
+}
+
+def write_old_file(filename, contents, age=100):
+    with open(filename, "w") as f:
+        f.write(contents)
+    t = os.path.getmtime(filename) - age
+    os.utime(filename, (t, t))
+
+def test_unchanged_source_is_not_read():
+    with tempdir():
+        write_old_file("example.txt", "1 + 1 = {{ 1 + 1 }}")
+
+        for doc in run_dexy_without_tempdir(STAT_INDEX_CONFIG):
+            doc.run()
+            assert not doc.artifacts[0].deferred_source
+            assert doc.artifacts[-1].source == 'run'
+            hashstrings = [a.hashstring for a in doc.artifacts]
+
+        for doc in run_dexy_without_tempdir(STAT_INDEX_CONFIG):
+            assert doc.artifacts[0].deferred_source
+            doc.run()
+            assert doc.artifacts[0].deferred_source
+            assert doc.artifacts[-1].source == 'cache'
+            assert [a.hashstring for a in doc.artifacts] == hashstrings
+            assert doc.artifacts[-1].output() == "1 + 1 = 2"
+
+        write_old_file("example.txt", "2 + 2 = {{ 2 + 2 }}", 50)
+
+        for doc in run_dexy_without_tempdir(STAT_INDEX_CONFIG):
+            assert not doc.artifacts[0].deferred_source
+            doc.run()
+            assert doc.artifacts[-1].source == 'run'
+            assert doc.artifacts[-1].output() == "2 + 2 = 4"
@@ -134,7 +134,7 @@ def test_dexy_command_with_data():
         assert os.path.exists(db.filename)
         for row in db.references_for_batch_id():
             h = row['hashstring']
-            assert os.path.exists("artifacts/%s-output.json" % h)
+            assert os.path.exists("artifacts/%s-sections.json" % h)
             assert os.path.exists("artifacts/%s-meta.json" % h)
 
         # Test database.
@@ -166,6 +166,57 @@ def test_caching():
         refs = db.references_for_batch_id()
         assert refs[1]['source'] == 'run'
 
+def test_affected_reports_are_complete():
+    with tempdir():
+        with open(".dexy", "w") as f:
+            f.write('{ "*.txt|dexy" : {} }')
+        for name in ["a.txt", "b.txt"]:
+            with open(name, "w") as f:
+                f.write(name)
+        setup_command()
+        with divert_stdout():
+            dexy_command()
+
+            with open("a.txt", "w") as f:
+                f.write("changed")
+            # Source artifacts are identified by mtime, which may not have
+            # changed within the same second.
+            os.utime("a.txt", (1000000000, 1000000000))
+            dexy_command(affected="a.txt")
+
+        db = dexy.utils.get_db()
+        keys = sorted(set(row['key'] for row in db.references_for_batch_id()))
+        assert keys == ["a.txt", "a.txt|dexy", "b.txt", "b.txt|dexy"]
+        outputs = sorted(f for f in os.listdir("output-long") if f.endswith(".txt"))
+        assert outputs == ["a.txt-dexy.txt", "b.txt-dexy.txt"]
+        with open("output-long/a.txt-dexy.txt", "r") as f:
+            assert f.read() == "changed"
+
+def test_affected_after_partial_batch():
+    with tempdir():
+        with open(".dexy", "w") as f:
+            f.write('{ "*.txt|dexy" : {} }')
+        for name in ["a.txt", "b.txt", "c.txt"]:
+            with open(name, "w") as f:
+                f.write(name)
+        setup_command()
+        with divert_stdout():
+            dexy_command()
+            # This batch only has c.txt, so b.txt is carried forward from the
+            # first one.
+            dexy_command(run="c.txt")
+
+            with open("a.txt", "w") as f:
+                f.write("changed")
+            os.utime("a.txt", (1000000000, 1000000000))
+            dexy_command(affected="a.txt")
+
+        db = dexy.utils.get_db()
+        keys = sorted(set(row['key'] for row in db.references_for_batch_id()))
+        assert keys == ["a.txt", "a.txt|dexy", "b.txt", "b.txt|dexy", "c.txt", "c.txt|dexy"]
+        outputs = sorted(f for f in os.listdir("output-long") if f.endswith(".txt"))
+        assert outputs == ["a.txt-dexy.txt", "b.txt-dexy.txt", "c.txt-dexy.txt"]
+
 def test_commands_filters():
     with divert_stdout() as stdout:
         filters_command()
@@ -193,3 +244,54 @@ def test_commands_filters_source():
 
     assert len(with_color) > len(without_color)
     # TODO find a way to strip out ansi color codes and assert that text is equal?
+
+JOBS_CONFIG = """
+{
+   "@abc.txt|dexy" : { "contents" : "abc" },
+   "@def.txt|dexy" : { "contents" : "def" },
+   "@ghi.txt|dexy" : { "contents" : "ghi" },
+   "@index.txt|jinja" : {
+       "allinputs" : true,
+       "contents" : "{{ d['abc.txt|dexy'] }} {{ d['def.txt|dexy'] }} {{ d['ghi.txt|dexy'] }}"
+    }
+}"""
+
+def test_dexy_command_with_jobs():
+    with tempdir():
+        with open(".dexy", "w") as f:
+            f.write(JOBS_CONFIG)
+        setup_command()
+        dexy_command(jobs=3)
+
+        db = dexy.utils.get_db()
+        refs = db.references_for_batch_id()
+        assert len(refs) == 8
+        assert all(row['source'] in ('run', None) for row in refs)
+
+        batch_info = dexy.utils.load_batch_info(1)
+        assert len(batch_info['docs']) == 4
+        artifacts = batch_info['docs']['index.txt|jinja']['artifacts']
+        with open("artifacts/%s.txt" % artifacts[-1][0], "r") as f:
+            assert f.read() == "abc def ghi"
+
+        dexy_command(jobs=3)
+        db = dexy.utils.get_db()
+        refs = db.references_for_batch_id()
+        assert [row['source'] for row in refs if row['is_last'] == 'True'] == ['cache'] * 4
+
+def test_dexy_command_with_levels_schedule():
+    with tempdir():
+        with open(".dexy", "w") as f:
+            f.write(JOBS_CONFIG)
+        setup_command()
+        dexy_command(jobs=2, schedule='levels')
+
+        batch_info = dexy.utils.load_batch_info(1)
+        timing_keys = [k for k, t in batch_info['timing']]
+        assert "run-level-1" in timing_keys
+        assert "run-level-2" in timing_keys
+        assert not "run-level-3" in timing_keys
+
+        artifacts = batch_info['docs']['index.txt|jinja']['artifacts']
+        with open("artifacts/%s.txt" % artifacts[-1][0], "r") as f:
+            assert f.read() == "abc def ghi"
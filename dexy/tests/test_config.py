@@ -65,3 +65,30 @@ def test_config_applies_in_subdirectory():
         assert c.config['./abc'].has_key("*.txt")
 
 
+
+def test_config_files_parsed_once():
+    with tempdir():
+        with open(".dexy", "wb") as f:
+            json.dump({"*.txt" : {}, "@virtual.txt" : {}, "$globals" : {"a" : 1}}, f)
+
+        os.makedirs("abc/def/ghi")
+        with open("abc/.dexy", "wb") as f:
+            json.dump({"*.py" : {}, "$globals" : {"b" : 2}}, f)
+        with open("abc/def/.dexy", "wb") as f:
+            json.dump({"$reset" : {}, "*.md" : {}}, f)
+
+        c = Controller(controller_args())
+        c.load_config()
+
+        assert c.config_resolver.parse_count == 3
+        assert c.config['.'].has_key("@virtual.txt")
+        assert not c.config['./abc'].has_key("@virtual.txt")
+        assert c.config['./abc'].has_key("*.txt")
+        assert c.config['./abc']['$globals'] == {"a" : 1, "b" : 2}
+        assert not c.config['./abc/def'].has_key("*.txt")
+        assert c.config['./abc/def/ghi'].has_key("*.md")
+        assert c.config['./abc/def/ghi']['$globals'] == {"a" : 1, "b" : 2}
+
+        # each directory has its own copy
+        c.config['./abc']['*.txt']['x'] = 1
+        assert not c.config['.']['*.txt'].has_key('x')
@@ -3,12 +3,14 @@ from dexy.commands import UserFeedback
 from dexy.constants import NullHandler
 from dexy.controller import Controller
 from dexy.document import Document
+from dexy.tests.utils import controller_args
 from dexy.tests.utils import tempdir
 from dexy.tests.utils import divert_stdout
 from modargs import args as modargs
 import dexy.commands
 import dexy.database
 import dexy.filters.python_filters
+import json
 import os
 
 SIMPLE_PY_CONFIG = {
@@ -84,6 +86,7 @@ def test_docs_with_no_filters():
         assert isinstance(c.members["hello.txt"], Document)
         assert sorted(c.batch_info().keys()) == [
                 "args",
+                "artifact_cache",
                 "config",
                 "docs",
                 "elapsed",
@@ -113,3 +116,90 @@ def test_circular_dependencies():
         assert "def depends on abc" in stdout_text
         assert "ghi depends on def" in stdout_text
 
+
+def test_plan_cache():
+    with tempdir():
+        with open(".dexy", "w") as f:
+            json.dump({"*.txt" : {}, "*.md|jinja" : { "inputs" : ["*.txt"] }}, f)
+        open("a.txt", "w").close()
+        open("b.md", "w").close()
+
+        def plan(additional_args={}):
+            args = controller_args({'silent' : True, 'dryrun' : True, 'globals' : {}})
+            args.update(additional_args)
+            c = Controller(args)
+            c.run()
+            return c
+
+        c = plan()
+        assert not dict(c.timing).has_key("load-plan")
+
+        c = plan()
+        assert dict(c.timing).has_key("load-plan")
+        assert [doc.key() for doc in c.docs] == ["a.txt", "b.md|jinja"]
+        assert c.members["b.md|jinja"].inputs == [c.members["a.txt"]]
+        assert c.members["b.md|jinja"].args['inputs'] == ["*.txt"]
+
+        c = plan({'noplancache' : True})
+        assert not dict(c.timing).has_key("load-plan")
+
+        # A new file matching a glob means planning again.
+        open("c.txt", "w").close()
+        c = plan()
+        assert not dict(c.timing).has_key("load-plan")
+        assert len(c.members["b.md|jinja"].inputs) == 2
+
+        # So does a changed config file.
+        with open(".dexy", "w") as f:
+            json.dump({"*.txt" : {}}, f)
+        c = plan()
+        assert not dict(c.timing).has_key("load-plan")
+        assert sorted(doc.key() for doc in c.docs) == ["a.txt", "c.txt"]
+
+        c = plan()
+        assert dict(c.timing).has_key("load-plan")
+
+def test_affected():
+    with tempdir():
+        config = {"*.txt" : {}, "a.md|jinja" : { "inputs" : ["a.txt"] }, "b.md|jinja" : { "inputs" : ["b.txt"] }}
+        with open(".dexy", "w") as f:
+            json.dump(config, f)
+        for filename in ["a.txt", "b.txt", "a.md", "b.md"]:
+            with open(filename, "w") as f:
+                f.write(filename)
+            # Files modified very recently are never recorded in the stat index.
+            os.utime(filename, (1000000000, 1000000000))
+
+        def run(affected, dryrun=False):
+            args = controller_args({'silent' : True, 'dryrun' : dryrun, 'globals' : {}, 'affected' : affected})
+            c = Controller(args)
+            c.run()
+            return c
+
+        c = run("a.txt", True)
+        assert [doc.key() for doc in c.docs] == ["a.txt", "a.md|jinja"]
+        assert c.skipped_docs == 2
+
+        # Unaffected inputs of affected documents are still run.
+        c = run("./b.md", True)
+        assert [doc.key() for doc in c.docs] == ["b.txt", "b.md|jinja"]
+
+        # With no paths, every document whose source file changed since the
+        # last run is affected, which is all of them the first time.
+        c = run(True)
+        assert len(c.docs) == 4
+
+        c = run(True)
+        assert c.docs == []
+        assert c.skipped_docs == 4
+
+        os.utime("b.txt", (1000000100, 1000000100))
+        c = run(True)
+        assert [doc.key() for doc in c.docs] == ["b.txt", "b.md|jinja"]
+
+        # So is every document which is new or configured differently.
+        config["b.md|jinja"]["inputs"] = ["a.txt"]
+        with open(".dexy", "w") as f:
+            json.dump(config, f)
+        c = run(True)
+        assert [doc.key() for doc in c.docs] == ["a.txt", "b.md|jinja"]
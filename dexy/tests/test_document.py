@@ -1,5 +1,7 @@
 from dexy.dexy_filter import DexyFilter
 from dexy.document import Document
+from dexy.document import InputResolver
+from ordereddict import OrderedDict
 import dexy.filters.pygments_filters
 import dexy.introspect
 
@@ -24,3 +26,25 @@ def test_document_set_name_and_filters():
     assert doc.filters == ['abc', 'def', 'xyz']
 
     assert doc.key() == "data/test.py|abc|def|xyz"
+
+def test_input_resolver():
+    members = OrderedDict()
+    for name in ["index.md", "abc.txt", "sub/def.txt", "sub/index.md", "other/ghi.py"]:
+        doc = Document()
+        doc.set_name_and_filters(name)
+        members[doc.key()] = doc
+
+    resolver = InputResolver(members)
+
+    index = members["index.md"]
+    index.input_args = ["*.txt"]
+    assert [d.key() for d in resolver.inputs_for(index)] == ["abc.txt", "sub/def.txt"]
+
+    sub_index = members["sub/index.md"]
+    sub_index.input_args = ["abc.txt", "*.py"]
+    assert [d.key() for d in resolver.inputs_for(sub_index)] == ["abc.txt"]
+
+    sub_index.input_args = []
+    sub_index.use_all_inputs = True
+    assert [d.key() for d in resolver.inputs_for(sub_index)] == ["index.md", "abc.txt", "sub/def.txt", "other/ghi.py"]
+    assert [d.key() for d in resolver.inputs_for(sub_index, True)] == ["index.md", "abc.txt", "sub/def.txt"]
@@ -0,0 +1,73 @@
+from dexy.controller import Controller
+from dexy.file_index import FileIndex
+from dexy.tests.utils import controller_args
+from dexy.tests.utils import tempdir
+import dexy.file_index
+import glob
+import os
+
+PATTERNS = ["*", "*.txt", ".*", "a.txt", ".hidden", "missing.txt", "[ab].txt",
+        "sub", "sub/*.py", "sub/c.py", "sub/", "nodir/*.txt"]
+
+def make_files():
+    os.makedirs("sub/deeper")
+    for f in ["a.txt", "b.txt", "c.md", ".hidden", "sub/c.py", "sub/d.py", "sub/.e.py"]:
+        open(f, "w").close()
+
+def test_glob_matches_glob_module():
+    with tempdir():
+        make_files()
+
+        walked = FileIndex()
+        for dirpath, dirnames, filenames in os.walk("."):
+            walked.add_dir(dirpath, dirnames, filenames)
+
+        for index in (walked, FileIndex()):
+            for pattern in PATTERNS:
+                assert index.glob(pattern) == sorted(glob.glob(pattern)), pattern
+            assert index.isdir("sub")
+            assert index.isdir("sub/deeper")
+            assert not index.isdir("a.txt")
+
+        assert walked.list_count == 1 # only for nodir, which doesn't exist
+
+def test_controller_lists_each_dir_once():
+    with tempdir():
+        make_files()
+        with open(".dexy", "w") as f:
+            f.write('{"*.txt" : {}, "*.md" : { "inputs" : ["*.txt"] }}')
+        with open("sub/.dexy", "w") as f:
+            f.write('{"*.py" : { "ifinput" : "%.txt" }, "c.py" : {}}')
+
+        c = Controller(controller_args({'silent' : True, 'globals' : {}}))
+        c.load_config()
+        c.process_config()
+
+        assert sorted(c.members.keys()) == ["a.txt", "b.txt", "c.md", "sub/c.py"]
+        assert c.file_index.list_count == 0
+
+def walked_dirs(exclude_regex=None):
+    walker = dexy.file_index.walk_project(".", ["logs"], [".git"], exclude_regex)
+    return [(dirpath, process_dir) for dirpath, dirnames, filenames, process_dir in walker]
+
+def test_walk_project():
+    with tempdir():
+        for d in ["a/b", "a/.git/x", "logs/x", "c/logs", "skip1", "skip2", "quiet/inner"]:
+            os.makedirs(d)
+        open("quiet/.nodexy", "w").close()
+        os.symlink("a", "link")
+
+        use_scandir = dexy.file_index.USE_SCANDIR
+        try:
+            for dexy.file_index.USE_SCANDIR in set([use_scandir, False]):
+                assert walked_dirs() == [
+                        (".", True), ("./a", True), ("./a/b", True),
+                        ("./c", True), ("./c/logs", True), ("./quiet", False),
+                        ("./skip1", True), ("./skip2", True)]
+
+                regex = dexy.file_index.exclusion_regex(["skip", "^b$"])
+                assert walked_dirs(regex) == [
+                        (".", True), ("./a", True), ("./c", True),
+                        ("./c/logs", True), ("./quiet", False)]
+        finally:
+            dexy.file_index.USE_SCANDIR = use_scandir
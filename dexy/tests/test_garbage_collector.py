@@ -0,0 +1,70 @@
+from dexy.controller import Controller
+from dexy.garbage_collector import GarbageCollector
+from dexy.tests.utils import controller_args
+from dexy.tests.utils import tempdir
+import dexy.utils
+import json
+import os
+
+def run_batch(contents, hashfunction="md5"):
+    with open("a.md", "w") as f:
+        f.write(contents)
+    c = Controller(controller_args({'silent' : True, 'globals' : {}, 'hashfunction' : hashfunction}))
+    c.run()
+    return c
+
+def test_garbage_collector():
+    with tempdir():
+        with open(".dexy", "w") as f:
+            json.dump({"a.md|jinja" : {}, "b.png" : {}}, f)
+        with open("b.png", "wb") as f:
+            f.write("\x89PNG")
+
+        first = run_batch("first")
+        os.mkdir(os.path.join("artifacts", first.members['a.md|jinja'].last_artifact.hashstring))
+        second = run_batch("second")
+        old = first.members['a.md|jinja'].last_artifact
+        new = second.members['a.md|jinja'].last_artifact
+        png = second.members['b.png'].last_artifact
+
+        db = dexy.utils.get_db(logsdir="logs")
+
+        # Keeping 2 batches keeps everything.
+        result = GarbageCollector(db, "artifacts", 2).collect()
+        assert result['removed'] == 0
+        assert os.path.exists(old.filepath())
+
+        # A budget bigger than the directory keeps everything.
+        result = GarbageCollector(db, "artifacts", 1, 1024 * 1024).collect()
+        assert result['removed'] == 0
+        assert result['kept_unreachable'] > 0
+
+        result = GarbageCollector(db, "artifacts", 1).collect()
+        assert result['removed'] > 0
+        assert result['kept_unreachable'] == 0
+        assert result['bytes_reclaimed'] > 0
+        assert result['bytes_after'] == result['bytes_before'] - result['bytes_reclaimed']
+        for filepath in [old.filepath(), old.meta_filepath(), old.cached_output_filepath(), old.temp_dir()]:
+            assert not os.path.exists(filepath)
+        for filepath in [new.filepath(), new.meta_filepath(), png.filepath()]:
+            assert os.path.exists(filepath)
+
+def test_garbage_collector_after_hashfunction_change():
+    with tempdir():
+        with open(".dexy", "w") as f:
+            json.dump({"a.md|jinja" : {}}, f)
+
+        first = run_batch("first", "md5")
+        second = run_batch("second", "xxh64")
+        old = first.members['a.md|jinja'].last_artifact
+        new = second.members['a.md|jinja'].last_artifact
+        assert len(old.hashstring) != len(new.hashstring)
+
+        db = dexy.utils.get_db(logsdir="logs")
+        result = GarbageCollector(db, "artifacts", 1).collect()
+        assert result['removed'] > 0
+        assert result['kept_unreachable'] == 0
+        for filepath in [old.filepath(), old.meta_filepath()]:
+            assert not os.path.exists(filepath)
+        for filepath in [new.filepath(), new.meta_filepath()]:
+            assert os.path.exists(filepath)
@@ -0,0 +1,59 @@
+from dexy.commands import UserFeedback
+from dexy.controller import Controller
+from dexy.tests.utils import controller_args
+from dexy.tests.utils import tempdir
+import dexy.hashing
+import os
+
+XXH64_VECTORS = [
+    ("", "ef46db3751d8e999"),
+    ("a", "d24ec4f1a98c6e5b"),
+    ("abc", "44bc2cf5ad770999")
+]
+
+def test_pure_python_xxh64():
+    for text, digest in XXH64_VECTORS:
+        h = dexy.hashing.PurePythonXXH64()
+        h.update(text)
+        assert h.hexdigest() == digest
+
+def test_pure_python_xxh64_matches_xxhash():
+    if not dexy.hashing.USE_XXHASH:
+        return
+
+    data = os.urandom(1000)
+    for size in [0, 3, 31, 32, 33, 100, 1000]:
+        h = dexy.hashing.PurePythonXXH64()
+        for i in range(0, size, 7):
+            h.update(data[i:min(i + 7, size)])
+        assert h.hexdigest() == dexy.hashing.xxhash.xxh64(data[:size]).hexdigest()
+
+def test_checksum_hash_updates():
+    h = dexy.hashing.new('crc32')
+    h.update("hello ")
+    h.update("world")
+    g = dexy.hashing.new('crc32')
+    g.update("hello world")
+    assert h.hexdigest() == g.hexdigest()
+
+def test_unknown_hash_function():
+    try:
+        dexy.hashing.new('nonesuch')
+        assert False, "should raise UserFeedback"
+    except UserFeedback as e:
+        assert "xxh64" in e.message
+
+def test_hashfunction_from_globals():
+    with tempdir():
+        c = Controller(controller_args({'silent' : True}))
+        c.config = { "." : { "$globals" : { "hashfunction" : "xxh64" } } }
+        assert c.project_hashfunction() == "xxh64"
+
+        c.args['hashfunction'] = "sha1"
+        assert c.project_hashfunction() == "sha1"
+
+def test_hashfunction_default():
+    with tempdir():
+        c = Controller(controller_args({'silent' : True}))
+        c.config = { "." : {} }
+        assert c.project_hashfunction() == "md5"
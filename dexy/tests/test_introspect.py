@@ -1,8 +1,10 @@
 from dexy.artifact import Artifact
 from dexy.dexy_filter import DexyFilter
 from dexy.reporter import Reporter
+from dexy.tests.utils import tempdir
 import dexy.introspect
 import inspect
+import os
 
 def test_list_artifact_classes():
     artifact_classes = dexy.introspect.artifact_classes()
@@ -31,3 +33,73 @@ def test_list_reports_dirs():
     for d in reports_dirs:
         assert isinstance(d, str)
 
+def test_reports_dirs_match_imported_reporters():
+    imported = set(r.REPORTS_DIR for r in dexy.introspect.reporters().values())
+    expected = set(d for d in imported if d and not d.startswith("logs/"))
+    assert set(dexy.introspect.reports_dirs()) == expected
+
+def test_reports_dirs_of_project_reporters():
+    with tempdir():
+        os.mkdir("reporters")
+        with open("reporters/custom_reporter.py", "w") as f:
+            f.write("""
+from dexy.reporter import Reporter
+from reporters.output_reporter import OutputReporter
+
+class Helper(object):
+    REPORTS_DIR = "not-a-report"
+
+class CustomReporter(Reporter):
+    REPORTS_DIR = "custom"
+
+class SubReporter(CustomReporter):
+    pass
+
+class MoreOutputReporter(OutputReporter):
+    pass
+""")
+        dirs = dexy.introspect.reports_dirs()
+        assert "custom" in dirs
+        assert not "not-a-report" in dirs
+
+        constants = dexy.introspect.reporter_class_constants("reporters/custom_reporter.py", "REPORTS_DIR")
+        classes = dict((k, [v]) for k, v in constants.iteritems())
+        assert dexy.introspect.resolve_reporter_constant("SubReporter", classes) == (True, "custom")
+        assert dexy.introspect.resolve_reporter_constant("Helper", classes) == (False, "not-a-report")
+
+        # OutputReporter is defined in a module which wasn't read.
+        assert dexy.introspect.resolve_reporter_constant("MoreOutputReporter", classes) is None
+        classes["OutputReporter"] = [(["Reporter"], "output")]
+        assert dexy.introspect.resolve_reporter_constant("MoreOutputReporter", classes) == (True, "output")
+
+        classes["CustomReporter"] = [(["Reporter"], dexy.introspect.NOT_LITERAL)]
+        assert dexy.introspect.resolve_reporter_constant("SubReporter", classes) is None
+
+
+def test_filters_manifest():
+    with tempdir():
+        os.mkdir("logs")
+        filters = dexy.introspect.filters(manifest_dir="logs")
+        assert os.path.exists(os.path.join("logs", dexy.introspect.FILTERS_MANIFEST_FILENAME))
+
+        cached = dexy.introspect.filters(manifest_dir="logs")
+        assert sorted(cached.keys()) == sorted(filters.keys())
+        assert len(cached.classes) == 0
+
+        assert cached['pyg'] == filters['pyg']
+        assert cached.classes.keys() == ['pyg']
+        assert dexy.introspect.get_filter_by_name("PygmentsFilter", cached) == filters['pyg']
+
+        key = dexy.introspect.filters_manifest_key()
+        assert dexy.introspect.load_filters_manifest("logs", key) is not None
+        assert dexy.introspect.load_filters_manifest("logs", "different key") is None
+
+def test_filters_manifest_retries_unavailable_modules():
+    with tempdir():
+        os.mkdir("logs")
+        key = dexy.introspect.filters_manifest_key()
+        dexy.introspect.save_filters_manifest("logs", key, dexy.introspect.FilterRegistry(), ["no_such_module"])
+        assert dexy.introspect.load_filters_manifest("logs", key) is not None
+
+        dexy.introspect.save_filters_manifest("logs", key, dexy.introspect.FilterRegistry(), ["json"])
+        assert dexy.introspect.load_filters_manifest("logs", key) is None
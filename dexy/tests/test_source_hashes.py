@@ -0,0 +1,40 @@
+from dexy.artifact import Artifact
+from dexy.artifacts.file_system_json_artifact import FileSystemJsonArtifact
+from dexy.source_hashes import SourceHashCache
+from dexy.tests.utils import tempdir
+import hashlib
+import inspect
+import os
+
+def md5(text):
+    md5.calls += 1
+    return hashlib.md5(text).hexdigest()
+
+def test_source_hash_cache():
+    classes = [FileSystemJsonArtifact, Artifact]
+    expected = hashlib.md5(inspect.getsource(FileSystemJsonArtifact) + inspect.getsource(Artifact)).hexdigest()
+
+    with tempdir():
+        os.mkdir("logs")
+        md5.calls = 0
+
+        cache = SourceHashCache("logs")
+        assert cache.source_hash(classes, 'md5', md5) == expected
+        assert cache.source_hash(classes, 'md5', md5) == expected
+        assert md5.calls == 1
+        cache.persist()
+
+        cache = SourceHashCache("logs")
+        assert cache.source_hash(classes, 'md5', md5) == expected
+        assert md5.calls == 1
+
+        # Hashes are kept separately for each hash function.
+        cache.source_hash(classes, 'sha1', md5)
+        assert md5.calls == 2
+
+        # A changed signature means hashing again.
+        key = [k for k in cache.entries if k.startswith("md5 ")][0]
+        cache.entries[key]['files'][0][1] -= 1
+        cache.memo = {}
+        assert cache.source_hash(classes, 'md5', md5) == expected
+        assert md5.calls == 3
@@ -1,5 +1,8 @@
 from dexy.artifact import Artifact
 from dexy.databases.sqlite_database import SqliteDatabase
+from dexy.tests.utils import tempdir
+import json
+import sqlite3
 
 def test_create_table():
     db = SqliteDatabase(dbfile=None)
@@ -46,6 +49,7 @@ def test_append_and_update_artifacts():
 
     db = SqliteDatabase(dbfile=None)
     db.append_artifacts([a1, a2])
+    db.flush()
 
     assert len(db.conn.execute("select * from artifacts").fetchall()) == 2
     assert len(db.conn.execute("select * from artifacts where id = ?", (a1.unique_key(),)).fetchall()) == 1
@@ -55,4 +59,92 @@ def test_append_and_update_artifacts():
     a1.elapsed = 10
 
     db.update_artifact(a1)
+    db.flush()
     assert db.conn.execute("select elapsed from artifacts where id = ?", (a1.unique_key(),)).fetchall()[0][0] == 10
+
+def test_buffered_rows():
+    a1 = Artifact()
+    a1.key = "abc.txt"
+    a1.batch_id = 1
+    a1.elapsed = 5
+    a1.hashstring = "abcde123"
+
+    db = SqliteDatabase(dbfile=None)
+    db.append_artifact(a1)
+    assert len(db.conn.execute("select * from artifacts").fetchall()) == 0
+
+    a1.elapsed = 10
+    db.update_artifact(a1)
+    assert db.pending_insert_positions.keys() == [a1.unique_key()]
+    assert len(db.pending_updates) == 0
+
+    # reads flush buffered rows first
+    assert db.artifact_row(a1)['elapsed'] == 10
+    assert len(db.pending_inserts) == 0
+
+def test_wal():
+    with tempdir():
+        db = SqliteDatabase(logsdir=None, dbfile="db.sql", wal=True)
+        assert db.conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+def test_indexes():
+    db = SqliteDatabase(dbfile=None)
+    indexes = [r[0] for r in db.conn.execute("select name from sqlite_master where type='index' and tbl_name='artifacts'")]
+    for field in SqliteDatabase.INDEXED_FIELDS:
+        assert "artifacts_%s" % field in indexes
+
+def test_blobs_stored_separately():
+    a1 = Artifact()
+    a1.key = "abc.txt"
+    a1.batch_id = 7
+    a1.hashstring = "abcde123"
+    a1.args['foo'] = 'bar'
+
+    db = SqliteDatabase(dbfile=None)
+    assert db.max_batch_id() == 0
+    db.append_artifact(a1)
+    assert db.max_batch_id() == 7
+
+    assert not 'args' in db.all()[0].keys()
+    assert json.loads(db.artifact_row(a1)['args'])['foo'] == 'bar'
+
+def test_migrate_old_schema():
+    with tempdir():
+        conn = sqlite3.connect("db.sql")
+        conn.execute("create table artifacts (id text primary key, batch_id int, hashstring text, key text, args text)")
+        conn.execute("insert into artifacts values ('1:1:abc.txt', 1, 'abcde123', 'abc.txt', '{}')")
+        conn.commit()
+        conn.close()
+
+        db = SqliteDatabase(logsdir=None, dbfile="db.sql")
+        assert db.table_columns("artifacts") == db.artifact_columns
+        row = db.query_unique_key('1:1:abc.txt')[0]
+        assert row['hashstring'] == 'abcde123'
+        assert row['args'] == '{}'
+        assert db.max_batch_id() == 1
+
+def test_copy_latest_rows():
+    db = SqliteDatabase(dbfile=None)
+    rows = [(1, "a.txt", "a.txt"), (1, "b.md|jinja", "b.md"), (1, "b.md|jinja", "b.md|jinja"), (1, "c.txt", "c.txt"),
+            (2, "c.txt", "c.txt"), (3, "a.txt", "a.txt")]
+    for batch_id, document_key, key in rows:
+        a = Artifact()
+        a.key = key
+        a.document_key = document_key
+        a.batch_id = batch_id
+        a.batch_order = 1
+        a.hashstring = "%s-%s" % (batch_id, key)
+        a.args = {'key' : key}
+        db.append_artifacts([a])
+
+    # Batch 2 only ran c.txt, so b.md|jinja comes from batch 1.
+    db.copy_latest_rows(["a.txt", "b.md|jinja", "c.txt"], 3)
+    assert db.max_batch_id() == 3
+
+    rows = db.references_for_batch_id(3)
+    assert sorted(row['id'] for row in rows) == ["3:a.txt:a.txt", "3:b.md|jinja:b.md", "3:b.md|jinja:b.md|jinja", "3:c.txt:c.txt"]
+    # The row already in batch 3 is kept.
+    assert db.conn.execute("select hashstring from artifacts where id = '3:a.txt:a.txt'").fetchone()[0] == "3-a.txt"
+    assert db.conn.execute("select hashstring from artifacts where id = '3:c.txt:c.txt'").fetchone()[0] == "2-c.txt"
+    args = db.conn.execute("select args from artifact_blobs where id = '3:b.md|jinja:b.md|jinja'").fetchone()[0]
+    assert json.loads(args) == {'key' : 'b.md|jinja'}
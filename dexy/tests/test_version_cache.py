@@ -0,0 +1,88 @@
+from dexy.dexy_filter import DexyFilter
+from dexy.tests.utils import tempdir
+from dexy.version_cache import VersionCache
+import dexy.utils
+import dexy.version_cache
+import os
+import time
+
+class FakeVersionFilter(DexyFilter):
+    ALIASES = ['fakeversion']
+    VERSION_COMMAND = "fakeversion --version"
+
+def test_find_command():
+    path = filter(None, os.environ["PATH"].split(os.pathsep))
+    expected = [os.path.join(d, "sh") for d in path if os.path.exists(os.path.join(d, "sh"))][0]
+    assert dexy.utils.find_command("sh") == expected
+    assert dexy.utils.command_exists("sh")
+    assert not dexy.utils.command_exists("no-such-command-xyz")
+
+def test_path_table_notices_new_commands():
+    with tempdir():
+        os.mkdir("bin")
+        old_path = os.environ["PATH"]
+        os.environ["PATH"] = os.path.abspath("bin") + os.pathsep + old_path
+        try:
+            assert not dexy.utils.command_exists("fakeversion")
+            with open("bin/fakeversion", "w") as f:
+                f.write("#!/bin/sh\n")
+            os.chmod("bin/fakeversion", 0755)
+            # Make sure the directory's mtime changes on coarse file systems.
+            mtime = time.time() + 10
+            os.utime("bin", (mtime, mtime))
+            assert dexy.utils.command_exists("fakeversion")
+        finally:
+            os.environ["PATH"] = old_path
+
+def test_version_cache():
+    with tempdir():
+        os.mkdir("bin")
+        os.mkdir("logs")
+        with open("bin/fakeversion", "w") as f:
+            f.write("#!/bin/sh\necho run >> runs.txt\necho fakeversion 1.0\n")
+        os.chmod("bin/fakeversion", 0755)
+
+        old_path = os.environ["PATH"]
+        os.environ["PATH"] = os.path.abspath("bin") + os.pathsep + old_path
+        try:
+            for i in range(2):
+                DexyFilter.version_cache = VersionCache("logs")
+                assert FakeVersionFilter.version() == "fakeversion 1.0"
+                DexyFilter.version_cache.persist()
+            assert len(open("runs.txt").readlines()) == 1
+
+            # A changed executable is run again.
+            mtime = time.time() - 10
+            os.utime("bin/fakeversion", (mtime, mtime))
+            DexyFilter.version_cache = VersionCache("logs")
+            assert FakeVersionFilter.version() == "fakeversion 1.0"
+            assert len(open("runs.txt").readlines()) == 2
+        finally:
+            os.environ["PATH"] = old_path
+            DexyFilter.version_cache = None
+
+def test_failed_versions_are_not_persisted():
+    with tempdir():
+        os.mkdir("bin")
+        os.mkdir("logs")
+        old_path = os.environ["PATH"]
+        os.environ["PATH"] = os.path.abspath("bin") + os.pathsep + old_path
+        try:
+            DexyFilter.version_cache = VersionCache("logs")
+            assert FakeVersionFilter.version() is False
+            DexyFilter.version_cache.persist()
+            assert not os.path.exists("logs/%s" % dexy.version_cache.VERSION_CACHE_FILENAME)
+
+            # Installing the tool is noticed by the next run in the same
+            # process, as in 'dexy watch'.
+            with open("bin/fakeversion", "w") as f:
+                f.write("#!/bin/sh\necho fakeversion 2.0\n")
+            os.chmod("bin/fakeversion", 0755)
+            mtime = time.time() + 10
+            os.utime("bin", (mtime, mtime))
+            assert FakeVersionFilter.version() is False
+            DexyFilter.version_cache.clear_memos()
+            assert FakeVersionFilter.version() == "fakeversion 2.0"
+        finally:
+            os.environ["PATH"] = old_path
+            DexyFilter.version_cache = None
@@ -0,0 +1,47 @@
+from dexy.tests.utils import controller_args
+from dexy.tests.utils import divert_stdout
+from dexy.tests.utils import tempdir
+from dexy.watcher import Watcher
+import json
+import os
+
+def test_watcher():
+    with tempdir():
+        with open(".dexy", "w") as f:
+            json.dump({"*.txt" : {}, "a.md|jinja" : { "inputs" : ["a.txt"] }, "b.md|jinja" : {}}, f)
+        with open("a.txt", "w") as f:
+            f.write("a")
+        with open("a.md", "w") as f:
+            f.write("{{ d['a.txt'] }}!")
+        with open("b.md", "w") as f:
+            f.write("b")
+
+        watcher = Watcher(controller_args({'silent' : True, 'reports' : "Output"}))
+        with divert_stdout():
+            watcher.build()
+            first = watcher.controller
+            assert watcher.changed_paths() == []
+            assert "a.txt" in watcher.signatures
+
+            with open("a.txt", "w") as f:
+                f.write("aaa")
+            changed = watcher.changed_paths()
+            assert changed == ["a.txt"]
+            watcher.build(changed)
+
+        c = watcher.controller
+        assert c.filter_list is first.filter_list
+        assert c.db is first.db
+        assert [doc.key() for doc in c.docs] == ["a.txt", "a.md|jinja"]
+        assert c.skipped_keys == ["b.md|jinja"]
+
+        # Skipped documents are carried forward, so reports are complete.
+        keys = [row['key'] for row in c.db.references_for_batch_id(c.batch_id)]
+        assert sorted(keys) == ["a.md", "a.md|jinja", "a.txt", "b.md", "b.md|jinja"]
+        with open("output/a.md", "r") as f:
+            assert f.read() == "aaa!"
+        assert os.path.exists("output/b.md")
+
+        # Recreating the output dir changes the project root's mtime, but
+        # not what is in it.
+        assert watcher.changed_paths() == []
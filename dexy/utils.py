@@ -91,8 +91,10 @@ def print_string_diff(str1, str2):
             msg = msg + "\n%5d:  \t \t\t%s %s" % (i, ord(c1), flag)
     return msg
 
-# Based on http://nedbatchelder.com/code/utilities/wh.py
-def command_exists(cmd_name):
+# Lookup tables of the files in the directories on PATH, keyed on PATH and PATHEXT.
+PATH_TABLES = {}
+
+def path_dirs_and_exts():
     path = os.environ["PATH"]
     if ";" in path:
         path = filter(None, path.split(";"))
@@ -107,14 +109,70 @@ def command_exists(cmd_name):
         # Not windows, look for exact command name.
         pathext = [""]
 
-    cmd_found = False
-    for d in path:
-        for e in pathext:
-            filepath = os.path.join(d, cmd_name + e)
-            if os.path.exists(filepath):
-                cmd_found = True
-                break
-    return cmd_found
+    return path, pathext
+
+def dir_mtimes(dirs):
+    mtimes = []
+    for d in dirs:
+        try:
+            mtimes.append(os.stat(d).st_mtime)
+        except os.error:
+            mtimes.append(None)
+    return mtimes
+
+def path_table():
+    """
+    Returns a dict mapping the name of each file in a directory on PATH to the
+    positions of the directories containing it. The directories are listed
+    again only if PATH changes or one of their mtimes does, e.g. because a
+    tool was installed while 'dexy watch' was running.
+    """
+    path, pathext = path_dirs_and_exts()
+    key = (tuple(path), tuple(pathext))
+    mtimes = dir_mtimes(path)
+    if not PATH_TABLES.has_key(key) or PATH_TABLES[key][0] != mtimes:
+        table = {}
+        for i, d in enumerate(path):
+            try:
+                names = os.listdir(d)
+            except os.error:
+                continue
+            for name in names:
+                table.setdefault(os.path.normcase(name), []).append(i)
+        PATH_TABLES[key] = (mtimes, (path, pathext, table))
+    return PATH_TABLES[key][1]
+
+# Based on http://nedbatchelder.com/code/utilities/wh.py
+def find_command(cmd_name):
+    """
+    Returns the path to cmd_name in the first directory on PATH containing
+    it, trying each extension in PATHEXT on windows, or None.
+    """
+    path, pathext, table = path_table()
+
+    if os.sep in cmd_name or (os.altsep and os.altsep in cmd_name):
+        # Not just a file name, so not in the table.
+        for d in path:
+            for e in pathext:
+                filepath = os.path.join(d, cmd_name + e)
+                if os.path.exists(filepath):
+                    return filepath
+        return None
+
+    found = []
+    for j, e in enumerate(pathext):
+        name = os.path.normcase(cmd_name + e)
+        for i in table.get(name, []):
+            found.append((i, j))
+
+    for i, j in sorted(found):
+        filepath = os.path.join(path[i], cmd_name + pathext[j])
+        # Skip broken symlinks, as os.path.exists does.
+        if os.path.exists(filepath):
+            return filepath
+
+def command_exists(cmd_name):
+    return find_command(cmd_name) is not None
 
 #http://code.activestate.com/recipes/148061-one-liner-word-wrap-function/
 def wrap_text(text, width):
@@ -0,0 +1,70 @@
+"""
+Remembers the output of each filter's version command, so that external
+software doesn't have to be run to find out its version until its executable
+changes.
+"""
+import dexy.json_cache
+import dexy.utils
+import os
+
+VERSION_CACHE_FILENAME = "tool-versions.json"
+
+def executable_signature(command):
+    """
+    Returns the resolved path, inode, mtime and size of the executable run by
+    command, or None if it can't be found on the PATH.
+    """
+    filepath = dexy.utils.find_command(command.split()[0])
+    if not filepath:
+        return None
+    filepath = os.path.realpath(filepath)
+    stat_info = os.stat(filepath)
+    return [filepath, stat_info.st_ino, stat_info.st_mtime, stat_info.st_size]
+
+class VersionCache(dexy.json_cache.JsonCache):
+    """
+    Maps version commands to the signature of the executable they run and the
+    version reported. Entries are loaded from and persisted to a JSON file in
+    the logs directory. Versions which couldn't be found are only remembered
+    until clear_memos is called.
+    """
+    def __init__(self, logsdir=None):
+        dexy.json_cache.JsonCache.__init__(self, logsdir, VERSION_CACHE_FILENAME)
+        self.signatures = {}
+        self.unrecorded = {}
+
+    def clear_memos(self):
+        """
+        Forgets the executables found and the versions not recorded, so
+        that tools installed or upgraded since are noticed. Called at the
+        start of each run which reuses the cache.
+        """
+        self.signatures = {}
+        self.unrecorded = {}
+
+    def signature(self, command):
+        if not self.signatures.has_key(command):
+            self.signatures[command] = executable_signature(command)
+        return self.signatures[command]
+
+    def lookup(self, command):
+        """
+        Returns the entry for command, a dict whose 'version' is the version
+        recorded, if its executable hasn't changed since, otherwise None.
+        """
+        if self.unrecorded.has_key(command):
+            return self.unrecorded[command]
+        signature = self.signature(command)
+        if signature and self.entries.has_key(command):
+            entry = self.entries[command]
+            if entry['executable'] == signature and entry['version'] is not False:
+                return entry
+
+    def update(self, command, version):
+        signature = self.signature(command)
+        if signature and version is not False:
+            self.merge({ command : { 'executable' : signature, 'version' : version } })
+        else:
+            # The command failed or its executable couldn't be found, so it
+            # isn't persisted and is run again once the memos are cleared.
+            self.unrecorded[command] = { 'version' : version }
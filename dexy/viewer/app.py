@@ -1,7 +1,9 @@
 from dexy.constants import Constants
 import dexy.introspect
-import web
 import os
+import posixpath
+import urllib
+import web
 
 ARTIFACT_CLASS = dexy.utils.artifact_class()
 
@@ -30,7 +32,7 @@ class raw:
         artifact = ARTIFACT_CLASS.retrieve(row['hashstring'])
 
         if artifact.binary_output:
-            return artifact.binary_data
+            return artifact.output()
         else:
             return artifact.output_text()
 
@@ -76,6 +78,31 @@ class grep:
 
 app = web.application(urls, globals())
 
+class CustomStaticApp(web.httpserver.StaticApp):
+    def translate_path(self, path):
+        return os.path.join(os.path.dirname(os.path.abspath(__file__)), path.lstrip("/"))
+
+class StaticMiddleware:
+    """WSGI middleware for serving static files."""
+    def __init__(self, app, prefix='/static/'):
+        self.app = app
+        self.prefix = prefix
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '')
+        path = self.normpath(path)
+
+        if path.startswith(self.prefix):
+            return CustomStaticApp(environ, start_response)
+        else:
+            return self.app(environ, start_response)
+
+    def normpath(self, path):
+        path2 = posixpath.normpath(urllib.unquote(path))
+        if path.endswith("/"):
+            path2 += "/"
+        return path2
+
 if __name__ == "__main__":
     app.run()
 
@@ -0,0 +1,124 @@
+"""
+Runs dexy again each time the files in a project change, for 'dexy watch'.
+Each run reuses the previous run's controller state, so filters, caches and
+the database don't have to be loaded again, and only the documents affected
+by the changes are run.
+"""
+import copy
+import dexy.commands
+import dexy.plan_cache
+import dexy.stat_index
+import os
+import sys
+import time
+
+def path_signature(path):
+    """
+    Returns the size, mtime, ctime and inode of path, or None if it doesn't
+    exist.
+    """
+    try:
+        return dexy.stat_index.stat_signature(os.stat(path))
+    except os.error:
+        return None
+
+def snapshot(paths):
+    """
+    Returns a dict of the signature of each path and a dict of the listing
+    signature of each path which is a directory.
+    """
+    signatures = {}
+    listings = {}
+    for path in paths:
+        signatures[path] = path_signature(path)
+        if os.path.isdir(path):
+            listings[path] = dexy.plan_cache.current_listing_signature(path)
+    return signatures, listings
+
+class Watcher(object):
+    """
+    Polls the paths which the last run depended on every interval seconds and
+    runs dexy with the given args whenever any of them change.
+    """
+    def __init__(self, args, interval=0.25):
+        self.args = args
+        self.interval = interval
+        self.controller = None
+        self.signatures = {}
+        self.listings = {}
+
+    def changed_paths(self):
+        changed = []
+        for path, signature in self.signatures.iteritems():
+            current = path_signature(path)
+            if current == signature:
+                continue
+            elif current and self.listings.has_key(path) and os.path.isdir(path):
+                # A directory's mtime also changes when a subdirectory is
+                # removed and created again, as reporters do with theirs.
+                if dexy.plan_cache.current_listing_signature(path) == self.listings[path]:
+                    self.signatures[path] = current
+                    continue
+            changed.append(path)
+        return sorted(changed)
+
+    def build(self, changed=None):
+        """
+        Runs dexy and the reports. After the first run, only documents
+        affected by the changed paths are run and the controller carries the
+        others forward from the last batch each of them ran in.
+        """
+        # Take signatures before running, so changes made during the run are
+        # noticed afterwards.
+        before, before_listings = snapshot(self.signatures.keys())
+
+        args = copy.deepcopy(self.args)
+        reports = args['reports']
+        if self.controller:
+            plan_paths = [p for p in changed if self.controller.plan_dirs.has_key(p) or self.controller.plan_config_files.has_key(p)]
+            if plan_paths:
+                # Let the controller compare the old and new plans.
+                args['affected'] = True
+            else:
+                args['affected'] = changed
+
+        start = time.time()
+        try:
+            controller = dexy.commands.run_dexy(args, self.controller)
+        except dexy.commands.UserFeedback as e:
+            if not self.controller:
+                # There is nothing to watch until a run has worked.
+                raise e
+            sys.stderr.write("%s\n" % e.message.rstrip("\n"))
+            self.signatures = before
+            self.listings = before_listings
+            return
+
+        if not args['dryrun']:
+            dexy.commands.reports_command(
+                    reports=reports,
+                    artifactclass=args['artifactclass'],
+                    controller=controller,
+                    hashfunction=controller.args['hashfunction'],
+                    logsdir=args['logsdir']
+                )
+
+        paths = controller.watched_paths()
+        self.signatures, self.listings = snapshot(p for p in paths if not before.has_key(p))
+        for path in paths:
+            if before.has_key(path):
+                self.signatures[path] = before[path]
+                if before_listings.has_key(path):
+                    self.listings[path] = before_listings[path]
+
+        self.controller = controller
+        print "finished in %0.2fs, watching %s paths for changes..." % (time.time() - start, len(self.signatures))
+
+    def run(self):
+        self.build()
+        while True:
+            time.sleep(self.interval)
+            changed = self.changed_paths()
+            if changed:
+                print "changed: %s" % ", ".join(changed)
+                self.build(changed)